@@ -0,0 +1,149 @@
+# answer_cache.py
+"""
+Кэш ответов на анонимные консультации (без данных профиля).
+
+Сначала ищется точное совпадение нормализованного текста вопроса, затем —
+похожий вопрос: текст превращается в вектор хэшированных символьных n-грамм,
+а поиск ведётся косинусной близостью по матрице NumPy. Похожий вопрос
+принимается, только если в нём те же числа и тот же набор слов (с точностью
+до окончаний и порядка): «100 г» и «300 г», «клубнику» и «клубнику и мёд» —
+разные вопросы, хотя по n-граммам почти совпадают. Всё считается
+локально, без сетевых запросов. Размер кэша ограничен, при переполнении
+вытесняется давно не использованная запись.
+"""
+import re
+import zlib
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_non_word = re.compile(r"[^\w\s]+")
+_spaces = re.compile(r"\s+")
+
+# Окончания отбрасываются, если от слова остаётся не меньше трёх букв
+ENDINGS = sorted([
+    "ами", "ями", "ого", "его", "ому", "ему", "ыми", "ими",
+    "ой", "ей", "ий", "ый", "ая", "яя", "ое", "ее", "ые", "ие", "ов", "ев",
+    "ам", "ям", "ах", "ях", "ом", "ем", "ую", "юю",
+    "а", "я", "ы", "и", "у", "ю", "о", "е", "ь"
+], key=len, reverse=True)
+
+
+def normalize_question(text: str) -> str:
+    """Нижний регистр, ё -> е, без знаков препинания и лишних пробелов"""
+    text = text.lower().replace("ё", "е")
+    text = _non_word.sub(" ", text)
+    return _spaces.sub(" ", text).strip()
+
+
+def stem(word: str, max_length: int = None) -> str:
+    """Грубая основа слова: без окончания и (если задано) не длиннее max_length букв"""
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            word = word[:-len(ending)]
+            break
+    return word[:max_length] if max_length else word
+
+
+def question_signature(normalized: str) -> tuple:
+    """Числа вопроса (с повторами) и множество основ его слов"""
+    words = normalized.split()
+    numbers = tuple(sorted(word for word in words if word.isdigit()))
+    return numbers, frozenset(stem(word) for word in words)
+
+
+class AnswerCache:
+
+    def __init__(self, max_entries: int = 10000, dim: int = 256, threshold: float = 0.85, ngram: int = 3):
+        self.max_entries = max_entries
+        self.dim = dim
+        self.threshold = threshold
+        self.ngram = ngram
+        # Память под векторы выделяется сразу: max_entries * dim * 4 байта
+        self._vectors = np.zeros((max_entries, dim), dtype=np.float32)
+        self._last_used = np.zeros(max_entries, dtype=np.int64)
+        self._keys = [None] * max_entries
+        self._answers = [None] * max_entries
+        self._signatures = [None] * max_entries
+        self._slots = {}  # нормализованный вопрос -> номер строки
+        self._size = 0
+        self._clock = 0
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+    def vectorize(self, normalized: str) -> np.ndarray:
+        """Нормированный вектор хэшированных символьных n-грамм (TF с логарифмом)"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        padded = f" {normalized} "
+        for i in range(max(1, len(padded) - self.ngram + 1)):
+            bucket = zlib.crc32(padded[i:i + self.ngram].encode()) % self.dim
+            vector[bucket] += 1.0
+        np.log1p(vector, out=vector)
+        norm = np.linalg.norm(vector)
+        if norm:
+            vector /= norm
+        return vector
+
+    def get(self, question: str):
+        """Возвращает закэшированный ответ на такой же или похожий вопрос либо None"""
+        key = normalize_question(question)
+        if not key:
+            return None
+        slot = self._slots.get(key)
+        if slot is not None:
+            self.exact_hits += 1
+        elif self._size:
+            scores = self._vectors[:self._size] @ self.vectorize(key)
+            signature = question_signature(key)
+            candidates = np.flatnonzero(scores >= self.threshold)
+            # Среди близких по n-граммам — самый близкий с теми же числами и словами
+            for candidate in candidates[np.argsort(-scores[candidates])]:
+                if self._signatures[candidate] == signature:
+                    slot = int(candidate)
+                    break
+            if slot is None:
+                self.misses += 1
+                return None
+            self.similar_hits += 1
+            logger.debug(f"Похожий вопрос в кэше (близость {scores[slot]:.3f})")
+        else:
+            self.misses += 1
+            return None
+        self._touch(slot)
+        return self._answers[slot]
+
+    def put(self, question: str, answer: str) -> None:
+        key = normalize_question(question)
+        if not key or self.max_entries <= 0:
+            return
+        slot = self._slots.get(key)
+        if slot is None:
+            if self._size < self.max_entries:
+                slot = self._size
+                self._size += 1
+            else:
+                slot = int(np.argmin(self._last_used))
+                del self._slots[self._keys[slot]]
+            self._vectors[slot] = self.vectorize(key)
+            self._signatures[slot] = question_signature(key)
+            self._keys[slot] = key
+            self._slots[key] = slot
+        self._answers[slot] = answer
+        self._touch(slot)
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.similar_hits + self.misses
+        return {
+            'entries': self._size,
+            'exact_hits': self.exact_hits,
+            'similar_hits': self.similar_hits,
+            'misses': self.misses,
+            'hit_ratio': (self.exact_hits + self.similar_hits) / lookups if lookups else 0.0
+        }
+
+    def _touch(self, slot: int) -> None:
+        self._clock += 1
+        self._last_used[slot] = self._clock
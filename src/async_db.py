@@ -0,0 +1,128 @@
+# async_db.py
+import os
+import asyncio
+import logging
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import db
+from meal_writer import MealWriter
+
+logger = logging.getLogger(__name__)
+
+# Отдельный пул потоков для работы с SQLite и шифрованием, чтобы
+# синхронные вызовы db.py не блокировали цикл событий бота.
+DB_EXECUTOR_WORKERS = int(os.getenv("DB_EXECUTOR_WORKERS", "4"))
+
+_executor = ThreadPoolExecutor(max_workers=DB_EXECUTOR_WORKERS, thread_name_prefix="db")
+
+# Пакетная запись приёмов пищи: не более MEAL_BATCH_SIZE строк или
+# MEAL_FLUSH_INTERVAL_MS миллисекунд ожидания на одну транзакцию
+MEAL_BATCH_SIZE = int(os.getenv("MEAL_BATCH_SIZE", "100"))
+MEAL_FLUSH_INTERVAL_MS = int(os.getenv("MEAL_FLUSH_INTERVAL_MS", "50"))
+
+
+async def run(func, *args, **kwargs):
+    """Выполняет синхронную функцию работы с БД в пуле потоков"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def add_user(telegram_id: int, name: str, age: str, weight: str,
+                   height: str, activity: str, goal: str, diseases: str, allergies: str) -> bool:
+    """Асинхронная версия db.add_user"""
+    return await run(
+        db.add_user,
+        telegram_id=telegram_id,
+        name=name,
+        age=age,
+        weight=weight,
+        height=height,
+        activity=activity,
+        goal=goal,
+        diseases=diseases,
+        allergies=allergies
+    )
+
+
+async def is_user_registered(telegram_id: int) -> bool:
+    """Асинхронная версия db.is_user_registered"""
+    return await run(db.is_user_registered, telegram_id)
+
+
+async def get_user_data(telegram_id: int) -> dict:
+    """Асинхронная версия db.get_user_data"""
+    return await run(db.get_user_data, telegram_id)
+
+
+async def update_user_fields(telegram_id: int, **fields) -> bool:
+    """Асинхронная версия db.update_user_fields"""
+    return await run(db.update_user_fields, telegram_id, **fields)
+
+
+async def _flush_meals(rows: list) -> list:
+    return await run(db.add_meals_batch, rows)
+
+
+meal_writer = MealWriter(
+    _flush_meals,
+    max_batch=MEAL_BATCH_SIZE,
+    flush_interval=MEAL_FLUSH_INTERVAL_MS / 1000
+)
+
+
+async def add_meal(telegram_id: int, meal: str) -> bool:
+    """Асинхронная версия db.add_meal: запись уходит в общую транзакцию очереди"""
+    return await meal_writer.submit(telegram_id, meal)
+
+
+async def get_meals(telegram_id: int, limit: int = 10) -> list:
+    """Асинхронная версия db.get_meals"""
+    return await run(db.get_meals, telegram_id, limit)
+
+
+async def get_all_users() -> list:
+    """Асинхронная версия db.get_all_users"""
+    return await run(db.get_all_users)
+
+
+async def iter_user_ids(chunk_size: int = 1000):
+    """Асинхронный итератор telegram_id: в памяти держится только одна порция"""
+    after_id = 0
+    while True:
+        rows = await run(db.get_user_ids_chunk, after_id, chunk_size)
+        if not rows:
+            return
+        for _, telegram_id in rows:
+            yield telegram_id
+        after_id = rows[-1][0]
+
+
+async def migrate_profile_format(chunk_size: int = 500, pause: float = 0.1) -> int:
+    """
+    Фоновый перевод старых профилей в формат с одним токеном.
+    Работает порциями с паузами, чтобы не занимать БД надолго.
+    """
+    after_id = 0
+    total = 0
+    while True:
+        try:
+            after_id, migrated = await run(db.migrate_profiles_chunk, after_id, chunk_size)
+        except Exception as e:
+            logger.error(f"Ошибка миграции формата профилей: {e}", exc_info=True)
+            return total
+        if after_id is None:
+            break
+        total += migrated
+        await asyncio.sleep(pause)
+    if total:
+        logger.info(f"Profile format migration finished: {total} rows rewritten")
+    return total
+
+
+async def shutdown() -> None:
+    """Сбрасывает очередь записи, дожидается запросов и закрывает соединения с БД"""
+    await meal_writer.close()
+    _executor.shutdown(wait=True)
+    db.close_connections()
+    logger.info("DB executor stopped")
@@ -0,0 +1,94 @@
+# bench_answer_cache.py
+"""
+Время поиска в кэше ответов (answer_cache.AnswerCache) при большом числе
+закэшированных вопросов.
+
+Кэш заполняется синтетическими вопросами вида «Сколько белка в 150 г
+гречки?» из шаблонов, продуктов и чисел. Затем измеряются запросы четырёх
+видов: точный повтор, тот же вопрос другими словами (попадание по
+n-граммам), вопрос с другим числом (близкий по n-граммам промах) и вопрос
+не из кэша (промах).
+
+Пример:
+    python bench_answer_cache.py --questions 100000 --queries 500
+"""
+import time
+import random
+import argparse
+
+from bench_common import measure_calls, print_header, print_row
+
+TEMPLATES = [
+    ("Сколько {nutrient} в {amount} г {product}?", "В {amount} г {product} сколько {nutrient}?"),
+    ("Можно ли есть {product} на ночь, если съел {amount} г?", "Если съел {amount} г, можно есть {product} на ночь?"),
+    ("Полезно ли {product} при диете на {amount} ккал?", "При диете на {amount} ккал полезно ли {product}?"),
+]
+NUTRIENTS = ["белка", "жиров", "углеводов", "калорий", "клетчатки", "сахара", "кальция", "железа"]
+SYLLABLES = ["ба", "ве", "гри", "до", "ке", "ла", "ми", "но", "пе", "ро", "са", "ту", "фа", "ше"]
+
+
+def make_products(count: int, rng: random.Random) -> list:
+    """Различные «названия продуктов» из слогов"""
+    products = set()
+    while len(products) < count:
+        products.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(3, 4))))
+    return sorted(products)
+
+
+def make_question(rng: random.Random, products: list, rephrased: bool = False, amount: int = None) -> tuple:
+    """Вопрос и его параметры (шаблон, питательное вещество, число, продукт)"""
+    template = rng.randrange(len(TEMPLATES))
+    params = {
+        "nutrient": rng.choice(NUTRIENTS),
+        "amount": amount if amount is not None else rng.randrange(50, 1000, 50),
+        "product": rng.choice(products),
+    }
+    return TEMPLATES[template][rephrased].format(**params), (template, params)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время поиска в кэше ответов")
+    parser.add_argument("--questions", type=int, default=100000, help="вопросов в кэше")
+    parser.add_argument("--products", type=int, default=2000, help="различных продуктов")
+    parser.add_argument("--queries", type=int, default=500, help="запросов каждого вида")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    from answer_cache import AnswerCache
+    rng = random.Random(args.seed)
+    products = make_products(args.products, rng)
+    cache = AnswerCache(max_entries=args.questions)
+
+    started = time.perf_counter()
+    cached = {}
+    while len(cached) < args.questions:
+        question, params = make_question(rng, products)
+        if question not in cached:
+            cached[question] = params
+            cache.put(question, f"Ответ {len(cached)}")
+    print(f"Заполнение: {args.questions} вопросов за {time.perf_counter() - started:.1f} с")
+
+    sample = rng.sample(list(cached.items()), args.queries)
+    rephrased, other_amount = [], []
+    for _, (template, params) in sample:
+        rephrased.append(TEMPLATES[template][1].format(**params))
+        amount = params["amount"] + 25
+        other_amount.append(TEMPLATES[template][0].format(**dict(params, amount=amount)))
+    queries = {
+        "точный повтор": [question for question, _ in sample],
+        "другими словами": rephrased,
+        "другое число (промах)": other_amount,
+        "нет в кэше (промах)": [f"Как приготовить {rng.choice(products)} на пару за {rng.randint(1, 60)} минут?"
+                                for _ in range(args.queries)],
+    }
+
+    print_header(f"AnswerCache.get, {args.questions} вопросов в кэше")
+    for label, questions in queries.items():
+        before = cache.exact_hits + cache.similar_hits
+        samples = measure_calls(cache.get, questions)
+        print_row(label, samples)
+        print(f"{'':<32}попаданий: {cache.exact_hits + cache.similar_hits - before} из {len(questions)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+# bench_common.py
+"""
+Общее для микробенчмарков bench_*.py и нагрузочного теста.
+
+Модули бота читают окружение при импорте, поэтому prepare_env вызывается до
+их импорта: база, журнал и картинки пишутся во временный каталог, а сеть
+не нужна. Результаты печатаются таблицей с перцентилями в миллисекундах.
+"""
+import os
+import time
+import tempfile
+
+
+def prepare_env(prefix: str = "nutribot-bench-") -> str:
+    """Создаёт временный каталог прогона и настраивает окружение; возвращает путь"""
+    workdir = tempfile.mkdtemp(prefix=prefix)
+    os.environ.update({
+        "DB_PATH": os.path.join(workdir, "users.db"),
+        "LOG_FILE": os.path.join(workdir, "bot.log"),
+        "IMAGE_DIR": os.path.join(workdir, "images"),
+        "LLM_WARMUP": "0",
+    })
+    os.environ.setdefault("OPENAI_API_KEY", "bench")
+    if not os.getenv("ENCRYPTION_KEY"):
+        from cryptography.fernet import Fernet
+        os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+    return workdir
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(q / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def measure(func, *args, repeat: int = 1000) -> list:
+    """Время каждого из repeat вызовов func(*args), секунды"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def measure_calls(func, values: list) -> list:
+    """Время вызова func(value) для каждого значения, секунды"""
+    samples = []
+    for value in values:
+        started = time.perf_counter()
+        func(value)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def print_header(title: str) -> None:
+    print(f"\n{title}")
+    print(f"{'вариант':<32}{'кол-во':>8}{'среднее, мс':>13}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+
+
+def print_row(label: str, samples: list) -> None:
+    """Строка таблицы: число замеров, среднее и перцентили"""
+    mean = sum(samples) / len(samples) if samples else 0.0
+    print(f"{label:<32}{len(samples):>8}{mean * 1000:>13.3f}{percentile(samples, 50) * 1000:>10.3f}"
+          f"{percentile(samples, 95) * 1000:>10.3f}{percentile(samples, 99) * 1000:>10.3f}")
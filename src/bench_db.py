@@ -0,0 +1,224 @@
+# bench_db.py
+"""
+Микробенчмарки слоя SQLite (db.py) на временной базе.
+
+Подкоманды:
+  connections — стоимость одного вызова: новое соединение на каждый вызов
+                (как было до пула) против переиспользуемого соединения потока
+                с WAL и прагмами из db.get_connection.
+  meals-index — db.get_meals на большой таблице meals до и после
+                покрывающего индекса (миграция 2).
+  meal-writer — строк в секунду при одновременных записях приёмов пищи:
+                очередь с групповой транзакцией (async_db.add_meal) против
+                отдельной транзакции на строку (db.add_meal в пуле потоков).
+  iter-users  — пиковая память и время обхода всех пользователей: список
+                db.get_all_users против keyset-пагинации db.iter_user_ids.
+  profile-crypto — шифрование и расшифровка профиля: шесть токенов Fernet
+                (по полю, формат 1) против одного токена на профиль (формат 2).
+
+Пример:
+    python bench_db.py connections --calls 5000
+    python bench_db.py meals-index --rows 10000000
+    python bench_db.py meal-writer --rows 20000 --concurrency 200
+    python bench_db.py iter-users --users 1000000
+    python bench_db.py profile-crypto --calls 5000
+"""
+import time
+import asyncio
+import random
+import sqlite3
+import argparse
+import tracemalloc
+
+from bench_common import prepare_env, measure, measure_calls, print_header, print_row
+
+
+def bench_connections(args) -> None:
+    import db
+    db.init_db()
+    db.add_user(1, "Анна", "30", "60", "165", "3️⃣ Средний", "Похудение", "нет", "нет")
+    # Журнал WAL уже включён init_db; для варианта «до» нужен режим по умолчанию
+    db.close_connections()
+    conn = sqlite3.connect(db.DB_NAME)
+    conn.execute("PRAGMA journal_mode=DELETE")
+    conn.close()
+
+    def read_new_connection():
+        conn = sqlite3.connect(db.DB_NAME)
+        try:
+            conn.execute(db.SQL_USER_EXISTS, (1,)).fetchone()
+        finally:
+            conn.close()
+
+    def write_new_connection():
+        conn = sqlite3.connect(db.DB_NAME)
+        try:
+            with conn:
+                conn.execute(db.SQL_INSERT_MEAL, (1, "Каша"))
+        finally:
+            conn.close()
+
+    def read_pooled():
+        db.get_connection().execute(db.SQL_USER_EXISTS, (1,)).fetchone()
+
+    def write_pooled():
+        conn = db.get_connection()
+        with conn:
+            conn.execute(db.SQL_INSERT_MEAL, (1, "Каша"))
+
+    print_header(f"Один вызов, {args.calls} повторов")
+    print_row("чтение, новое соединение", measure(read_new_connection, repeat=args.calls))
+    print_row("запись, новое соединение", measure(write_new_connection, repeat=args.calls))
+    # Первое обращение открывает соединение потока и включает WAL
+    db.get_connection()
+    print_row("чтение, соединение потока", measure(read_pooled, repeat=args.calls))
+    print_row("запись, соединение потока", measure(write_pooled, repeat=args.calls))
+
+
+def bench_meals_index(args) -> None:
+    import db
+    conn = db.get_connection()
+    # Только базовые таблицы, без индекса
+    db._migration_001_initial(conn.cursor())
+    started = time.perf_counter()
+    rng = random.Random(1)
+    batch = 100000
+    for start in range(0, args.rows, batch):
+        rows = ((rng.randrange(args.users), f"Приём пищи {i}", f"2024-01-01 00:00:{i % 60:02d}")
+                for i in range(start, min(start + batch, args.rows)))
+        with conn:
+            conn.executemany("INSERT INTO meals (user_id, meal, timestamp) VALUES (?, ?, ?)", rows)
+    print(f"Заполнение: {args.rows} строк за {time.perf_counter() - started:.1f} с")
+
+    user_ids = [rng.randrange(args.users) for _ in range(args.queries)]
+    print_header(f"get_meals, {args.rows} строк, {args.users} пользователей")
+    # Без индекса каждый запрос читает всю таблицу, поэтому запросов меньше
+    before = [user_ids[i % len(user_ids)] for i in range(args.queries_before)]
+    print_row("без индекса", measure_calls(db.get_meals, before))
+    started = time.perf_counter()
+    with conn:
+        db._migration_002_meals_index(conn.cursor())
+    print(f"{'':<32}индекс построен за {time.perf_counter() - started:.1f} с")
+    print_row("покрывающий индекс", measure_calls(db.get_meals, user_ids))
+
+
+def bench_meal_writer(args) -> None:
+    import db
+    import async_db
+    db.init_db()
+
+    async def direct(telegram_id: int, meal: str) -> bool:
+        return await async_db.run(db.add_meal, telegram_id, meal)
+
+    async def write_all(add_meal) -> float:
+        """Пишет args.rows строк не более чем args.concurrency одновременно; возвращает время"""
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(i: int) -> bool:
+            async with semaphore:
+                return await add_meal(i % 1000, f"Приём пищи {i}")
+
+        started = time.perf_counter()
+        results = await asyncio.gather(*(one(i) for i in range(args.rows)))
+        elapsed = time.perf_counter() - started
+        assert all(results)
+        return elapsed
+
+    async def scenario():
+        print(f"\n{args.rows} строк, {args.concurrency} одновременных записей")
+        for label, add_meal in (("транзакция на строку", direct), ("очередь MealWriter", async_db.add_meal)):
+            elapsed = await write_all(add_meal)
+            print(f"{label:<32}{args.rows / elapsed:>10.0f} строк/с")
+        writer = async_db.meal_writer
+        print(f"{'':<32}пачек: {writer.batches_written}, в среднем "
+              f"{writer.rows_written / max(writer.batches_written, 1):.1f} строк")
+        await async_db.shutdown()
+
+    asyncio.run(scenario())
+
+
+def bench_iter_users(args) -> None:
+    import db
+    db.init_db()
+    conn = db.get_connection()
+    batch = 100000
+    for start in range(0, args.users, batch):
+        with conn:
+            conn.executemany("INSERT INTO users (telegram_id, name) VALUES (?, ?)",
+                             ((10 ** 9 + i, "Пользователь") for i in range(start, min(start + batch, args.users))))
+
+    def whole_list() -> int:
+        return sum(1 for _ in db.get_all_users())
+
+    def keyset() -> int:
+        return sum(1 for _ in db.iter_user_ids(args.chunk_size))
+
+    print(f"\nОбход {args.users} пользователей")
+    for label, func in (("список get_all_users", whole_list), (f"iter_user_ids({args.chunk_size})", keyset)):
+        tracemalloc.start()
+        started = time.perf_counter()
+        count = func()
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        assert count == args.users
+        print(f"{label:<32}пик памяти {peak / 1024 / 1024:>8.2f} МБ, {elapsed:>6.2f} с")
+
+
+def bench_profile_crypto(args) -> None:
+    import db
+    fields = {'age': "30", 'weight': "60", 'height': "165", 'activity': "3️⃣ Средний",
+              'diseases': "нет", 'allergies': "нет"}
+    legacy = [db.encrypt_data(fields[key]) for key in db.SENSITIVE_FIELDS]
+    blob = db.encrypt_profile(fields)
+
+    def encrypt_legacy():
+        [db.encrypt_data(fields[key]) for key in db.SENSITIVE_FIELDS]
+
+    def decrypt_legacy():
+        db._decrypt_legacy_fields(legacy)
+
+    print_header(f"Профиль из {len(db.SENSITIVE_FIELDS)} полей, {args.calls} повторов")
+    print_row("запись, токен на поле", measure(encrypt_legacy, repeat=args.calls))
+    print_row("запись, один токен", measure(db.encrypt_profile, fields, repeat=args.calls))
+    print_row("чтение, токен на поле", measure(decrypt_legacy, repeat=args.calls))
+    print_row("чтение, один токен", measure(db.decrypt_profile, blob, repeat=args.calls))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микробенчмарки слоя SQLite")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    connections = commands.add_parser("connections", help="новое соединение на вызов против соединения потока")
+    connections.add_argument("--calls", type=int, default=5000, help="вызовов каждого вида")
+    connections.set_defaults(func=bench_connections)
+
+    meals_index = commands.add_parser("meals-index", help="get_meals до и после индекса")
+    meals_index.add_argument("--rows", type=int, default=10000000, help="строк в meals")
+    meals_index.add_argument("--users", type=int, default=100000, help="различных пользователей")
+    meals_index.add_argument("--queries", type=int, default=2000, help="запросов с индексом")
+    meals_index.add_argument("--queries-before", type=int, default=20, help="запросов без индекса")
+    meals_index.set_defaults(func=bench_meals_index)
+
+    meal_writer = commands.add_parser("meal-writer", help="очередь записи против транзакции на строку")
+    meal_writer.add_argument("--rows", type=int, default=20000, help="строк каждого вида")
+    meal_writer.add_argument("--concurrency", type=int, default=200, help="одновременных записей")
+    meal_writer.set_defaults(func=bench_meal_writer)
+
+    iter_users = commands.add_parser("iter-users", help="память при обходе всех пользователей")
+    iter_users.add_argument("--users", type=int, default=1000000, help="пользователей в базе")
+    iter_users.add_argument("--chunk-size", type=int, default=1000, help="размер порции iter_user_ids")
+    iter_users.set_defaults(func=bench_iter_users)
+
+    profile_crypto = commands.add_parser("profile-crypto", help="шифрование профиля: токен на поле против одного")
+    profile_crypto.add_argument("--calls", type=int, default=5000, help="вызовов каждого вида")
+    profile_crypto.set_defaults(func=bench_profile_crypto)
+
+    args = parser.parse_args()
+    workdir = prepare_env("nutribot-bench-db-")
+    print(f"Каталог прогона: {workdir}")
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# bench_energy.py
+"""
+Время расчёта суточных целей (energy.py) для многих пользователей:
+compute_targets в цикле по одному профилю против одного вызова
+compute_targets_batch на массивах NumPy.
+
+Профили синтетические, в том же виде, что возвращает db.get_user_data
+(строки, часть полей пустые или некорректные). Измеряются:
+  - цикл compute_targets с разбором каждого профиля;
+  - profiles_to_arrays + compute_targets_batch + round_targets (то же, что
+    строит nutrition_agent.build_plan_inputs_batch);
+  - только compute_targets_batch на уже подготовленных массивах.
+
+Пример:
+    python bench_energy.py --sizes 1000 10000 100000 --repeat 5
+"""
+import random
+import argparse
+
+from bench_common import measure, print_header, print_row
+
+ACTIVITY_OPTIONS = ["1️⃣ Минимальный", "2️⃣ Низкий", "3️⃣ Средний", "4️⃣ Высокий", "5️⃣ Очень высокий", None]
+GOALS = ["Похудение", "Набор массы", "Поддержание здоровья", None]
+GENDERS = ["male", "female", None]
+
+
+def make_profiles(count: int, rng: random.Random) -> list:
+    profiles = []
+    for _ in range(count):
+        profiles.append({
+            "weight": rng.choice([str(rng.randint(40, 140)), f"{rng.randint(40, 140)},5", "", None]),
+            "height": str(rng.randint(145, 205)),
+            "age": rng.choice([str(rng.randint(16, 90)), "тридцать"]),
+            "gender": rng.choice(GENDERS),
+            "activity": rng.choice(ACTIVITY_OPTIONS),
+            "goal": rng.choice(GOALS)
+        })
+    return profiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Расчёт целей: цикл по профилям против векторного")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="профилей в пачке")
+    parser.add_argument("--repeat", type=int, default=5, help="повторов каждого варианта")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    import energy
+    rng = random.Random(args.seed)
+    for size in args.sizes:
+        profiles = make_profiles(size, rng)
+        arrays = energy.profiles_to_arrays(profiles)
+
+        def scalar_loop():
+            return [energy.compute_targets(**energy.profile_values(p)) for p in profiles]
+
+        def batch():
+            return energy.round_targets(energy.compute_targets_batch(**energy.profiles_to_arrays(profiles)))
+
+        def batch_only():
+            return energy.compute_targets_batch(**arrays)
+
+        assert scalar_loop() == batch()
+        print_header(f"{size} профилей, время на всю пачку")
+        print_row("цикл compute_targets", measure(scalar_loop, repeat=args.repeat))
+        print_row("разбор + compute_targets_batch", measure(batch, repeat=args.repeat))
+        print_row("только compute_targets_batch", measure(batch_only, repeat=args.repeat))
+
+
+if __name__ == "__main__":
+    main()
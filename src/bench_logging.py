@@ -0,0 +1,67 @@
+# bench_logging.py
+"""
+Сколько логирование добавляет к времени обработчика при LOG_LEVEL=DEBUG.
+
+«Обработчик» пишет --lines DEBUG-строк. Сравниваются:
+  - прежняя настройка: FileHandler и StreamHandler в потоке вызова;
+  - logging_setup: QueueHandler, запись на диск в фоновом потоке;
+  - logging_setup с прореживанием (get_sampled_logger).
+Консольный вывод уходит в /dev/null, файл журнала — во временный каталог.
+
+Пример:
+    python bench_logging.py --calls 2000 --lines 20
+"""
+import os
+import sys
+import logging
+import argparse
+
+from bench_common import prepare_env, measure, print_header, print_row
+
+
+def handler(logger: logging.Logger, lines: int) -> None:
+    for i in range(lines):
+        logger.debug("Пользователь %s: шаг %s обработки", 12345, i)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Задержка обработчика с логированием на уровне DEBUG")
+    parser.add_argument("--calls", type=int, default=2000, help="вызовов обработчика")
+    parser.add_argument("--lines", type=int, default=20, help="DEBUG-строк на вызов")
+    args = parser.parse_args()
+
+    workdir = prepare_env("nutribot-bench-logging-")
+    os.environ["LOG_LEVEL"] = "DEBUG"
+    sys.stderr = open(os.devnull, "w")
+    root = logging.getLogger()
+    logger = logging.getLogger("bench")
+    results = []
+
+    # Как было до logging_setup: запись в файл прямо в обработчике
+    root.setLevel(logging.DEBUG)
+    file_handler = logging.FileHandler(os.path.join(workdir, "database.log"))
+    stream_handler = logging.StreamHandler()
+    for h in (file_handler, stream_handler):
+        h.setFormatter(logging.Formatter("%(asctime)s - %(name)s - %(levelname)s - %(message)s"))
+        root.addHandler(h)
+    results.append(("FileHandler в потоке вызова", measure(handler, logger, args.lines, repeat=args.calls)))
+    for h in (file_handler, stream_handler):
+        root.removeHandler(h)
+        h.close()
+
+    import logging_setup
+    logging_setup.setup_logging()
+    results.append(("QueueHandler (logging_setup)", measure(handler, logger, args.lines, repeat=args.calls)))
+    sampled = logging_setup.get_sampled_logger("bench", every=100)
+    results.append(("QueueHandler, каждая 100-я", measure(handler, sampled, args.lines, repeat=args.calls)))
+    logging_setup.stop_logging()
+
+    sys.stderr = sys.__stderr__
+    print(f"Каталог прогона: {workdir}")
+    print_header(f"Обработчик с {args.lines} DEBUG-строками")
+    for label, samples in results:
+        print_row(label, samples)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# bench_recipe_store.py
+"""
+Время поиска в хранилище рецептов (recipe_store.find_recipe) при большом
+числе сохранённых рецептов.
+
+Хранилище заполняется синтетическими наборами ингредиентов напрямую через
+SQL-запросы recipe_store (как put_recipe, но пачками). Популярность слов
+распределена по Ципфу, как у реальных продуктов: «курица» и «лук» встречаются
+в десятках тысяч рецептов. Затем измеряются запросы трёх видов: точный набор,
+набор с одним добавленным ингредиентом (похожий, Жаккар n/(n+1)) и
+случайный набор (промах).
+
+Пример:
+    python bench_recipe_store.py --recipes 500000 --queries 2000
+"""
+import time
+import random
+import argparse
+
+from bench_common import prepare_env, print_header, print_row
+
+LETTERS = "абвгдежзиклмнопрстуфхцчшэюя"
+
+
+def make_vocabulary(size: int, rng: random.Random) -> list:
+    """Слова-ингредиенты, которые tokenize превращает в разные токены"""
+    import recipe_store
+    words, tokens = [], set()
+    while len(words) < size:
+        word = "".join(rng.choice(LETTERS) for _ in range(rng.randint(5, 8)))
+        token = recipe_store.tokenize(word)
+        if len(token) == 1 and not token & tokens:
+            words.append(word)
+            tokens |= token
+    return words
+
+
+def fill_store(count: int, vocabulary: list, rng: random.Random, batch: int = 10000) -> list:
+    """Сохраняет count рецептов с разными наборами; возвращает их наборы слов"""
+    import db
+    import recipe_store
+    weights = [1 / (rank + 1) for rank in range(len(vocabulary))]
+    token_of = {word: next(iter(recipe_store.tokenize(word))) for word in vocabulary}
+    conn = db.get_connection()
+    sets, seen = [], set()
+    now = time.time()
+    while len(sets) < count:
+        with conn:
+            for _ in range(min(batch, count - len(sets))):
+                words = sorted(set(rng.choices(vocabulary, weights, k=rng.randint(4, 8))))
+                tokens = sorted(token_of[word] for word in words)
+                goal = rng.randrange(3)
+                if (tuple(tokens), goal) in seen:
+                    continue
+                seen.add((tuple(tokens), goal))
+                recipe_id = conn.execute(recipe_store.SQL_INSERT_RECIPE, (
+                    " ".join(tokens), goal, "", len(tokens), "Рецепт: " + ", ".join(words), now, now
+                )).lastrowid
+                conn.executemany(recipe_store.SQL_INSERT_POSTING, [(t, goal, len(tokens), recipe_id) for t in tokens])
+                conn.executemany(recipe_store.SQL_INCREMENT_DF, [(t,) for t in tokens])
+                sets.append((words, goal))
+    return sets
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Время поиска в хранилище рецептов")
+    parser.add_argument("--recipes", type=int, default=500000, help="рецептов в хранилище")
+    parser.add_argument("--vocabulary", type=int, default=3000, help="различных ингредиентов")
+    parser.add_argument("--queries", type=int, default=2000, help="запросов каждого вида")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    workdir = prepare_env("nutribot-bench-recipes-")
+    import db
+    import recipe_store
+    from energy import GOALS
+    db.init_db()
+    rng = random.Random(args.seed)
+    goals = list(GOALS)
+
+    vocabulary = make_vocabulary(args.vocabulary, rng)
+    started = time.perf_counter()
+    sets = fill_store(args.recipes, vocabulary, rng)
+    print(f"Заполнение: {args.recipes} рецептов за {time.perf_counter() - started:.1f} с ({workdir})")
+
+    queries = {"точный набор": [], "добавлен ингредиент": [], "случайный набор (промах)": []}
+    for words, goal in rng.sample(sets, min(args.queries, len(sets))):
+        queries["точный набор"].append((words, goal))
+        queries["добавлен ингредиент"].append((words + [rng.choice(vocabulary)], goal))
+        queries["случайный набор (промах)"].append((rng.sample(vocabulary, len(words)), goal))
+
+    print_header(f"find_recipe, {args.recipes} рецептов")
+    for label, items in queries.items():
+        samples, hits = [], 0
+        for words, goal in items:
+            began = time.perf_counter()
+            found = recipe_store.find_recipe(", ".join(words), goals[goal], "нет")
+            samples.append(time.perf_counter() - began)
+            hits += found is not None
+        print_row(label, samples)
+        print(f"{'':<32}попаданий: {hits} из {len(items)}")
+
+
+if __name__ == "__main__":
+    main()
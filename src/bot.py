@@ -1,6 +1,9 @@
 import os
+import time
+import asyncio
 import logging
 from telegram import Update, ReplyKeyboardMarkup, InputFile
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import (
     CommandHandler,
     MessageHandler,
@@ -9,15 +12,19 @@ from telegram.ext import (
     ContextTypes,
     filters
 )
-from db import (
+from async_db import (
     add_user,
     is_user_registered,
-    get_user_data
+    get_user_data,
+    update_user_fields
 )
-from consult import get_consultation
-from recipes import generate_recipe_with_openai
+import async_db
+import image_store
+from llm import SingleFlight
+from consult import get_consultation, stream_consultation
+from recipes import generate_recipe_with_openai, stream_recipe, is_recipe_error, record_delivery
 from nutrition_agent import generate_nutrition_plan
-from src.generate_images import generate_recipe_image
+from generate_images import generate_recipe_image
 from keyboards import get_main_keyboard
 
 logger = logging.getLogger(__name__)
@@ -26,6 +33,21 @@ logger = logging.getLogger(__name__)
 # 0 - NAME, 1 - AGE, 2 - WEIGHT, 3 - HEIGHT, 4 - ACTIVITY, 5 - GOAL, 6 - DISEASES, 7 - ALLERGIES
 NAME, AGE, WEIGHT, HEIGHT, ACTIVITY, GOAL, DISEASES, ALLERGIES = range(8)
 
+# Потоковая выдача консультаций: ответ появляется в одном сообщении,
+# которое редактируется не чаще, чем раз в CONSULT_EDIT_INTERVAL секунд
+CONSULT_STREAMING = os.getenv("CONSULT_STREAMING", "1") == "1"
+CONSULT_EDIT_INTERVAL = float(os.getenv("CONSULT_EDIT_INTERVAL", "1.5"))
+TELEGRAM_TEXT_LIMIT = 4096
+
+# Одновременные запросы картинки для одного и того же блюда генерируют её один раз
+image_flight = SingleFlight()
+# Рецепт отправляется текстом сразу, картинка — следом; если она не готова
+# через RECIPE_IMAGE_TIMEOUT секунд после текста, рецепт остаётся без неё
+RECIPE_STREAMING = os.getenv("RECIPE_STREAMING", "1") == "1"
+RECIPE_IMAGE_TIMEOUT = float(os.getenv("RECIPE_IMAGE_TIMEOUT", "60"))
+# Генерации картинок, которые продолжаются после таймаута (картинка пригодится в следующий раз)
+_background_tasks = set()
+
 
 # --- ФУНКЦИИ РЕГИСТРАЦИИ ---
 
@@ -36,7 +58,7 @@ async def start_registration(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """
     try:
         user = update.effective_user
-        if is_user_registered(user.id):
+        if await is_user_registered(user.id):
             reply_kb = [
                 ["Похудение", "Набор массы"],
                 ["Поддержание здоровья", "Помощь"]
@@ -175,7 +197,7 @@ async def get_diseases(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def get_allergies(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_data = context.user_data
-    if add_user(
+    if await add_user(
             telegram_id=update.effective_user.id,
             name=user_data.get('name'),
             age=user_data.get('age'),
@@ -205,6 +227,107 @@ async def get_allergies(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # --- ФУНКЦИИ КОНСУЛЬТАЦИИ И РЕЦЕПТОВ ---
 
+async def _edit_consultation(sent, text: str) -> bool:
+    """
+    Правит сообщение с ответом; ошибки Telegram только логируются.
+    «message is not modified» считается успехом.
+    """
+    try:
+        await sent.edit_text(text)
+        return True
+    except BadRequest as e:
+        if "not modified" in str(e).lower():
+            return True
+        logger.warning(f"Не удалось отредактировать ответ консультанта: {e}")
+    except RetryAfter as e:
+        logger.warning(f"Telegram просит подождать {e.retry_after} с перед правкой ответа")
+    except TelegramError as e:
+        logger.warning(f"Ошибка Telegram при правке ответа консультанта: {e}")
+    return False
+
+
+async def _finish_consultation(message, sent, text: str) -> None:
+    """
+    Доставляет окончательный текст правкой отправленного сообщения; если
+    правка не удалась (в том числе после ожидания по RetryAfter) — новым сообщением
+    """
+    if sent is not None:
+        try:
+            await sent.edit_text(text)
+            return
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            if await _edit_consultation(sent, text):
+                return
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                return
+            logger.warning(f"Не удалось отредактировать ответ консультанта: {e}")
+        except TelegramError as e:
+            logger.warning(f"Ошибка Telegram при правке ответа консультанта: {e}")
+    await message.reply_text(text)
+
+
+async def send_consultation(message, question: str, user_data: dict = None):
+    """
+    Отправляет ответ консультанта. В потоковом режиме первое сообщение уходит
+    с первыми токенами и затем дополняется правками. Ошибки Telegram при
+    правках не повторяют запрос к модели: пользователь получает уже
+    полученный текст. Ответ генерируется заново обычным запросом, только если
+    сломался сам поток и пользователю ещё ничего не отправлено.
+    """
+    if not CONSULT_STREAMING:
+        answer = await get_consultation(question, user_data=user_data)
+        await message.reply_text(answer)
+        return
+
+    started = time.monotonic()
+    sent = None
+    text = ""
+    shown = ""
+    last_edit = 0.0
+    try:
+        async for chunk in stream_consultation(question, user_data=user_data):
+            text += chunk
+            visible = text[:TELEGRAM_TEXT_LIMIT]
+            if not visible.strip():
+                continue
+            now = time.monotonic()
+            if sent is None:
+                try:
+                    sent = await message.reply_text(visible)
+                except TelegramError as e:
+                    # Первый фрагмент не ушёл — попробуем со следующим или в конце
+                    logger.warning(f"Не удалось отправить начало ответа консультанта: {e}")
+                    continue
+                logger.debug(f"Первый фрагмент консультации через {now - started:.2f} с")
+            elif visible != shown and now - last_edit >= CONSULT_EDIT_INTERVAL:
+                if not await _edit_consultation(sent, visible):
+                    last_edit = now
+                    continue
+            else:
+                continue
+            shown = visible
+            last_edit = now
+    except Exception as e:
+        if sent is not None or text.strip():
+            logger.error(f"Поток консультации прерван, отправляем полученную часть: {e}", exc_info=True)
+            await _finish_consultation(message, sent, (text + "\n\n⚠️ Ответ прерван.")[:TELEGRAM_TEXT_LIMIT])
+            return
+        logger.error(f"Ошибка потоковой консультации, отправляем ответ целиком: {e}", exc_info=True)
+        answer = await get_consultation(question, user_data=user_data)
+        await message.reply_text(answer)
+        return
+
+    if not text.strip():
+        logger.error("Пустой ответ модели в потоке, отправляем ответ целиком")
+        await message.reply_text(await get_consultation(question, user_data=user_data))
+        return
+    if text[:TELEGRAM_TEXT_LIMIT] != shown:
+        await _finish_consultation(message, sent, text[:TELEGRAM_TEXT_LIMIT])
+    logger.info(f"Консультация отправлена потоково за {time.monotonic() - started:.2f} с")
+
+
 async def ask(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         question = " ".join(context.args)
@@ -212,18 +335,116 @@ async def ask(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("❓ Задайте вопрос после команды /ask")
             return
         user_id = update.effective_user.id
-        user_data = get_user_data(user_id) if is_user_registered(user_id) else None
-        answer = get_consultation(question, user_data=user_data)
-        await update.message.reply_text(answer)
+        user_data = await get_user_data(user_id) if await is_user_registered(user_id) else None
+        await send_consultation(update.message, question, user_data=user_data)
     except Exception as e:
         logger.error(f"Ошибка /ask: {str(e)}")
         await update.message.reply_text("⚠️ Ошибка обработки запроса")
 
 
+def extract_dish_title(recipe_text: str) -> str:
+    """Название блюда — первая строка рецепта без эмодзи-префикса"""
+    lines = recipe_text.splitlines()
+    if lines and lines[0].strip():
+        title = lines[0].strip("🍽️ ").strip()
+        if title:
+            return title
+    return "блюдо"
+
+
+def create_visual_prompt(title: str) -> str:
+    visual_prompt = (
+        f"Фотография аппетитного блюда '{title}', студийное освещение, высокое качество, "
+        "яркие цвета, профессиональная подача"
+    )
+    logger.debug(f"Visual prompt: {visual_prompt}")
+    return visual_prompt
+
+
+async def get_recipe_image(title: str):
+    """
+    Картинка блюда {'path', 'file_id', 'source'}: из хранилища или, если её
+    ещё нет, новая генерация. None, если картинку получить не удалось.
+    """
+    key = image_store.title_key(title)
+    image = await async_db.run(image_store.get_image, key)
+    if image:
+        image['source'] = 'file_id' if image['file_id'] else 'disk'
+        return image
+    path = await image_flight.do(key, lambda: generate_recipe_image(create_visual_prompt(title)))
+    if not path:
+        return None
+    await async_db.run(image_store.put_image, key, title, path)
+    return {'path': path, 'file_id': None, 'source': 'generated'}
+
+
+async def send_recipe_photo(message, title: str, image: dict, caption: str) -> bool:
+    """
+    Отправляет картинку блюда по сохранённому file_id или загружает файл
+    и запоминает file_id, который вернул Telegram. Возвращает False, если
+    file_id недействителен, а файла уже нет на диске.
+    """
+    key = image_store.title_key(title)
+    if image['file_id']:
+        try:
+            await message.reply_photo(photo=image['file_id'], caption=caption, reply_markup=get_main_keyboard())
+            return True
+        except BadRequest as e:
+            logger.warning(f"file_id картинки «{title}» больше не действителен: {e}")
+            await async_db.run(image_store.set_file_id, key, None)
+    try:
+        photo = open(image['path'], "rb")
+    except FileNotFoundError:
+        return False
+    # Размер берётся у открытого файла: после отправки его может удалить вытеснение LRU
+    with photo:
+        size = os.fstat(photo.fileno()).st_size
+        sent = await message.reply_photo(photo=photo, caption=caption, reply_markup=get_main_keyboard())
+    image_store.record_upload(size)
+    if sent.photo:
+        await async_db.run(image_store.set_file_id, key, sent.photo[-1].file_id)
+    return True
+
+
+def _keep_in_background(task: asyncio.Task) -> None:
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+
+async def cancel_background_tasks() -> None:
+    """Отменяет фоновые генерации картинок (при остановке бота)"""
+    for task in list(_background_tasks):
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+
+
+async def _generate_recipe_text(ingredients: str, user_data: dict, on_title) -> str:
+    """
+    Генерирует текст рецепта потоково и вызывает on_title(title), как только
+    готова первая строка с названием блюда. При ошибке потока рецепт
+    генерируется целиком обычным запросом.
+    """
+    if RECIPE_STREAMING:
+        text = ""
+        title_sent = False
+        try:
+            async for chunk in stream_recipe(ingredients, user_data):
+                text += chunk
+                if not title_sent and "\n" in text.lstrip():
+                    title_sent = True
+                    on_title(extract_dish_title(text.lstrip()))
+            return text
+        except Exception as e:
+            logger.error(f"Ошибка потоковой генерации рецепта, генерируем целиком: {e}", exc_info=True)
+    return await generate_recipe_with_openai(ingredients=ingredients, user_context=user_data)
+
+
 async def recipe_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Команда /recipe. Генерация рецепта и картинки.
     Ожидается, что в сообщении содержится список ингредиентов.
+    Картинка начинает готовиться, как только известно название блюда;
+    текст отправляется сразу, а фото — следом, когда будет готово.
     """
     try:
         if update.message and update.message.text:
@@ -240,44 +461,61 @@ async def recipe_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
 
         user = update.effective_user
-        if not is_user_registered(user.id):
+        if not await is_user_registered(user.id):
             await update.message.reply_text("ℹ️ Сначала пройдите регистрацию (/start)")
             return
 
-        user_data = get_user_data(user.id)
-        recipe_text = generate_recipe_with_openai(ingredients=ingredients_text, user_context=user_data)
-
-        def create_visual_prompt(recipe_text: str) -> str:
-            lines = recipe_text.splitlines()
-            if lines and lines[0].strip():
-                title = lines[0].strip("🍽️ ").strip()
-                if not title:
-                    title = "блюдо"
-            else:
-                title = "блюдо"
-            visual_prompt = (
-                f"Фотография аппетитного блюда '{title}', студийное освещение, высокое качество, "
-                "яркие цвета, профессиональная подача"
-            )
-            logger.debug(f"Visual prompt: {visual_prompt}")
-            return visual_prompt
-
-        visual_prompt = create_visual_prompt(recipe_text)
-        image_path = generate_recipe_image(visual_prompt)
-        logger.info(f"Получен путь к изображению: {image_path}")
-
-        if image_path:
-            with open(image_path, "rb") as photo:
-                await update.message.reply_photo(
-                    photo=photo,
-                    caption=recipe_text,
+        started = time.monotonic()
+        user_data = await get_user_data(user.id)
+        image_task = None
+        title = None
+
+        def start_image(dish_title: str) -> None:
+            nonlocal image_task, title
+            title = dish_title
+            image_task = asyncio.create_task(get_recipe_image(dish_title))
+
+        try:
+            recipe_text = await _generate_recipe_text(ingredients_text, user_data, start_image)
+            if is_recipe_error(recipe_text):
+                await update.message.reply_text(recipe_text, reply_markup=get_main_keyboard())
+                return
+            if image_task is None:
+                start_image(extract_dish_title(recipe_text))
+
+            await update.message.reply_text(recipe_text[:TELEGRAM_TEXT_LIMIT])
+            text_sent = time.monotonic()
+            first_response = text_sent - started
+
+            image = None
+            try:
+                image = await asyncio.wait_for(asyncio.shield(image_task), RECIPE_IMAGE_TIMEOUT)
+                source = image['source'] if image else 'failed'
+            except asyncio.TimeoutError:
+                logger.warning(f"Картинка «{title}» не готова за {RECIPE_IMAGE_TIMEOUT:g} с, рецепт отправлен без неё")
+                _keep_in_background(image_task)
+                source = 'timeout'
+            except Exception as e:
+                logger.error(f"Ошибка получения картинки «{title}»: {e}", exc_info=True)
+                source = 'failed'
+
+            if image and not await send_recipe_photo(update.message, title, image, f"🍽️ {title}"):
+                image = None
+                source = 'failed'
+            if not image:
+                await update.message.reply_text(
+                    "⚠️ Не удалось создать изображение, но рецепт выше готов.",
                     reply_markup=get_main_keyboard()
                 )
-        else:
-            await update.message.reply_text(
-                "⚠️ Рецепт готов, но не удалось создать изображение.\n\n" + recipe_text,
-                reply_markup=get_main_keyboard()
-            )
+            image_store.record(source, time.monotonic() - text_sent)
+            total = time.monotonic() - started
+            record_delivery(first_response, total)
+            logger.info(f"Рецепт «{title}»: текст через {first_response:.2f} с, всего {total:.2f} с")
+        finally:
+            # На путях ошибок картинка больше не нужна; после таймаута её дожидается фоновая задача
+            if image_task is not None and image_task not in _background_tasks:
+                image_task.cancel()
+                await asyncio.gather(image_task, return_exceptions=True)
     except Exception as e:
         logger.error(f"Ошибка обработки команды /recipe: {e}", exc_info=True)
         if update.message:
@@ -286,6 +524,39 @@ async def recipe_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.callback_query.message.reply_text("⚠️ Ошибка генерации рецепта")
 
 
+def run_in_background(context: ContextTypes.DEFAULT_TYPE, update: Update, coroutine) -> None:
+    """
+    Запускает медленную часть обработки (запрос к LLM) отдельной задачей:
+    флаги user_data уже обновлены, и следующий апдейт можно обрабатывать сразу
+    """
+    context.application.create_task(coroutine, update=update)
+
+
+async def reply_consultation(update: Update, question: str) -> None:
+    """Консультация по тексту сообщения"""
+    try:
+        user_data = await get_user_data(update.effective_user.id)
+        await send_consultation(update.message, question, user_data=user_data)
+    except Exception:
+        logger.exception("Ошибка консультации:")
+        await update.message.reply_text("⚠️ Не удалось обработать сообщение")
+
+
+async def reply_goal_plan(update: Update, goal: str) -> None:
+    """План питания под только что выбранную цель"""
+    try:
+        user_data = await get_user_data(update.effective_user.id)
+        # Генерируем новый план питания или краткие рекомендации:
+        plan = await generate_nutrition_plan(user_data)
+        await update.message.reply_text(
+            f"Вы выбрали цель: {goal}\n\n" + plan,
+            reply_markup=get_main_keyboard()
+        )
+    except Exception:
+        logger.exception("Ошибка плана питания для новой цели:")
+        await update.message.reply_text("⚠️ Не удалось обработать сообщение")
+
+
 async def handle_ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
     Обработка всех текстовых сообщений.
@@ -298,7 +569,7 @@ async def handle_ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE)
     """
     try:
         user_id = update.effective_user.id
-        if not is_user_registered(user_id):
+        if not await is_user_registered(user_id):
             await update.message.reply_text("ℹ️ Сначала пройдите регистрацию (/start)")
             return
 
@@ -310,15 +581,13 @@ async def handle_ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE)
         # 1) Режим рецепта
         if context.user_data.get("awaiting_recipe"):
             context.user_data["awaiting_recipe"] = False
-            await recipe_handler(update, context)
+            run_in_background(context, update, recipe_handler(update, context))
             return
 
         # 2) Режим консультации
         if context.user_data.get("awaiting_consultation"):
             context.user_data["awaiting_consultation"] = False
-            user_data = get_user_data(user_id)
-            answer = get_consultation(user_text, user_data=user_data)
-            await update.message.reply_text(answer)
+            run_in_background(context, update, reply_consultation(update, user_text))
             return
 
         # 3) "Помощь"
@@ -328,25 +597,18 @@ async def handle_ingredients(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
         # 4) Обработка "Похудение"/"Набор массы"/"Поддержание здоровья"
         if user_text in ["Похудение", "Набор массы", "Поддержание здоровья"]:
-            # ТУТ ВОССТАНАВЛИВАЕМ "СТАРОЕ" ПОВЕДЕНИЕ
-            # Например, меняем цель пользователя и выдаём рекомендации/рецепты/план
-            user_data = get_user_data(user_id)
-            user_data["goal"] = user_text  # Допустим, пользователь меняет цель
-            # Генерируем новый план питания или краткие рекомендации:
-            plan = generate_nutrition_plan(user_data)
-            await update.message.reply_text(
-                f"Вы выбрали цель: {user_text}\n\n" + plan,
-                reply_markup=get_main_keyboard()
-            )
+            # Сохраняем новую цель пользователя и выдаём план под неё
+            if not await update_user_fields(user_id, goal=user_text):
+                await update.message.reply_text("❌ Не удалось сохранить цель")
+                return
+            run_in_background(context, update, reply_goal_plan(update, user_text))
             return
 
         # 5) Если похоже на вопрос
         if "?" in user_text or user_text.lower().startswith(
             ("как", "что", "почему", "какие", "зачем", "кто", "можешь", "посоветуй")
         ):
-            user_data = get_user_data(user_id)
-            answer = get_consultation(user_text, user_data=user_data)
-            await update.message.reply_text(answer)
+            run_in_background(context, update, reply_consultation(update, user_text))
             return
 
         # 6) Fallback
@@ -372,6 +634,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/start - Регистрация\n"
         "/ask [вопрос] - Консультация\n"
         "/nutrition - Персональный план питания\n"
+        "/nutrition обновить - Составить план заново\n"
         "/recipe - Рецепт (с изображением)\n"
         "Или нажмите нужную кнопку на клавиатуре ниже."
     )
@@ -384,14 +647,16 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def nutrition_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
-        if not is_user_registered(user.id):
+        if not await is_user_registered(user.id):
             if update.message:
                 await update.message.reply_text("ℹ️ Сначала пройдите регистрацию (/start)")
             elif update.callback_query:
                 await update.callback_query.message.reply_text("ℹ️ Сначала пройдите регистрацию (/start)")
             return
-        user_data = get_user_data(user.id)
-        plan = generate_nutrition_plan(user_data)
+        user_data = await get_user_data(user.id)
+        # "/nutrition обновить" — сгенерировать план заново, минуя кэш
+        regenerate = bool(context.args) and context.args[0].lower() in ("обновить", "новый")
+        plan = await generate_nutrition_plan(user_data, regenerate=regenerate)
         if update.message:
             await update.message.reply_text(plan, reply_markup=get_main_keyboard())
         elif update.callback_query:
@@ -419,7 +684,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data["awaiting_consultation"] = True
         await query.message.reply_text("Введите ваш вопрос для консультации:")
     elif command == "/nutrition":
-        await nutrition_handler(update, context)
+        run_in_background(context, update, nutrition_handler(update, context))
     elif command == "/recipe":
         context.user_data["awaiting_recipe"] = True
         await query.message.reply_text("Пожалуйста, отправьте список ингредиентов для рецепта:")
@@ -452,7 +717,8 @@ def create_conv_handler():
 
 
 def create_ask_handler():
-    return CommandHandler("ask", ask)
+    # Медленные обработчики без состояния не задерживают очередь апдейтов
+    return CommandHandler("ask", ask, block=False)
 
 
 def create_help_handler():
@@ -464,11 +730,11 @@ def create_message_handler():
 
 
 def create_nutrition_handler():
-    return CommandHandler("nutrition", nutrition_handler)
+    return CommandHandler("nutrition", nutrition_handler, block=False)
 
 
 def create_recipe_handler():
-    return CommandHandler("recipe", recipe_handler)
+    return CommandHandler("recipe", recipe_handler, block=False)
 
 
 
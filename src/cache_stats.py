@@ -0,0 +1,53 @@
+# cache_stats.py
+"""
+Общие счётчики для кэшей в SQLite (plan_cache, recipe_store): попадания и
+промахи со временем ответа и периодический запуск очистки.
+"""
+import threading
+
+
+class HitStats:
+    """Число попаданий/промахов и суммарное время ответа для каждого исхода"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._hit_seconds = 0.0
+        self._miss_seconds = 0.0
+
+    def record(self, hit: bool, seconds: float) -> None:
+        """Учитывает попадание/промах и время ответа"""
+        with self._lock:
+            if hit:
+                self._hits += 1
+                self._hit_seconds += seconds
+            else:
+                self._misses += 1
+                self._miss_seconds += seconds
+
+    def get_stats(self) -> dict:
+        """Доля попаданий и среднее время ответа при попадании и промахе"""
+        with self._lock:
+            hits, misses = self._hits, self._misses
+            return {
+                'hits': hits,
+                'misses': misses,
+                'hit_ratio': hits / (hits + misses) if hits + misses else 0.0,
+                'avg_hit_seconds': self._hit_seconds / hits if hits else 0.0,
+                'avg_miss_seconds': self._miss_seconds / misses if misses else 0.0
+            }
+
+
+class EveryN:
+    """Счётчик записей: tick() возвращает True на каждую n-ю (пора проверить размер кэша)"""
+
+    def __init__(self, n: int):
+        self.n = n
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def tick(self) -> bool:
+        with self._lock:
+            self._count += 1
+            return self._count % self.n == 0
@@ -1,71 +1,95 @@
 # consult.py
 import os
 import logging
+from functools import lru_cache
 from dotenv import load_dotenv
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from llm import get_model, ainvoke, astream
+from answer_cache import AnswerCache
+import token_budget
+from token_budget import PromptTooLong
 
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
 
 load_dotenv()
 
+# Кэш ответов на вопросы без данных профиля: они зависят только от текста вопроса
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000")),
+    dim=int(os.getenv("ANSWER_CACHE_DIM", "256")),
+    threshold=float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.85"))
+)
+
+
+# Шаблоны разбираются один раз при импорте; текст пользователя передаётся
+# переменными, поэтому фигурные скобки в вопросе не ломают цепочку.
+PROFILE_PROMPT = ChatPromptTemplate.from_template(
+    "Ты - диетолог-нутрициолог с 10-летним стажем. "
+    "У пользователя, зарегистрированного с данными: возраст {age} лет, вес {weight} кг, рост {height} см, "
+    "заболевания: {diseases}, аллергии: {allergies} и цель: {goal}, "
+    "ответь на следующий вопрос: {question} "
+    "Дай подробный и научно обоснованный ответ, учитывая индивидуальные особенности пользователя."
+)
+ANONYMOUS_PROMPT = ChatPromptTemplate.from_template(
+    "Ты - опытный диетолог-нутрициолог с 10-летним стажем. "
+    "Ответь на следующий вопрос: {question} "
+    "Дай подробный и научно обоснованный ответ."
+)
+
+TOO_LONG_ANSWER = "⚠️ Вопрос слишком длинный. Пожалуйста, сформулируйте его короче."
+
+
+@lru_cache(maxsize=None)
+def _get_chain(with_profile: bool):
+    prompt = PROFILE_PROMPT if with_profile else ANONYMOUS_PROMPT
+    return prompt | get_model("consult") | StrOutputParser()
+
+
+def build_consultation_request(question: str, user_data: dict = None) -> tuple:
+    """
+    Возвращает (цепочка, входные данные) для вопроса пользователя.
+    Бросает PromptTooLong, если вопрос не помещается в бюджет токенов.
+    """
+    token_budget.ensure_fits(question, token_budget.QUESTION_MAX_TOKENS)
+    if not user_data:
+        return _get_chain(False), {"question": question}
+
+    field_limit = token_budget.PROFILE_FIELD_MAX_TOKENS
+    inputs = {
+        "age": user_data.get("age", "неизвестно"),
+        "weight": user_data.get("weight", "неизвестно"),
+        # Если рост не задан (регистрация может его не собирать), задаём значение по умолчанию:
+        "height": user_data.get("height", "неизвестно"),
+        "diseases": token_budget.trim(user_data.get("diseases", "нет"), field_limit),
+        "allergies": token_budget.trim(user_data.get("allergies", "нет"), field_limit),
+        "goal": user_data.get("goal", "нет данных"),
+        "question": question
+    }
+    return _get_chain(True), inputs
+
 
-def get_consultation(question: str, user_data: dict = None) -> str:
+async def get_consultation(question: str, user_data: dict = None) -> str:
     """
     Генерирует ответ на вопрос пользователя с учетом данных его профиля (если они предоставлены).
     """
     try:
-        if user_data:
-            system_prompt = (
-                "Ты - диетолог-нутрициолог с 10-летним стажем. "
-                "У пользователя, зарегистрированного с данными: возраст {age} лет, вес {weight} кг, рост {height} см, "
-                "заболевания: {diseases}, аллергии: {allergies} и цель: {goal}, "
-                "ответь на следующий вопрос: {question} "
-                "Дай подробный и научно обоснованный ответ, учитывая индивидуальные особенности пользователя."
-            )
-            age = user_data.get("age", "неизвестно")
-            weight = user_data.get("weight", "неизвестно")
-            # Если рост не задан (регистрация может его не собирать), задаём значение по умолчанию:
-            height = user_data.get("height", "неизвестно")
-            diseases = user_data.get("diseases", "нет")
-            allergies = user_data.get("allergies", "нет")
-            goal = user_data.get("goal", "нет данных")
-            formatted_prompt = system_prompt.format(
-                age=age,
-                weight=weight,
-                height=height,
-                diseases=diseases,
-                allergies=allergies,
-                goal=goal,
-                question=question
-            )
-        else:
-            # Если данные отсутствуют, используем общий промпт
-            formatted_prompt = (
-                "Ты - опытный диетолог-нутрициолог с 10-летним стажем. "
-                "Ответь на следующий вопрос: {question} "
-                "Дай подробный и научно обоснованный ответ."
-            ).format(question=question)
-
-        chain = (
-                ChatPromptTemplate.from_template(formatted_prompt)
-                | ChatOpenAI(
-            model_name="gpt-4o",
-            temperature=0.7,
-            max_tokens=1000,
-            openai_api_key=os.getenv("OPENAI_API_KEY")
-        )
-                | StrOutputParser()
-        )
-        result = chain.invoke({})
+        if not user_data:
+            cached_answer = answer_cache.get(question)
+            if cached_answer is not None:
+                return cached_answer
+
+        chain, inputs = build_consultation_request(question, user_data)
+        result = await ainvoke(chain, inputs, "consult")
         logger.info(f"Успешно сгенерирован ответ длиной {len(result)} символов")
+        if not user_data:
+            answer_cache.put(question, result)
         return result
 
+    except PromptTooLong as e:
+        logger.warning(f"Вопрос отклонён по бюджету токенов: {e}")
+        return TOO_LONG_ANSWER
+
     except Exception as e:
         logger.error(f"Ошибка при генерации ответа: {str(e)}", exc_info=True)
         return (
@@ -74,3 +98,27 @@ def get_consultation(question: str, user_data: dict = None) -> str:
         )
 
 
+async def stream_consultation(question: str, user_data: dict = None):
+    """
+    Потоковая версия get_consultation: отдаёт фрагменты ответа по мере генерации.
+    Ошибки не перехватываются — вызывающий код сам решает, как откатиться.
+    """
+    if not user_data:
+        cached_answer = answer_cache.get(question)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+
+    try:
+        chain, inputs = build_consultation_request(question, user_data)
+    except PromptTooLong as e:
+        logger.warning(f"Вопрос отклонён по бюджету токенов: {e}")
+        yield TOO_LONG_ANSWER
+        return
+
+    chunks = []
+    async for chunk in astream(chain, inputs, "consult"):
+        chunks.append(chunk)
+        yield chunk
+    if not user_data:
+        answer_cache.put(question, "".join(chunks))
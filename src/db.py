@@ -1,19 +1,15 @@
 import os
+import json
+import time
 import sqlite3
 import logging
-from cryptography.fernet import Fernet
+import threading
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 from dotenv import load_dotenv
+from profile_cache import ProfileCache
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('database.log'),
-        logging.StreamHandler()
-    ]
-)
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -21,15 +17,36 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DB_DIR = os.path.join(BASE_DIR, "data")
 os.makedirs(DB_DIR, exist_ok=True)
 
-DB_NAME = os.path.join(DB_DIR, "users.db")
+# DB_PATH позволяет указать другой файл базы (например, для нагрузочного теста)
+DB_NAME = os.getenv("DB_PATH") or os.path.join(DB_DIR, "users.db")
+
+# Параметры соединений SQLite
+DB_BUSY_TIMEOUT = float(os.getenv("DB_BUSY_TIMEOUT", "5"))
+DB_CACHE_SIZE_KB = int(os.getenv("DB_CACHE_SIZE_KB", "16384"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_STATEMENT_CACHE = int(os.getenv("DB_STATEMENT_CACHE", "128"))
 
-# Инициализация шифрования
+# Кэш расшифрованных профилей (только в памяти)
+profile_cache = ProfileCache(
+    max_entries=int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000")),
+    ttl=float(os.getenv("PROFILE_CACHE_TTL", "300")),
+    max_bytes=int(os.getenv("PROFILE_CACHE_MAX_BYTES", str(16 * 1024 * 1024)))
+)
+
+# Инициализация шифрования.
+# ENCRYPTION_KEY — текущий ключ (им шифруются новые данные),
+# ENCRYPTION_OLD_KEYS — прежние ключи через запятую, нужны только для чтения
+# во время ротации (см. rotate_key.py).
 ENCRYPTION_KEY = os.getenv("ENCRYPTION_KEY")
 if not ENCRYPTION_KEY:
-    logger.error("ENCRYPTION_KEY not found in .env! Generating new key...")
-    ENCRYPTION_KEY = Fernet.generate_key().decode()
+    # Новый случайный ключ сделал бы все сохранённые профили нечитаемыми
+    logger.critical("ENCRYPTION_KEY not found in .env! Generate one with generate_key.py")
+    raise RuntimeError("ENCRYPTION_KEY is not set")
+ENCRYPTION_OLD_KEYS = [
+    key.strip() for key in os.getenv("ENCRYPTION_OLD_KEYS", "").split(",") if key.strip()
+]
 
-cipher = Fernet(ENCRYPTION_KEY.encode())
+cipher = MultiFernet([Fernet(key.encode()) for key in [ENCRYPTION_KEY, *ENCRYPTION_OLD_KEYS]])
 
 def fix_padding(token: str) -> str:
     missing_padding = len(token) % 4
@@ -46,42 +63,328 @@ def decrypt_data(encrypted_data: str) -> str:
     fixed_token = fix_padding(encrypted_data)
     return cipher.decrypt(fixed_token.encode()).decode()
 
+def rotate_token(encrypted_data: str) -> str:
+    """Перешифровывает токен текущим ключом (данные, зашифрованные старым ключом)"""
+    fixed_token = fix_padding(encrypted_data)
+    return cipher.rotate(fixed_token.encode()).decode()
+
+# Форматы хранения профиля:
+# 1 — каждое чувствительное поле зашифровано отдельным токеном в своей колонке
+# 2 — все чувствительные поля сериализованы в JSON и зашифрованы одним токеном
+PROFILE_FORMAT_LEGACY = 1
+PROFILE_FORMAT_BLOB = 2
+SENSITIVE_FIELDS = ('age', 'weight', 'height', 'activity', 'diseases', 'allergies')
+
+def encrypt_profile(fields: dict) -> str:
+    """Шифрует чувствительные поля профиля одним токеном"""
+    payload = {key: fields.get(key) for key in SENSITIVE_FIELDS}
+    return encrypt_data(json.dumps(payload, ensure_ascii=False))
+
+def decrypt_profile(token: str) -> dict:
+    """Расшифровывает профиль, сохранённый в формате PROFILE_FORMAT_BLOB"""
+    return json.loads(decrypt_data(token))
+
+
+
+# --- ПУЛ СОЕДИНЕНИЙ ---
+# Соединения SQLite нельзя разделять между потоками, поэтому каждый поток
+# получает своё долгоживущее соединение, которое переиспользуется между вызовами.
+
+_local = threading.local()
+_connections = []
+_connections_lock = threading.Lock()
+
+
+def _configure_connection(conn: sqlite3.Connection) -> None:
+    """Включает WAL и настраивает прагмы производительности"""
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+
+
+def get_connection() -> sqlite3.Connection:
+    """Возвращает переиспользуемое соединение текущего потока"""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(
+            DB_NAME,
+            timeout=DB_BUSY_TIMEOUT,
+            check_same_thread=False,
+            cached_statements=DB_STATEMENT_CACHE
+        )
+        _configure_connection(conn)
+        _local.conn = conn
+        with _connections_lock:
+            _connections.append(conn)
+        logger.debug(f"Opened SQLite connection for thread {threading.current_thread().name}")
+    return conn
+
+
+def close_connections() -> None:
+    """Закрывает все открытые соединения (вызывается при остановке бота)"""
+    with _connections_lock:
+        for conn in _connections:
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                logger.error(f"Error closing connection: {e}")
+        _connections.clear()
+    _local.conn = None
+
+
+# Тексты запросов вынесены в константы: sqlite3 кэширует подготовленные
+# выражения по тексту SQL, поэтому одинаковая строка компилируется один раз.
+SQL_INSERT_USER = '''
+    INSERT INTO users (telegram_id, name, goal, profile, format_version)
+    VALUES (?, ?, ?, ?, ?)
+'''
+SQL_USER_EXISTS = "SELECT 1 FROM users WHERE telegram_id=?"
+SQL_SELECT_USER = '''
+    SELECT name, goal, format_version, profile, profile_version,
+           age, weight, height, activity, diseases, allergies
+    FROM users WHERE telegram_id=?
+'''
+SQL_SELECT_PROFILE_FOR_UPDATE = '''
+    SELECT format_version, profile, age, weight, height, activity, diseases, allergies
+    FROM users WHERE telegram_id=?
+'''
+SQL_INSERT_MEAL = "INSERT INTO meals (user_id, meal) VALUES (?, ?)"
+SQL_SELECT_MEALS = '''
+    SELECT meal, timestamp
+    FROM meals
+    WHERE user_id=?
+    ORDER BY timestamp DESC
+    LIMIT ?
+'''
+SQL_SELECT_USER_IDS = "SELECT telegram_id FROM users"
+SQL_SELECT_USER_IDS_CHUNK = "SELECT id, telegram_id FROM users WHERE id > ? ORDER BY id LIMIT ?"
+SQL_SELECT_PROFILES_CHUNK = '''
+    SELECT id, telegram_id, name, goal, format_version, profile, profile_version,
+           age, weight, height, activity, diseases, allergies
+    FROM users WHERE id > ? ORDER BY id LIMIT ?
+'''
+SQL_SELECT_LEGACY_PROFILES = '''
+    SELECT id, age, weight, height, activity, diseases, allergies
+    FROM users
+    WHERE id > ? AND format_version = 1
+    ORDER BY id
+    LIMIT ?
+'''
+SQL_UPGRADE_PROFILE = '''
+    UPDATE users
+    SET profile = ?, format_version = 2,
+        age = NULL, weight = NULL, height = NULL,
+        activity = NULL, diseases = NULL, allergies = NULL
+    WHERE id = ? AND format_version = 1
+'''
+SQL_SELECT_JOB_STATE = "SELECT started_at, last_id, finished_at FROM job_state WHERE name=?"
+SQL_UPSERT_JOB_STATE = '''
+    INSERT INTO job_state (name, started_at, last_id, finished_at, updated_at)
+    VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT(name) DO UPDATE SET
+        started_at = excluded.started_at,
+        last_id = excluded.last_id,
+        finished_at = excluded.finished_at,
+        updated_at = excluded.updated_at
+'''
+
+
+# --- МИГРАЦИИ СХЕМЫ ---
+# Каждая миграция — функция, получающая курсор. Номер применённой версии
+# хранится в PRAGMA user_version; новые миграции добавляются в конец списка.
+
+def _migration_001_initial(cursor):
+    """Базовые таблицы users и meals"""
+    # Таблица пользователей с новыми полями: height и activity
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER UNIQUE,
+            name TEXT,
+            age TEXT,
+            weight TEXT,
+            height TEXT,
+            activity TEXT,
+            goal TEXT,
+            diseases TEXT,
+            allergies TEXT
+        )
+    ''')
+
+    # Таблица приёмов пищи
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS meals (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            meal TEXT,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(telegram_id)
+        )
+    ''')
+
+def _migration_002_meals_index(cursor):
+    """Покрывающий индекс для get_meals: поиск по user_id без сортировки и чтения таблицы"""
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_meals_user_timestamp
+        ON meals (user_id, timestamp DESC, meal)
+    ''')
+
+def _migration_003_numeric_types(cursor):
+    """
+    Приводит числовые колонки к INTEGER
+    (возраст, вес и рост хранятся зашифрованными токенами и остаются TEXT)
+    """
+    cursor.execute('''
+        UPDATE users SET telegram_id = CAST(telegram_id AS INTEGER)
+        WHERE typeof(telegram_id) != 'integer' AND telegram_id GLOB '[0-9]*'
+    ''')
+    cursor.execute('''
+        UPDATE meals SET user_id = CAST(user_id AS INTEGER)
+        WHERE typeof(user_id) != 'integer' AND user_id GLOB '[0-9]*'
+    ''')
+
+def _migration_004_profile_blob(cursor):
+    """Колонки для профиля, зашифрованного одним токеном, и маркер формата"""
+    cursor.execute("ALTER TABLE users ADD COLUMN profile TEXT")
+    cursor.execute("ALTER TABLE users ADD COLUMN format_version INTEGER NOT NULL DEFAULT 1")
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_users_format_version
+        ON users (format_version, id)
+    ''')
+
+def _migration_005_profile_version(cursor):
+    """Версия профиля, увеличивается при каждом изменении данных пользователя"""
+    cursor.execute("ALTER TABLE users ADD COLUMN profile_version INTEGER NOT NULL DEFAULT 1")
+
+def _migration_006_plan_cache(cursor):
+    """Таблица кэша планов питания"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS nutrition_plans (
+            cache_key TEXT PRIMARY KEY,
+            plan TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_nutrition_plans_accessed
+        ON nutrition_plans (accessed_at)
+    ''')
+
+def _migration_007_job_state(cursor):
+    """Контрольные точки фоновых задач (для продолжения после сбоя)"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS job_state (
+            name TEXT PRIMARY KEY,
+            started_at REAL NOT NULL,
+            last_id INTEGER NOT NULL DEFAULT 0,
+            finished_at REAL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+def _migration_008_recipe_images(cursor):
+    """Индекс картинок рецептов по нормализованному названию блюда"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recipe_images (
+            title_key TEXT PRIMARY KEY,
+            title TEXT NOT NULL,
+            sha256 TEXT NOT NULL,
+            path TEXT NOT NULL,
+            file_id TEXT,
+            size INTEGER NOT NULL DEFAULT 0,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recipe_images_sha256
+        ON recipe_images (sha256)
+    ''')
+
+def _migration_009_recipes(cursor):
+    """Хранилище рецептов и обратный индекс по токенам ингредиентов"""
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recipes (
+            id INTEGER PRIMARY KEY,
+            ingredients_key TEXT NOT NULL,
+            goal INTEGER NOT NULL,
+            allergies_key TEXT NOT NULL,
+            token_count INTEGER NOT NULL,
+            recipe TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            accessed_at REAL NOT NULL,
+            hits INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_recipes_key
+        ON recipes (ingredients_key, goal, allergies_key)
+    ''')
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_recipes_accessed
+        ON recipes (accessed_at)
+    ''')
+    # Постинги отсортированы по (токен, цель, число токенов), поэтому поиск
+    # кандидатов — короткий просмотр диапазона первичного ключа
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recipe_tokens (
+            token TEXT NOT NULL,
+            goal INTEGER NOT NULL,
+            token_count INTEGER NOT NULL,
+            recipe_id INTEGER NOT NULL,
+            PRIMARY KEY (token, goal, token_count, recipe_id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS recipe_token_df (
+            token TEXT PRIMARY KEY,
+            df INTEGER NOT NULL
+        ) WITHOUT ROWID
+    ''')
+
+MIGRATIONS = [
+    _migration_001_initial,
+    _migration_002_meals_index,
+    _migration_003_numeric_types,
+    _migration_004_profile_blob,
+    _migration_005_profile_version,
+    _migration_006_plan_cache,
+    _migration_007_job_state,
+    _migration_008_recipe_images,
+    _migration_009_recipes,
+]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations(conn: sqlite3.Connection) -> int:
+    """Применяет недостающие миграции, каждую в своей транзакции"""
+    version = get_schema_version(conn)
+    for number, migration in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+        logger.info(f"Applying migration {number}: {migration.__doc__.strip().splitlines()[0]}")
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migration(conn.cursor())
+            conn.execute(f"PRAGMA user_version={number}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version = number
+    return version
+
 def init_db():
-    """Инициализирует базу данных с таблицами users и meals"""
+    """Инициализирует базу данных и применяет миграции схемы"""
     try:
         logger.info(f"Initializing database at: {DB_NAME}")
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-
-            # Таблица пользователей с новыми полями: height и activity
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    telegram_id INTEGER UNIQUE,
-                    name TEXT,
-                    age TEXT,
-                    weight TEXT,
-                    height TEXT,
-                    activity TEXT,
-                    goal TEXT,
-                    diseases TEXT,
-                    allergies TEXT
-                )
-            ''')
-
-            # Таблица приёмов пищи
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS meals (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER,
-                    meal TEXT,
-                    timestamp DATETIME DEFAULT CURRENT_TIMESTAMP,
-                    FOREIGN KEY(user_id) REFERENCES users(telegram_id)
-                )
-            ''')
-
-            conn.commit()
-            logger.info("Database tables created successfully")
+        version = run_migrations(get_connection())
+        logger.info(f"Database schema is at version {version}")
     except sqlite3.Error as e:
         logger.error(f"Database initialization error: {e}")
         raise
@@ -90,32 +393,24 @@ def add_user(telegram_id: int, name: str, age: str, weight: str,
              height: str, activity: str, goal: str, diseases: str, allergies: str) -> bool:
     """Добавляет нового пользователя с шифрованием данных"""
     try:
-        encrypted_data = {
-            'age': encrypt_data(age),
-            'weight': encrypt_data(weight),
-            'height': encrypt_data(height),
-            'diseases': encrypt_data(diseases),
-            'allergies': encrypt_data(allergies),
-            'activity': encrypt_data(activity)
-        }
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO users (
-                    telegram_id, name, age, weight, height, activity, goal, diseases, allergies
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
+        encrypted_profile = encrypt_profile({
+            'age': age,
+            'weight': weight,
+            'height': height,
+            'activity': activity,
+            'diseases': diseases,
+            'allergies': allergies
+        })
+        conn = get_connection()
+        with conn:
+            conn.execute(SQL_INSERT_USER, (
                 telegram_id,
                 name,
-                encrypted_data['age'],
-                encrypted_data['weight'],
-                encrypted_data['height'],
-                encrypted_data['activity'],
                 goal,
-                encrypted_data['diseases'],
-                encrypted_data['allergies']
+                encrypted_profile,
+                PROFILE_FORMAT_BLOB
             ))
-            conn.commit()
+        profile_cache.invalidate(telegram_id)
         logger.info(f"User {telegram_id} added successfully")
         return True
     except sqlite3.IntegrityError:
@@ -125,40 +420,129 @@ def add_user(telegram_id: int, name: str, age: str, weight: str,
         logger.error(f"Error adding user: {e}")
         return False
 
+def _decrypt_legacy_fields(values) -> dict:
+    """Расшифровывает поля профиля, сохранённого в PROFILE_FORMAT_LEGACY"""
+    return {
+        key: decrypt_data(value) if value is not None else None
+        for key, value in zip(SENSITIVE_FIELDS, values)
+    }
+
+def _row_to_user_data(result) -> dict:
+    """Расшифровывает строку (name, goal, format_version, profile, profile_version, поля формата 1...)"""
+    name, goal, format_version, profile, profile_version = result[:5]
+    if format_version == PROFILE_FORMAT_BLOB:
+        fields = decrypt_profile(profile)
+    else:
+        fields = _decrypt_legacy_fields(result[5:])
+    return {
+        'name': name,
+        'age': fields.get('age'),
+        'weight': fields.get('weight'),
+        'height': fields.get('height'),
+        'activity': fields.get('activity'),
+        'goal': goal,
+        'diseases': fields.get('diseases'),
+        'allergies': fields.get('allergies'),
+        'profile_version': profile_version
+    }
+
+def _load_user_data(telegram_id: int) -> dict:
+    """Читает профиль из БД, расшифровывает и кладёт в кэш"""
+    # Поколение берётся до SELECT: если профиль изменят во время чтения, put его не сохранит
+    generation = profile_cache.generation(telegram_id)
+    cursor = get_connection().execute(SQL_SELECT_USER, (telegram_id,))
+    result = cursor.fetchone()
+    if not result:
+        return {}
+    decrypted_data = _row_to_user_data(result)
+    profile_cache.put(telegram_id, decrypted_data, generation)
+    return decrypted_data
+
+# Поля профиля, которые можно менять через update_user_fields
+PLAIN_FIELDS = ('name', 'goal')
+UPDATABLE_FIELDS = PLAIN_FIELDS + SENSITIVE_FIELDS
+
+def update_user_fields(telegram_id: int, **fields) -> bool:
+    """
+    Частично обновляет профиль существующего пользователя одним UPDATE.
+    Чувствительные поля объединяются с текущими и перешифровываются одним
+    токеном; остальные колонки не трогаются. profile_version увеличивается.
+    Для незарегистрированного пользователя ничего не создаётся — возвращается False.
+    """
+    unknown = set(fields) - set(UPDATABLE_FIELDS)
+    if unknown:
+        logger.error(f"Unknown profile fields for update: {sorted(unknown)}")
+        return False
+    if not fields:
+        return True
+
+    plain = {key: fields[key] for key in PLAIN_FIELDS if key in fields}
+    sensitive = {key: fields[key] for key in SENSITIVE_FIELDS if key in fields}
+    conn = get_connection()
+    try:
+        # Блокировка на запись берётся сразу: профиль не изменится между чтением и UPDATE
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            columns = dict(plain)
+            assignments = [f"{column} = ?" for column in plain]
+            if sensitive:
+                row = conn.execute(SQL_SELECT_PROFILE_FOR_UPDATE, (telegram_id,)).fetchone()
+                if row is None:
+                    conn.rollback()
+                    logger.warning(f"User {telegram_id} not found, profile is not updated")
+                    return False
+                if row[0] == PROFILE_FORMAT_BLOB and row[1]:
+                    current = decrypt_profile(row[1])
+                else:
+                    current = _decrypt_legacy_fields(row[2:])
+                current.update(sensitive)
+                columns['profile'] = encrypt_profile(current)
+                columns['format_version'] = PROFILE_FORMAT_BLOB
+                assignments += ["profile = ?", "format_version = ?"]
+                assignments += [f"{column} = NULL" for column in SENSITIVE_FIELDS]
+            assignments.append("profile_version = profile_version + 1")
+
+            updated = conn.execute(
+                f"UPDATE users SET {', '.join(assignments)} WHERE telegram_id = ?",
+                (*columns.values(), telegram_id)
+            ).rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if not updated:
+            logger.warning(f"User {telegram_id} not found, profile is not updated")
+            return False
+        logger.info(f"User {telegram_id} updated fields: {sorted(fields)}")
+        return True
+    except Exception as e:
+        logger.error(f"Error updating user {telegram_id}: {e}")
+        return False
+    finally:
+        profile_cache.invalidate(telegram_id)
+
 def is_user_registered(telegram_id: int) -> bool:
     """Проверяет регистрацию пользователя"""
+    if profile_cache.get(telegram_id) is not None:
+        return True
     try:
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT 1 FROM users WHERE telegram_id=?", (telegram_id,))
-            return bool(cursor.fetchone())
+        # Сразу загружаем профиль: следующий get_user_data возьмёт его из кэша
+        return bool(_load_user_data(telegram_id))
     except sqlite3.Error as e:
         logger.error(f"Registration check error: {e}")
         return False
+    except Exception as e:
+        logger.error(f"Error loading profile for registration check: {e}")
+        cursor = get_connection().execute(SQL_USER_EXISTS, (telegram_id,))
+        return bool(cursor.fetchone())
 
 def get_user_data(telegram_id: int) -> dict:
     """Возвращает расшифрованные данные пользователя"""
+    cached = profile_cache.get(telegram_id)
+    if cached is not None:
+        return cached
     try:
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT name, age, weight, height, activity, goal, diseases, allergies 
-                FROM users WHERE telegram_id=?
-            ''', (telegram_id,))
-            result = cursor.fetchone()
-            if not result:
-                return {}
-            decrypted_data = {
-                'name': result[0],
-                'age': decrypt_data(result[1]),
-                'weight': decrypt_data(result[2]),
-                'height': decrypt_data(result[3]),
-                'activity': decrypt_data(result[4]),
-                'goal': result[5],
-                'diseases': decrypt_data(result[6]),
-                'allergies': decrypt_data(result[7])
-            }
-            return decrypted_data
+        return _load_user_data(telegram_id)
     except sqlite3.Error as e:
         logger.error(f"Error getting user data: {e}")
         return {}
@@ -166,32 +550,42 @@ def get_user_data(telegram_id: int) -> dict:
 def add_meal(telegram_id: int, meal: str) -> bool:
     """Добавляет запись о приёме пищи"""
     try:
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                INSERT INTO meals (user_id, meal)
-                VALUES (?, ?)
-            ''', (telegram_id, meal))
-            conn.commit()
+        conn = get_connection()
+        with conn:
+            conn.execute(SQL_INSERT_MEAL, (telegram_id, meal))
         logger.info(f"Meal added for user {telegram_id}")
         return True
     except sqlite3.Error as e:
         logger.error(f"Error adding meal: {e}")
         return False
 
+def add_meals_batch(rows: list) -> list:
+    """
+    Добавляет пачку записей (telegram_id, meal) одной транзакцией.
+    Возвращает список результатов по каждой строке.
+    """
+    results = []
+    try:
+        conn = get_connection()
+        with conn:
+            for telegram_id, meal in rows:
+                try:
+                    conn.execute(SQL_INSERT_MEAL, (telegram_id, meal))
+                    results.append(True)
+                except sqlite3.IntegrityError as e:
+                    logger.error(f"Error adding meal for user {telegram_id}: {e}")
+                    results.append(False)
+    except sqlite3.Error as e:
+        logger.error(f"Error adding meals batch: {e}")
+        return [False] * len(rows)
+    logger.info(f"Meals batch committed: {sum(results)} of {len(rows)} rows")
+    return results
+
 def get_meals(telegram_id: int, limit: int = 10) -> list:
     """Возвращает последние записи о питании"""
     try:
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute('''
-                SELECT meal, timestamp 
-                FROM meals 
-                WHERE user_id=?
-                ORDER BY timestamp DESC
-                LIMIT ?
-            ''', (telegram_id, limit))
-            return cursor.fetchall()
+        cursor = get_connection().execute(SQL_SELECT_MEALS, (telegram_id, limit))
+        return cursor.fetchall()
     except sqlite3.Error as e:
         logger.error(f"Error getting meals: {e}")
         return []
@@ -199,15 +593,86 @@ def get_meals(telegram_id: int, limit: int = 10) -> list:
 def get_all_users() -> list:
     """Возвращает список всех зарегистрированных пользователей"""
     try:
-        with sqlite3.connect(DB_NAME) as conn:
-            cursor = conn.cursor()
-            cursor.execute("SELECT telegram_id FROM users")
-            return [row[0] for row in cursor.fetchall()]
+        cursor = get_connection().execute(SQL_SELECT_USER_IDS)
+        return [row[0] for row in cursor.fetchall()]
     except sqlite3.Error as e:
         logger.error(f"Error getting users: {e}")
         return []
 
+def get_user_ids_chunk(after_id: int = 0, limit: int = 1000) -> list:
+    """
+    Возвращает следующую порцию пользователей [(id, telegram_id), ...]
+    после первичного ключа after_id (keyset-пагинация).
+    """
+    try:
+        cursor = get_connection().execute(SQL_SELECT_USER_IDS_CHUNK, (after_id, limit))
+        return cursor.fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Error getting users chunk: {e}")
+        return []
+
+def get_profiles_chunk(after_id: int = 0, limit: int = 1000) -> list:
+    """
+    Порция расшифрованных профилей [(id, telegram_id, user_data), ...] после
+    after_id одним запросом. Профили не попадают в profile_cache, чтобы
+    массовые проходы не вытесняли из него активных пользователей.
+    Для профилей, которые не удалось расшифровать, user_data — пустой словарь.
+    """
+    try:
+        rows = get_connection().execute(SQL_SELECT_PROFILES_CHUNK, (after_id, limit)).fetchall()
+    except sqlite3.Error as e:
+        logger.error(f"Error getting profiles chunk: {e}")
+        return []
+    profiles = []
+    for row in rows:
+        try:
+            user_data = _row_to_user_data(row[2:])
+        except (InvalidToken, ValueError) as e:
+            logger.error(f"Error decrypting profile of user {row[1]}: {e!r}")
+            user_data = {}
+        profiles.append((row[0], row[1], user_data))
+    return profiles
 
+def iter_user_ids(chunk_size: int = 1000):
+    """Генератор telegram_id всех пользователей без загрузки списка целиком"""
+    after_id = 0
+    while True:
+        rows = get_user_ids_chunk(after_id, chunk_size)
+        if not rows:
+            return
+        for _, telegram_id in rows:
+            yield telegram_id
+        after_id = rows[-1][0]
 
+def migrate_profiles_chunk(after_id: int = 0, chunk_size: int = 500) -> tuple:
+    """
+    Переводит порцию профилей из PROFILE_FORMAT_LEGACY в PROFILE_FORMAT_BLOB
+    одной транзакцией. Возвращает (последний обработанный id, число перенесённых
+    строк); id равен None, когда старых профилей больше нет.
+    """
+    conn = get_connection()
+    rows = conn.execute(SQL_SELECT_LEGACY_PROFILES, (after_id, chunk_size)).fetchall()
+    if not rows:
+        return None, 0
+    updates = []
+    for row in rows:
+        try:
+            updates.append((encrypt_profile(_decrypt_legacy_fields(row[1:])), row[0]))
+        except Exception as e:
+            logger.error(f"Cannot migrate profile row {row[0]}: {e}")
+    with conn:
+        cursor = conn.executemany(SQL_UPGRADE_PROFILE, updates)
+    return rows[-1][0], cursor.rowcount
 
+def get_job_state(name: str):
+    """Состояние фоновой задачи: {'started_at', 'last_id', 'finished_at'} или None"""
+    row = get_connection().execute(SQL_SELECT_JOB_STATE, (name,)).fetchone()
+    if row is None:
+        return None
+    return {'started_at': row[0], 'last_id': row[1], 'finished_at': row[2]}
 
+def save_job_state(name: str, started_at: float, last_id: int, finished_at: float = None) -> None:
+    """Сохраняет контрольную точку фоновой задачи"""
+    conn = get_connection()
+    with conn:
+        conn.execute(SQL_UPSERT_JOB_STATE, (name, started_at, last_id, finished_at, time.time()))
@@ -0,0 +1,166 @@
+# energy.py
+"""
+Локальный расчёт энергии и макроэлементов для плана питания.
+
+BMR считается по формуле Mifflin-St Jeor, суточная потребность (TDEE) —
+умножением на коэффициент уровня активности, выбранного при регистрации.
+Затем калорийность корректируется под цель и раскладывается на белки,
+жиры и углеводы. Есть пакетный режим на NumPy для расчёта сразу по всем
+пользователям.
+"""
+import math
+
+import numpy as np
+
+# Коэффициенты активности для вариантов 1️⃣–5️⃣ из регистрации
+ACTIVITY_FACTORS = {
+    1: 1.2,     # минимальный (сидячий образ жизни)
+    2: 1.375,   # низкий (1-2 тренировки в неделю)
+    3: 1.55,    # средний (3-4 тренировки в неделю)
+    4: 1.725,   # высокий (5-7 тренировок в неделю)
+    5: 1.9      # очень высокий (ежедневные интенсивные тренировки)
+}
+DEFAULT_ACTIVITY_LEVEL = 1
+
+# Поправка к калорийности и белок (г на кг веса) для каждой цели
+GOALS = {
+    "похудение": {"adjustment": -0.15, "protein_per_kg": 1.8},
+    "набор массы": {"adjustment": 0.10, "protein_per_kg": 2.0},
+    "поддержание здоровья": {"adjustment": 0.0, "protein_per_kg": 1.5}
+}
+DEFAULT_GOAL = "поддержание здоровья"
+GOAL_CODES = {goal: code for code, goal in enumerate(GOALS)}
+
+# Постоянная часть формулы Mifflin-St Jeor; пол при регистрации не
+# спрашивается, поэтому без него берётся среднее между мужской и женской
+GENDER_OFFSETS = {"male": 5.0, "female": -161.0}
+UNKNOWN_GENDER_OFFSET = (GENDER_OFFSETS["male"] + GENDER_OFFSETS["female"]) / 2
+
+# Значения для пустых или некорректных полей профиля
+DEFAULT_WEIGHT = 70.0
+DEFAULT_HEIGHT = 170.0
+DEFAULT_AGE = 30
+
+FAT_SHARE = 0.25          # доля калорий из жиров
+MIN_CALORIES = 1200.0     # нижняя граница рекомендуемой калорийности
+KCAL_PER_G_PROTEIN = 4.0
+KCAL_PER_G_FAT = 9.0
+KCAL_PER_G_CARBS = 4.0
+
+
+def parse_number(value, default: float) -> float:
+    """Положительное число из поля профиля; пустое или некорректное значение заменяется default"""
+    try:
+        number = float(str(value).strip().replace(",", "."))
+    except (TypeError, ValueError):
+        return default
+    return number if math.isfinite(number) and number > 0 else default
+
+
+def parse_activity_level(activity) -> int:
+    """Номер уровня активности (1–5) из строки вида '3️⃣ Средний (...)'"""
+    if isinstance(activity, int):
+        level = activity
+    else:
+        text = str(activity or "").strip()
+        level = int(text[0]) if text[:1].isdigit() else DEFAULT_ACTIVITY_LEVEL
+    return level if level in ACTIVITY_FACTORS else DEFAULT_ACTIVITY_LEVEL
+
+
+def normalize_goal(goal) -> str:
+    goal = str(goal or "").strip().lower()
+    return goal if goal in GOALS else DEFAULT_GOAL
+
+
+def gender_offset(gender) -> float:
+    return GENDER_OFFSETS.get(str(gender or "").strip().lower(), UNKNOWN_GENDER_OFFSET)
+
+
+def mifflin_st_jeor(weight: float, height: float, age: float, gender=None) -> float:
+    """BMR = 10*вес + 6.25*рост - 5*возраст + (5 для мужчин / -161 для женщин)"""
+    return 10 * weight + 6.25 * height - 5 * age + gender_offset(gender)
+
+
+def compute_targets(weight: float, height: float, age: float,
+                    activity=None, goal=None, gender=None) -> dict:
+    """Суточные цели по калориям и макроэлементам для одного пользователя"""
+    batch = compute_targets_batch(
+        weights=[float(weight)],
+        heights=[float(height)],
+        ages=[float(age)],
+        activity_levels=[parse_activity_level(activity)],
+        goal_codes=[GOAL_CODES[normalize_goal(goal)]],
+        gender_offsets=[gender_offset(gender)]
+    )
+    return round_targets(batch)[0]
+
+
+def compute_targets_batch(weights, heights, ages, activity_levels, goal_codes, gender_offsets) -> dict:
+    """
+    Векторный расчёт целей для массива пользователей.
+    Все аргументы — последовательности одинаковой длины; goal_codes — индексы
+    из GOAL_CODES. Возвращает словарь массивов NumPy.
+    """
+    weights = np.asarray(weights, dtype=np.float64)
+    heights = np.asarray(heights, dtype=np.float64)
+    ages = np.asarray(ages, dtype=np.float64)
+    levels = np.asarray(activity_levels, dtype=np.int64)
+    goal_codes = np.asarray(goal_codes, dtype=np.int64)
+    offsets = np.asarray(gender_offsets, dtype=np.float64)
+
+    factor_table = np.zeros(max(ACTIVITY_FACTORS) + 1)
+    for level, factor in ACTIVITY_FACTORS.items():
+        factor_table[level] = factor
+    adjustment_table = np.array([goal["adjustment"] for goal in GOALS.values()])
+    protein_table = np.array([goal["protein_per_kg"] for goal in GOALS.values()])
+
+    bmr = 10 * weights + 6.25 * heights - 5 * ages + offsets
+    activity_factor = factor_table[levels]
+    tdee = bmr * activity_factor
+    calories = np.maximum(tdee * (1 + adjustment_table[goal_codes]), MIN_CALORIES)
+
+    protein_g = weights * protein_table[goal_codes]
+    fat_g = calories * FAT_SHARE / KCAL_PER_G_FAT
+    carbs_kcal = calories - protein_g * KCAL_PER_G_PROTEIN - fat_g * KCAL_PER_G_FAT
+    carbs_g = np.maximum(carbs_kcal, 0) / KCAL_PER_G_CARBS
+
+    return {
+        "bmr": bmr,
+        "tdee": tdee,
+        "calories": calories,
+        "protein_g": protein_g,
+        "fat_g": fat_g,
+        "carbs_g": carbs_g
+    }
+
+
+def round_targets(batch: dict) -> list:
+    """Результат compute_targets_batch в виде списка словарей с целыми значениями"""
+    # np.rint, как и round(), округляет половины к чётному
+    columns = {key: np.rint(values).astype(np.int64).tolist() for key, values in batch.items()}
+    return [dict(zip(columns, row)) for row in zip(*columns.values())]
+
+
+def profile_values(profile: dict) -> dict:
+    """Разобранные поля профиля, от которых зависят цели; вместо пустых и некорректных — значения по умолчанию"""
+    return {
+        "weight": parse_number(profile.get("weight"), DEFAULT_WEIGHT),
+        "height": parse_number(profile.get("height"), DEFAULT_HEIGHT),
+        "age": int(parse_number(profile.get("age"), DEFAULT_AGE)),
+        "gender": profile.get("gender"),
+        "activity": parse_activity_level(profile.get("activity")),
+        "goal": normalize_goal(profile.get("goal"))
+    }
+
+
+def profiles_to_arrays(profiles: list) -> dict:
+    """Готовит аргументы compute_targets_batch из списка профилей (словарей get_user_data)"""
+    values = [profile_values(p) for p in profiles]
+    return {
+        "weights": [v["weight"] for v in values],
+        "heights": [v["height"] for v in values],
+        "ages": [v["age"] for v in values],
+        "activity_levels": [v["activity"] for v in values],
+        "goal_codes": [GOAL_CODES[v["goal"]] for v in values],
+        "gender_offsets": [gender_offset(v["gender"]) for v in values]
+    }
@@ -1,15 +1,37 @@
 import os
-import requests
-import datetime
+import uuid
+import hashlib
+import asyncio
 import logging
 
-logger = logging.getLogger(__name__)
+import httpx
 
-# Получаем API-ключ из переменной окружения
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+from llm import OPENAI_API_KEY, OPENAI_BASE_URL
+from image_cache import finalize_image
 
+logger = logging.getLogger(__name__)
 
-def generate_image(prompt: str) -> str:
+# Генерация картинки может занимать десятки секунд, поэтому таймаут чтения
+# больше, чем у остальных запросов; соединение должно устанавливаться быстро
+IMAGE_CONNECT_TIMEOUT = float(os.getenv("IMAGE_CONNECT_TIMEOUT", "10"))
+IMAGE_READ_TIMEOUT = float(os.getenv("IMAGE_READ_TIMEOUT", "90"))
+# Сколько картинок генерируется и скачивается одновременно
+IMAGE_MAX_CONCURRENCY = int(os.getenv("IMAGE_MAX_CONCURRENCY", "4"))
+IMAGE_DOWNLOAD_CHUNK = 64 * 1024
+IMAGE_DIR = os.getenv("IMAGE_DIR", "images")
+
+# Общий пул соединений для запросов генерации и скачивания картинок
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=IMAGE_MAX_CONCURRENCY * 2,
+        max_keepalive_connections=IMAGE_MAX_CONCURRENCY * 2
+    ),
+    timeout=httpx.Timeout(IMAGE_READ_TIMEOUT, connect=IMAGE_CONNECT_TIMEOUT)
+)
+_semaphore = asyncio.Semaphore(IMAGE_MAX_CONCURRENCY)
+
+
+async def generate_image(prompt: str) -> str:
     """
     Отправляет запрос к DALL·E для генерации изображения на основе текстового описания.
 
@@ -26,7 +48,13 @@ def generate_image(prompt: str) -> str:
         "n": 1,  # Количество изображений
         "size": "1024x1024"  # Размер изображения
     }
-    response = requests.post("https://api.openai.com/v1/images/generations", headers=headers, json=data)
+    try:
+        response = await http_client.post(
+            f"{OPENAI_BASE_URL.rstrip('/')}/images/generations", headers=headers, json=data
+        )
+    except httpx.HTTPError as e:
+        logger.error("Ошибка запроса генерации изображения: %s", e)
+        return None
     if response.status_code == 200:
         result = response.json()
         return result['data'][0]['url']
@@ -35,44 +63,56 @@ def generate_image(prompt: str) -> str:
         return None
 
 
-def generate_recipe_image(recipe_prompt: str) -> str:
+async def download_image(image_url: str, image_dir: str = IMAGE_DIR) -> str:
     """
-    Генерирует изображение для рецепта, скачивает его и сохраняет в папку 'images'.
-    Принимает визуально ориентированный промпт и возвращает путь к сохранённому файлу или None в случае ошибки.
-
-    :param recipe_prompt: Текстовое описание для генерации изображения.
-    :return: Путь к сохранённому файлу или None.
+    Скачивает изображение по частям прямо на диск, не держа его целиком в памяти
+    и считая sha256 на лету, затем пережимает его и сохраняет под именем sha256 содержимого
+    (image_cache.finalize_image): одинаковые картинки занимают один файл,
+    а имена одновременных загрузок не пересекаются.
+    Возвращает путь к файлу или None.
     """
-    image_url = generate_image(recipe_prompt)
-    if not image_url:
-        return None
-
+    os.makedirs(image_dir, exist_ok=True)
+    tmp_path = os.path.join(image_dir, f".{uuid.uuid4().hex}.part")
     try:
-        image_response = requests.get(image_url)
-        image_response.raise_for_status()
+        async with http_client.stream("GET", image_url) as response:
+            response.raise_for_status()
+            digest = hashlib.sha256()
+            with open(tmp_path, "wb") as f:
+                async for chunk in response.aiter_bytes(IMAGE_DOWNLOAD_CHUNK):
+                    f.write(chunk)
+                    digest.update(chunk)
+        return await asyncio.to_thread(finalize_image, tmp_path, image_dir, digest=digest.hexdigest())
     except Exception as e:
         logger.error("Ошибка при скачивании изображения: %s", e, exc_info=True)
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
         return None
 
-    image_dir = "images"
-    os.makedirs(image_dir, exist_ok=True)
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"recipe_{timestamp}.png"
-    file_path = os.path.join(image_dir, filename)
 
-    with open(file_path, "wb") as f:
-        f.write(image_response.content)
+async def generate_recipe_image(recipe_prompt: str) -> str:
+    """
+    Генерирует изображение для рецепта, скачивает его и сохраняет в папку IMAGE_DIR.
+    Принимает визуально ориентированный промпт и возвращает путь к сохранённому файлу или None в случае ошибки.
 
-    return file_path
+    :param recipe_prompt: Текстовое описание для генерации изображения.
+    :return: Путь к сохранённому файлу или None.
+    """
+    async with _semaphore:
+        image_url = await generate_image(recipe_prompt)
+        if not image_url:
+            return None
+        return await download_image(image_url)
+
+
+async def close() -> None:
+    """Закрывает пул соединений"""
+    await http_client.aclose()
 
 
 if __name__ == "__main__":
     prompt = "Фотография аппетитного блюда 'Омлет с грибами и сыром', студийное освещение, высокое качество, яркие цвета"
-    saved_image_path = generate_recipe_image(prompt)
+    saved_image_path = asyncio.run(generate_recipe_image(prompt))
     if saved_image_path:
         print(f"Изображение сохранено: {saved_image_path}")
     else:
         print("Не удалось сгенерировать или сохранить изображение.")
-
-
-
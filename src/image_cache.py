@@ -0,0 +1,169 @@
+# image_cache.py
+"""
+Каталог картинок рецептов с ограничением размера на диске.
+
+Перед сохранением картинка уменьшается до
+IMAGE_MAX_SIDE пикселей по большей стороне и пережимается в JPEG или WebP —
+Telegram всё равно показывает фото в таком разрешении, а загружать
+приходится в разы меньше байт. Файл называется sha256 своего содержимого.
+
+Порядок LRU хранится во времени изменения файлов (при каждом использовании
+оно обновляется), поэтому после перезапуска индекс восстанавливается простым
+сканированием каталога. Когда занятое место превышает квоту, удаляются
+давно не использованные файлы.
+"""
+import os
+import io
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow из requirements.txt не установлен — картинки сохраняются как есть
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("IMAGE_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+IMAGE_MAX_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "800"))
+IMAGE_FORMAT = os.getenv("IMAGE_FORMAT", "jpeg").lower()  # jpeg, webp или png (без пережатия)
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+IMAGE_HASH_CHUNK = 64 * 1024
+
+_EXTENSIONS = {"jpeg": ".jpg", "webp": ".webp", "png": ".png"}
+
+
+def check_reencoding() -> bool:
+    """Проверяет при запуске, что картинки будут пережиматься; иначе пишет предупреждение"""
+    if IMAGE_FORMAT in ("jpeg", "webp") and Image is None:
+        logger.warning("Pillow не установлен: картинки рецептов сохраняются и загружаются в исходном размере")
+        return False
+    return True
+
+
+def file_sha256(path: str) -> str:
+    """sha256 файла, прочитанного по частям"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(IMAGE_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def reencode(path: str):
+    """
+    Уменьшает и пережимает картинку из файла под показ в Telegram.
+    Возвращает (байты, расширение) или None, если пережатие выключено или невозможно.
+    """
+    if Image is None or IMAGE_FORMAT not in ("jpeg", "webp"):
+        return None
+    try:
+        with Image.open(path) as image:
+            image = image.convert("RGB")
+            image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+            output = io.BytesIO()
+            image.save(output, format=IMAGE_FORMAT.upper(), quality=IMAGE_QUALITY, optimize=True)
+        return output.getvalue(), _EXTENSIONS[IMAGE_FORMAT]
+    except Exception as e:
+        logger.warning(f"Не удалось пережать картинку, сохраняется оригинал: {e}")
+        return None
+
+
+def finalize_image(tmp_path: str, image_dir: str, extension: str = ".png", digest: str = None) -> str:
+    """
+    Превращает скачанный файл в итоговый: пережимает (если возможно) и
+    сохраняет под именем <sha256>.<расширение>. Возвращает путь к файлу.
+    digest — sha256 файла, посчитанный при скачивании; без него оригинал
+    хэшируется по частям.
+    """
+    processed = reencode(tmp_path)
+    if processed is not None:
+        data, extension = processed
+        logger.debug(f"Картинка пережата: {os.path.getsize(tmp_path)} -> {len(data)} байт")
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        digest = hashlib.sha256(data).hexdigest()
+    elif digest is None:
+        digest = file_sha256(tmp_path)
+    file_path = os.path.join(image_dir, digest + extension)
+    os.replace(tmp_path, file_path)
+    return file_path
+
+
+class ImageCache:
+    """LRU-индекс файлов каталога картинок с квотой на занятое место"""
+
+    def __init__(self, directory: str, max_bytes: int = IMAGE_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.evicted_files = 0
+        self.evicted_bytes = 0
+        self._files = OrderedDict()  # путь -> размер, от давно не использованных к свежим
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def rebuild(self) -> dict:
+        """Восстанавливает индекс по содержимому каталога и удаляет недокачанные файлы"""
+        entries = []
+        if os.path.isdir(self.directory):
+            for entry in os.scandir(self.directory):
+                if not entry.is_file():
+                    continue
+                if entry.name.endswith(".part"):
+                    os.remove(entry.path)
+                    continue
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+        entries.sort()
+        with self._lock:
+            self._files = OrderedDict((path, size) for _, path, size in entries)
+            self._bytes = sum(self._files.values())
+            self._evict()
+        usage = self.usage()
+        logger.info(f"Image cache: {usage['files']} files, {usage['bytes'] / 1024 / 1024:.1f} MB")
+        return usage
+
+    def add(self, path: str) -> None:
+        """Добавляет файл в индекс и при превышении квоты удаляет старые файлы"""
+        size = os.path.getsize(path)
+        with self._lock:
+            self._bytes += size - self._files.pop(path, 0)
+            self._files[path] = size
+            self._evict(keep=path)
+
+    def touch(self, path: str) -> None:
+        """Отмечает использование файла (и в индексе, и во времени изменения на диске)"""
+        with self._lock:
+            if path in self._files:
+                self._files.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def usage(self) -> dict:
+        with self._lock:
+            return {
+                'files': len(self._files),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'evicted_files': self.evicted_files,
+                'evicted_bytes': self.evicted_bytes
+            }
+
+    def _evict(self, keep: str = None) -> None:
+        while self._bytes > self.max_bytes and self._files:
+            path, size = next(iter(self._files.items()))
+            if path == keep:
+                break
+            del self._files[path]
+            self._bytes -= size
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"Не удалось удалить {path}: {e}")
+            self.evicted_files += 1
+            self.evicted_bytes += size
+            logger.debug(f"Image cache evicted {path} ({size} bytes)")
@@ -0,0 +1,145 @@
+# image_store.py
+"""
+Хранилище картинок рецептов (таблица recipe_images).
+
+Ключ — нормализованное название блюда из первой строки рецепта, поэтому
+для популярных блюд картинка генерируется один раз. Файлы лежат в IMAGE_DIR
+под именем sha256 содержимого; место на диске ограничено квотой
+(image_cache). После первой отправки в Telegram запоминается file_id
+фотографии, и дальше отправляется только он, без повторной загрузки файла.
+"""
+import os
+import time
+import sqlite3
+import logging
+import threading
+
+import db
+from answer_cache import normalize_question
+from image_cache import ImageCache
+from generate_images import IMAGE_DIR
+
+logger = logging.getLogger(__name__)
+
+SQL_SELECT_IMAGE = "SELECT title, sha256, path, file_id FROM recipe_images WHERE title_key=?"
+SQL_TOUCH_IMAGE = "UPDATE recipe_images SET accessed_at=?, hits=hits+1 WHERE title_key=?"
+SQL_UPSERT_IMAGE = '''
+    INSERT INTO recipe_images (title_key, title, sha256, path, file_id, size, created_at, accessed_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT(title_key) DO UPDATE SET
+        title = excluded.title,
+        sha256 = excluded.sha256,
+        path = excluded.path,
+        file_id = excluded.file_id,
+        size = excluded.size,
+        accessed_at = excluded.accessed_at
+'''
+SQL_SET_FILE_ID = "UPDATE recipe_images SET file_id=? WHERE title_key=?"
+SQL_CLEAR_FILE_ID = "UPDATE recipe_images SET file_id=NULL WHERE title_key=?"
+SQL_DELETE_IMAGE = "DELETE FROM recipe_images WHERE title_key=?"
+
+# Источник отправленной картинки: file_id Telegram, файл с диска или новая генерация
+SOURCES = ('file_id', 'disk', 'generated')
+
+_stats_lock = threading.Lock()
+_stats = {source: {'count': 0, 'seconds': 0.0} for source in SOURCES}
+_stats['failed'] = {'count': 0, 'seconds': 0.0}
+_stats['timeout'] = {'count': 0, 'seconds': 0.0}
+_uploads = {'count': 0, 'bytes': 0}
+
+# Индекс файлов каталога с квотой; восстанавливается при запуске (rebuild)
+image_cache = ImageCache(IMAGE_DIR)
+
+
+def title_key(title: str) -> str:
+    """Ключ блюда: нормализованное название (регистр, ё, пунктуация и эмодзи не важны)"""
+    return normalize_question(title) or "блюдо"
+
+
+def get_image(key: str):
+    """
+    Запись о картинке блюда {'title', 'sha256', 'path', 'file_id'} или None.
+    Запись без file_id, файл которой пропал с диска (например, вытеснен
+    по квоте), удаляется; с file_id картинку можно отправить и без файла.
+    """
+    try:
+        conn = db.get_connection()
+        row = conn.execute(SQL_SELECT_IMAGE, (key,)).fetchone()
+        if row is None:
+            return None
+        image = {'title': row[0], 'sha256': row[1], 'path': row[2], 'file_id': row[3]}
+        exists = os.path.exists(image['path'])
+        with conn:
+            if not image['file_id'] and not exists:
+                conn.execute(SQL_DELETE_IMAGE, (key,))
+                return None
+            conn.execute(SQL_TOUCH_IMAGE, (time.time(), key))
+        if exists:
+            image_cache.touch(image['path'])
+        return image
+    except sqlite3.Error as e:
+        logger.error(f"Error reading recipe image: {e}")
+        return None
+
+
+def put_image(key: str, title: str, path: str, file_id: str = None) -> None:
+    """Запоминает картинку блюда; имя файла — sha256 его содержимого"""
+    try:
+        sha256 = os.path.splitext(os.path.basename(path))[0]
+        now = time.time()
+        conn = db.get_connection()
+        with conn:
+            conn.execute(SQL_UPSERT_IMAGE, (key, title, sha256, path, file_id, os.path.getsize(path), now, now))
+        image_cache.add(path)
+    except (sqlite3.Error, OSError) as e:
+        logger.error(f"Error writing recipe image: {e}")
+
+
+def set_file_id(key: str, file_id: str = None) -> None:
+    """Сохраняет file_id загруженной фотографии (None — сбросить устаревший)"""
+    try:
+        conn = db.get_connection()
+        with conn:
+            if file_id:
+                conn.execute(SQL_SET_FILE_ID, (file_id, key))
+            else:
+                conn.execute(SQL_CLEAR_FILE_ID, (key,))
+    except sqlite3.Error as e:
+        logger.error(f"Error updating recipe image file_id: {e}")
+
+
+def record(source: str, seconds: float) -> None:
+    """Учитывает картинку из источника source (или failed/timeout) и сколько она шла после текста рецепта"""
+    with _stats_lock:
+        stats = _stats[source]
+        stats['count'] += 1
+        stats['seconds'] += seconds
+
+
+def record_upload(size: int) -> None:
+    """Учитывает загрузку файла картинки в Telegram"""
+    with _stats_lock:
+        _uploads['count'] += 1
+        _uploads['bytes'] += size
+
+
+def get_stats() -> dict:
+    """
+    Доля попаданий и среднее время до отправки картинки по источникам,
+    объём загрузок в Telegram и занятое место на диске
+    """
+    with _stats_lock:
+        result = {
+            source: {
+                'count': stats['count'],
+                'avg_seconds': stats['seconds'] / stats['count'] if stats['count'] else 0.0
+            }
+            for source, stats in _stats.items()
+        }
+    hits = result['file_id']['count'] + result['disk']['count']
+    total = hits + result['generated']['count'] + result['failed']['count'] + result['timeout']['count']
+    result['hit_ratio'] = hits / total if total else 0.0
+    with _stats_lock:
+        result['uploads'] = dict(_uploads)
+    result['disk_usage'] = image_cache.usage()
+    return result
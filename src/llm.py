@@ -0,0 +1,252 @@
+# llm.py
+"""
+Общий реестр клиентов ChatOpenAI.
+
+Клиенты создаются один раз на сочетание модели и параметров и используют
+общие пулы HTTP-соединений, поэтому keep-alive соединения с API
+переиспользуются между запросами. Настройки задаются переменными окружения:
+  OPENAI_BASE_URL, OPENAI_TIMEOUT, OPENAI_MAX_RETRIES, OPENAI_MAX_CONNECTIONS,
+  CONSULT_MODEL, NUTRITION_MODEL, RECIPE_MODEL, LLM_WARMUP,
+  LLM_MAX_CONCURRENCY, LLM_MAX_CONCURRENCY_PER_MODEL.
+"""
+import os
+import time
+import hashlib
+import asyncio
+import logging
+import threading
+from contextlib import asynccontextmanager
+
+import httpx
+from dotenv import load_dotenv
+from langchain_openai import ChatOpenAI
+
+import token_budget
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_TIMEOUT = float(os.getenv("OPENAI_TIMEOUT", "60"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+LLM_WARMUP = os.getenv("LLM_WARMUP", "1") == "1"
+# Ограничения на число одновременных запросов к LLM: общее и на каждую модель
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_CONCURRENCY_PER_MODEL = int(os.getenv("LLM_MAX_CONCURRENCY_PER_MODEL", "16"))
+
+# Параметры моделей для каждой задачи бота
+MODEL_PRESETS = {
+    "consult": {"model": os.getenv("CONSULT_MODEL", "gpt-4o"), "temperature": 0.7, "max_tokens": 1000},
+    "nutrition": {"model": os.getenv("NUTRITION_MODEL", "gpt-3.5-turbo"), "temperature": 0.7, "max_tokens": 1000},
+    "recipe": {"model": os.getenv("RECIPE_MODEL", "gpt-3.5-turbo"), "temperature": 0.7, "max_tokens": None},
+}
+
+_limits = httpx.Limits(
+    max_connections=OPENAI_MAX_CONNECTIONS,
+    max_keepalive_connections=OPENAI_MAX_CONNECTIONS
+)
+_timeout = httpx.Timeout(OPENAI_TIMEOUT, connect=10.0)
+http_client = httpx.Client(limits=_limits, timeout=_timeout)
+http_async_client = httpx.AsyncClient(limits=_limits, timeout=_timeout)
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def get_chat_model(model: str, temperature: float = 0.7, max_tokens: int = None) -> ChatOpenAI:
+    """Возвращает долгоживущий клиент для заданной модели и параметров"""
+    key = (model, temperature, max_tokens)
+    chat_model = _models.get(key)
+    if chat_model is None:
+        with _models_lock:
+            chat_model = _models.get(key)
+            if chat_model is None:
+                chat_model = ChatOpenAI(
+                    model=model,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    openai_api_key=OPENAI_API_KEY,
+                    openai_api_base=OPENAI_BASE_URL,
+                    timeout=OPENAI_TIMEOUT,
+                    max_retries=OPENAI_MAX_RETRIES,
+                    http_client=http_client,
+                    http_async_client=http_async_client
+                )
+                _models[key] = chat_model
+                logger.debug(f"Created chat model client {key}")
+    return chat_model
+
+
+def get_model(preset: str) -> ChatOpenAI:
+    """Клиент с параметрами из MODEL_PRESETS ("consult", "nutrition", "recipe")"""
+    return get_chat_model(**MODEL_PRESETS[preset])
+
+
+# --- ОГРАНИЧЕНИЕ ПАРАЛЛЕЛЬНОСТИ ---
+
+_global_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+_model_semaphores = {}
+_limiter_stats = {
+    'requests': 0,
+    'in_flight': 0,
+    'wait_total': 0.0,
+    'wait_max': 0.0
+}
+
+
+@asynccontextmanager
+async def limit(model: str):
+    """
+    Ждёт свободного слота (для модели, затем общего) и учитывает время ожидания.
+    Слот модели берётся первым: запросы к перегруженной модели ждут в её
+    очереди и не занимают общие слоты, нужные остальным моделям.
+    """
+    semaphore = _model_semaphores.get(model)
+    if semaphore is None:
+        semaphore = _model_semaphores[model] = asyncio.Semaphore(LLM_MAX_CONCURRENCY_PER_MODEL)
+    started = time.monotonic()
+    async with semaphore, _global_semaphore:
+        waited = time.monotonic() - started
+        _limiter_stats['requests'] += 1
+        _limiter_stats['wait_total'] += waited
+        _limiter_stats['wait_max'] = max(_limiter_stats['wait_max'], waited)
+        if waited > 1:
+            logger.info(f"LLM request for {model} waited {waited:.2f} s in queue")
+        _limiter_stats['in_flight'] += 1
+        try:
+            yield
+        finally:
+            _limiter_stats['in_flight'] -= 1
+
+
+def get_limiter_stats() -> dict:
+    """Метрики очереди запросов к LLM"""
+    stats = dict(_limiter_stats)
+    stats['wait_avg'] = stats['wait_total'] / stats['requests'] if stats['requests'] else 0.0
+    return stats
+
+
+# --- ОБЪЕДИНЕНИЕ ОДИНАКОВЫХ ЗАПРОСОВ ---
+
+class SingleFlight:
+    """
+    Объединяет одновременные одинаковые запросы: пока вызов с ключом key
+    выполняется, остальные запросы с тем же ключом ждут его результат.
+    Ошибка вызова получают все ожидающие; отмена одного ожидающего не
+    затрагивает остальных, а вызов отменяется, только если его больше никто не ждёт.
+    """
+
+    def __init__(self):
+        self._calls = {}  # key -> [task, число ожидающих]
+        self.calls = 0
+        self.coalesced = 0
+
+    async def do(self, key: str, factory):
+        entry = self._calls.get(key)
+        if entry is None:
+            entry = [asyncio.ensure_future(factory()), 0]
+            self._calls[key] = entry
+            entry[0].add_done_callback(lambda _: self._forget(key, entry))
+            self.calls += 1
+        else:
+            self.coalesced += 1
+        entry[1] += 1
+        try:
+            return await asyncio.shield(entry[0])
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not entry[0].done():
+                # Запись убирается сразу, а не в done-колбэке: иначе запрос, пришедший
+                # до его вызова, присоединился бы к уже отменённому вызову
+                self._forget(key, entry)
+                entry[0].cancel()
+
+    def _forget(self, key: str, entry: list) -> None:
+        if self._calls.get(key) is entry:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        total = self.calls + self.coalesced
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'in_flight': len(self._calls),
+            'coalescing_ratio': self.coalesced / total if total else 0.0
+        }
+
+
+single_flight = SingleFlight()
+
+
+def render_prompt(chain, inputs: dict) -> str:
+    """Итоговый текст промпта цепочки (первым звеном должен быть шаблон)"""
+    prompt = getattr(chain, "first", None)
+    if hasattr(prompt, "format"):
+        return prompt.format(**inputs)
+    return repr(sorted(inputs.items()))
+
+
+def request_key(rendered: str, preset: str) -> str:
+    """Хэш модели и итогового текста промпта"""
+    payload = f"{MODEL_PRESETS[preset]}\x00{rendered}"
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def check_prompt(rendered: str, preset: str) -> int:
+    """Считает токены промпта, учитывает их в метриках и отклоняет слишком длинные"""
+    tokens = token_budget.ensure_fits(rendered, token_budget.PROMPT_MAX_TOKENS)
+    token_budget.record(preset, tokens)
+    logger.debug(f"LLM request {preset}: {tokens} prompt tokens")
+    return tokens
+
+
+async def ainvoke(chain, inputs: dict, preset: str):
+    """
+    Асинхронно выполняет цепочку с моделью пресета с учётом ограничений.
+    Одинаковые запросы, пришедшие одновременно, выполняются один раз.
+    """
+    rendered = render_prompt(chain, inputs)
+    check_prompt(rendered, preset)
+
+    async def call():
+        async with limit(MODEL_PRESETS[preset]["model"]):
+            return await chain.ainvoke(inputs)
+
+    return await single_flight.do(request_key(rendered, preset), call)
+
+
+async def astream(chain, inputs: dict, preset: str):
+    """Потоковое выполнение цепочки; слот лимитера занят до конца потока"""
+    check_prompt(render_prompt(chain, inputs), preset)
+    async with limit(MODEL_PRESETS[preset]["model"]):
+        async for chunk in chain.astream(inputs):
+            yield chunk
+
+
+async def warm_up() -> None:
+    """
+    Создаёт клиенты всех пресетов и заранее открывает соединения с API,
+    чтобы первый запрос пользователя не тратил время на TCP/TLS; словарь
+    tiktoken загружается в фоне. При LLM_WARMUP=0 только создаёт клиенты.
+    """
+    for preset in MODEL_PRESETS:
+        get_model(preset)
+    if not LLM_WARMUP:
+        return
+    token_budget.start_loading()
+    url = f"{OPENAI_BASE_URL.rstrip('/')}/models"
+    headers = {"Authorization": f"Bearer {OPENAI_API_KEY}"}
+    try:
+        await http_async_client.get(url, headers=headers)
+        logger.info("LLM clients warmed up")
+    except Exception as e:
+        logger.warning(f"LLM warm-up failed: {e}")
+
+
+async def close() -> None:
+    """Закрывает общие пулы соединений"""
+    http_client.close()
+    await http_async_client.aclose()
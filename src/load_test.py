@@ -0,0 +1,610 @@
+# load_test.py
+"""
+Нагрузочный тест бота без сети.
+
+Приложение собирается так же, как в main.py (build_application), со всеми
+обработчиками из bot.py, но:
+  - запросы к Bot API уходят в FakeTelegramRequest, который отвечает сразу
+    (с настраиваемой задержкой) и считает вызовы;
+  - OPENAI_BASE_URL указывает на локальный OpenAI-совместимый сервер
+    FakeOpenAIServer с настраиваемой задержкой и потоковой выдачей;
+  - база данных, журнал и картинки пишутся во временный каталог.
+
+Каждый виртуальный пользователь проходит регистрацию, задаёт вопросы (/ask),
+выбирает цель кнопкой, запрашивает /nutrition и /recipe. Апдейты одного
+пользователя идут последовательно, разных пользователей — вперемешку;
+приложение, как и в боте, разбирает их по одному, а медленные обработчики
+работают отдельными задачами. Время апдейта считается до окончания этих задач.
+В конце выводятся пропускная способность, p50/p95/p99 по обработчикам,
+время до первого текста ответа на /ask, задержка цикла событий и пиковый RSS.
+
+Пример:
+    python load_test.py --users 500 --llm-latency 0.5 --json report.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import struct
+import asyncio
+import logging
+import argparse
+import tempfile
+import threading
+import importlib
+
+from telegram import Update
+from telegram.ext import Application
+from telegram.request import BaseRequest
+
+from bench_common import percentile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SRC_DIR = os.path.dirname(os.path.abspath(__file__))
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+logger = logging.getLogger(__name__)
+
+BOT_TOKEN = "123456:LOAD-TEST"
+ACTIVITY_OPTIONS = [
+    "1️⃣ Минимальный (сидячий образ жизни)",
+    "2️⃣ Низкий (1-2 тренировки в неделю)",
+    "3️⃣ Средний (3-4 тренировки в неделю)",
+    "4️⃣ Высокий (5-7 тренировок в неделю)",
+    "5️⃣ Очень высокий (ежедневные интенсивные тренировки)"
+]
+GOALS = ["Похудение", "Набор массы", "Поддержание здоровья"]
+QUESTIONS = [
+    "Сколько воды нужно пить в день?",
+    "Что съесть перед тренировкой?",
+    "Как уменьшить тягу к сладкому?",
+    "Можно ли есть после шести вечера?",
+    "Какие продукты богаты железом?"
+]
+INGREDIENTS = [
+    "курица, рис, брокколи",
+    "яйца, шпинат, сыр",
+    "лосось, картофель, укроп",
+    "творог, ягоды, мёд"
+]
+
+
+def make_png(size: int, seed: int) -> bytes:
+    """PNG size x size с шумом — сжимается примерно как настоящая фотография"""
+    rng = random.Random(seed)
+    row_bytes = size * 3
+    raw = b"".join(b"\x00" + rng.randbytes(row_bytes) for _ in range(size))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 1)) + chunk(b"IEND", b"")
+
+
+DISHES = ["Курица с рисом", "Омлет со шпинатом", "Запечённый лосось", "Творожная запеканка",
+          "Овощное рагу", "Гречка с грибами", "Салат с тунцом", "Тыквенный суп"]
+FAKE_BODY = (
+    "Ингредиенты и шаги приготовления для нагрузочного теста. "
+    "Сбалансированное питание включает белки, жиры и углеводы в разумных пропорциях. " * 6
+)
+
+
+def fake_answer(payload: dict) -> str:
+    """Текст ответа; название блюда зависит от промпта, чтобы блюда повторялись, но не все"""
+    prompt = json.dumps(payload.get("messages", []), ensure_ascii=False)
+    return f"🍽️ {DISHES[zlib.crc32(prompt.encode()) % len(DISHES)]}\n\n{FAKE_BODY}"
+
+
+# --- ФЕЙКОВЫЙ ТРАНСПОРТ BOT API ---
+
+class FakeTelegramRequest(BaseRequest):
+    """Отвечает на вызовы Bot API локально, как будто сообщение доставлено"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = {}
+        self.error_replies = 0
+        self.uploads = 0
+        self.upload_bytes = 0
+        # Время первого отправленного сообщения в каждый чат (сбрасывается перед апдейтом)
+        self.first_message_at = {}
+        self._message_id = 0
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        params = request_data.parameters if request_data else {}
+        files = request_data.multipart_data if request_data else {}
+        if files:
+            self.uploads += 1
+            self.upload_bytes += sum(len(content) for _, content, _ in files.values())
+
+        if endpoint == "getMe":
+            result = {"id": 1, "is_bot": True, "first_name": "NutriBot", "username": "load_test_bot"}
+        elif endpoint in ("sendMessage", "editMessageText", "sendPhoto"):
+            text = params.get("text") or params.get("caption") or ""
+            if text.startswith(("⚠️", "❌")):
+                self.error_replies += 1
+            if endpoint != "editMessageText":
+                self.first_message_at.setdefault(params.get("chat_id"), time.perf_counter())
+            self._message_id += 1
+            result = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": params.get("chat_id"), "type": "private"},
+                "text": text
+            }
+            if endpoint == "sendPhoto":
+                file_id = params["photo"] if not files else f"photo-{self._message_id}"
+                result["photo"] = [{
+                    "file_id": file_id,
+                    "file_unique_id": file_id,
+                    "width": 1024,
+                    "height": 1024
+                }]
+        else:
+            result = True
+        return 200, json.dumps({"ok": True, "result": result}).encode()
+
+
+class TrackingApplication(Application):
+    """Запоминает задачи, запущенные при обработке апдейта (block=False и create_task)"""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.spawned = {}
+
+    def create_task(self, coroutine, update=None):
+        task = super().create_task(coroutine, update=update)
+        if update is not None:
+            self.spawned.setdefault(id(update), []).append(task)
+        return task
+
+    async def wait_spawned(self, update) -> None:
+        """Ждёт задачи апдейта, включая запущенные из них же"""
+        while self.spawned.get(id(update)):
+            await asyncio.gather(*self.spawned.pop(id(update)), return_exceptions=True)
+
+
+# --- ФЕЙКОВЫЙ OPENAI-СОВМЕСТИМЫЙ СЕРВЕР ---
+
+class FakeOpenAIServer:
+    """
+    Минимальный HTTP/1.1-сервер с keep-alive: /chat/completions (обычный и
+    потоковый ответ), /images/generations, /models и скачивание картинок.
+    Работает в отдельном потоке со своим циклом событий, как удалённый API:
+    блокирующий вызов в боте не останавливает и сервер.
+    """
+
+    def __init__(self, latency: float = 0.5, jitter: float = 0.2,
+                 stream_chunks: int = 20, chunk_delay: float = 0.02, image_latency: float = 2.0,
+                 image_size: int = 1024, image_variants: int = 8):
+        self.latency = latency
+        self.image_latency = image_latency
+        # Несколько разных картинок заранее: генерировать PNG на каждый запрос долго
+        self.images = [make_png(image_size, seed) for seed in range(image_variants)]
+        self.jitter = jitter
+        self.stream_chunks = stream_chunks
+        self.chunk_delay = chunk_delay
+        self.requests = {}
+        # Принятые TCP-соединения: при работающем keep-alive их намного меньше запросов
+        self.connections = 0
+        self.port = None
+        self._server = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="fake-openai", daemon=True)
+
+    def start(self) -> str:
+        self._thread.start()
+        self._server = asyncio.run_coroutine_threadsafe(
+            asyncio.start_server(self._handle, "127.0.0.1", 0), self._loop
+        ).result()
+        self.port = self._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def stop(self) -> None:
+        async def shutdown():
+            self._server.close()
+            tasks = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        asyncio.run_coroutine_threadsafe(shutdown(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+    async def _delay(self, latency: float) -> None:
+        await asyncio.sleep(max(0.0, random.gauss(latency, latency * self.jitter)))
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                head = await reader.readuntil(b"\r\n\r\n")
+                lines = head.decode("latin-1").split("\r\n")
+                method, path, _ = lines[0].split(" ", 2)
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        name, value = line.split(":", 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+                path = path.split("?", 1)[0]
+                key = "/files/*" if path.startswith("/files/") else path
+                self.requests[key] = self.requests.get(key, 0) + 1
+                await self._respond(writer, method, path, body)
+        except (asyncio.IncompleteReadError, ConnectionResetError):
+            pass
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, method, path, body):
+        if path.endswith("/chat/completions"):
+            payload = json.loads(body or b"{}")
+            await self._delay(self.latency)
+            if payload.get("stream"):
+                await self._stream_completion(writer, payload)
+            else:
+                self._send_json(writer, self._completion(payload))
+        elif path.endswith("/images/generations"):
+            await self._delay(self.image_latency)
+            url = f"http://127.0.0.1:{self.port}/files/{random.randrange(len(self.images))}.png"
+            self._send_json(writer, {"created": int(time.time()), "data": [{"url": url}]})
+        elif path.startswith("/files/"):
+            index = int(path.rsplit("/", 1)[-1].split(".")[0])
+            self._send(writer, 200, self.images[index], "image/png")
+        elif path.endswith("/models"):
+            self._send_json(writer, {"object": "list", "data": []})
+        else:
+            self._send_json(writer, {"error": {"message": f"unknown path {path}"}}, status=404)
+        await writer.drain()
+
+    def _send(self, writer, status, body, content_type):
+        writer.write(
+            f"HTTP/1.1 {status} OK\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n".encode() + body
+        )
+
+    def _send_json(self, writer, data, status=200):
+        self._send(writer, status, json.dumps(data, ensure_ascii=False).encode(), "application/json")
+
+    def _completion(self, payload):
+        return {
+            "id": "chatcmpl-load-test",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload.get("model", "fake"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": fake_answer(payload)},
+                "finish_reason": "stop"
+            }],
+            "usage": {"prompt_tokens": 100, "completion_tokens": 200, "total_tokens": 300}
+        }
+
+    async def _stream_completion(self, writer, payload):
+        writer.write(
+            b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\n"
+            b"Transfer-Encoding: chunked\r\nConnection: keep-alive\r\n\r\n"
+        )
+        answer = fake_answer(payload)
+        size = max(1, len(answer) // self.stream_chunks + 1)
+        pieces = [answer[i:i + size] for i in range(0, len(answer), size)]
+        for index, piece in enumerate(pieces + [None]):
+            chunk = {
+                "id": "chatcmpl-load-test",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": piece} if piece is not None else {},
+                    "finish_reason": None if piece is not None else "stop"
+                }]
+            }
+            self._write_chunk(writer, f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+            await writer.drain()
+            if piece is not None and index and self.chunk_delay:
+                await asyncio.sleep(self.chunk_delay)
+        self._write_chunk(writer, "data: [DONE]\n\n")
+        writer.write(b"0\r\n\r\n")
+
+    @staticmethod
+    def _write_chunk(writer, text):
+        data = text.encode()
+        writer.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+
+# --- СИНТЕТИЧЕСКИЕ АПДЕЙТЫ ---
+
+class UpdateFactory:
+
+    def __init__(self, bot):
+        self.bot = bot
+        self._update_id = 0
+
+    def _next_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Update:
+        update_id = self._next_id()
+        message = {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": self._user(user_id),
+            "text": text
+        }
+        if text.startswith("/"):
+            command = text.split(" ", 1)[0]
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+        return Update.de_json({"update_id": update_id, "message": message}, self.bot)
+
+    def callback(self, user_id: int, data: str) -> Update:
+        update_id = self._next_id()
+        return Update.de_json({
+            "update_id": update_id,
+            "callback_query": {
+                "id": str(update_id),
+                "from": self._user(user_id),
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": update_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "Выберите команду:"
+                }
+            }
+        }, self.bot)
+
+
+def user_script(user_id: int, asks: int) -> list:
+    """Последовательность (метка, тип, данные) одного виртуального пользователя"""
+    rng = random.Random(user_id)
+    steps = [
+        ("/start", "message", "/start"),
+        ("registration", "message", f"User{user_id}"),
+        ("registration", "message", str(rng.randint(18, 70))),
+        ("registration", "message", str(rng.randint(45, 120))),
+        ("registration", "message", str(rng.randint(150, 200))),
+        ("registration", "message", rng.choice(ACTIVITY_OPTIONS)),
+        ("registration", "message", rng.choice(GOALS)),
+        ("registration", "message", "нет"),
+        ("registration", "message", "нет"),
+    ]
+    for _ in range(asks):
+        steps.append(("/ask", "message", f"/ask {rng.choice(QUESTIONS)}"))
+    steps += [
+        ("goal_button", "message", rng.choice(GOALS)),
+        ("/nutrition", "message", "/nutrition"),
+        ("callback", "callback", "/recipe"),
+        ("/recipe", "message", rng.choice(INGREDIENTS)),
+    ]
+    return steps
+
+
+# --- ПРОГОН ---
+
+async def monitor_loop_lag(samples: list, interval: float = 0.05) -> None:
+    """Насколько позже запланированного просыпается цикл событий"""
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(time.perf_counter() - started - interval)
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux возвращает килобайты, macOS — байты
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+async def run_load_test(args) -> dict:
+    fake_openai = FakeOpenAIServer(
+        latency=args.llm_latency,
+        jitter=args.llm_jitter,
+        stream_chunks=args.stream_chunks,
+        chunk_delay=args.chunk_delay,
+        image_latency=args.image_latency,
+        image_size=args.image_size
+    )
+    base_url = fake_openai.start()
+
+    workdir = tempfile.mkdtemp(prefix="nutribot-load-")
+    os.chdir(workdir)
+    os.environ.update({
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_KEY": "load-test",
+        "DB_PATH": os.path.join(workdir, "users.db"),
+        "LOG_FILE": os.path.join(workdir, "bot.log"),
+        "LOG_LEVEL": args.log_level,
+    })
+    if not os.getenv("ENCRYPTION_KEY"):
+        from cryptography.fernet import Fernet
+        os.environ["ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+
+    # Модули бота читают окружение при импорте, поэтому импортируются здесь
+    bot_main = importlib.import_module("main")
+    bot_main.setup_logging()
+    bot_main.init_db()
+
+    telegram_request = FakeTelegramRequest(latency=args.tg_latency)
+    app = bot_main.build_application(BOT_TOKEN, request=telegram_request, application_class=TrackingApplication)
+    await app.initialize()
+    await app.post_init(app)
+    await app.start()
+    factory = UpdateFactory(app.bot)
+
+    # Как и очередь апдейтов в боте: следующий апдейт разбирается, когда
+    # блокирующие обработчики предыдущего закончили
+    dispatch_lock = asyncio.Lock()
+    latencies = {}
+    first_text = []
+    failures = {}
+    lag_samples = []
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples))
+
+    async def virtual_user(index: int) -> None:
+        user_id = 10_000_000 + index
+        await asyncio.sleep(index / args.arrival_rate if args.arrival_rate else 0)
+        for label, kind, data in user_script(user_id, args.asks):
+            update = factory.message(user_id, data) if kind == "message" else factory.callback(user_id, data)
+            telegram_request.first_message_at.pop(user_id, None)
+            started = time.perf_counter()
+            try:
+                async with dispatch_lock:
+                    await app.process_update(update)
+                await app.wait_spawned(update)
+            except Exception:
+                failures[label] = failures.get(label, 0) + 1
+                logger.exception(f"Update {label} failed")
+            latencies.setdefault(label, []).append(time.perf_counter() - started)
+            sent_at = telegram_request.first_message_at.get(user_id)
+            if label == "/ask" and sent_at is not None:
+                first_text.append(sent_at - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(virtual_user(i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    lag_task.cancel()
+    await app.stop()
+    await app.shutdown()
+    await app.post_shutdown(app)
+    fake_openai.stop()
+
+    llm = importlib.import_module("llm")
+    plan_cache = importlib.import_module("plan_cache")
+    image_store = importlib.import_module("image_store")
+    recipes = importlib.import_module("recipes")
+    recipe_store = importlib.import_module("recipe_store")
+    total_updates = sum(len(values) for values in latencies.values())
+    return {
+        "users": args.users,
+        "updates": total_updates,
+        "seconds": elapsed,
+        "updates_per_second": total_updates / elapsed if elapsed else 0.0,
+        "handlers": {
+            label: {
+                "count": len(values),
+                "failures": failures.get(label, 0),
+                "p50_ms": percentile(values, 50) * 1000,
+                "p95_ms": percentile(values, 95) * 1000,
+                "p99_ms": percentile(values, 99) * 1000,
+                "max_ms": max(values) * 1000
+            }
+            for label, values in latencies.items()
+        },
+        "ask_first_text_ms": {
+            "p50": percentile(first_text, 50) * 1000,
+            "p95": percentile(first_text, 95) * 1000,
+            "p99": percentile(first_text, 99) * 1000
+        },
+        "loop_lag_ms": {
+            "p50": percentile(lag_samples, 50) * 1000,
+            "p99": percentile(lag_samples, 99) * 1000,
+            "max": max(lag_samples, default=0.0) * 1000
+        },
+        "peak_rss_mb": peak_rss_mb(),
+        "telegram_calls": telegram_request.calls,
+        "error_replies": telegram_request.error_replies,
+        "uploads": telegram_request.uploads,
+        "upload_bytes": telegram_request.upload_bytes,
+        "llm_requests": fake_openai.requests,
+        "llm_connections": fake_openai.connections,
+        "llm_limiter": llm.get_limiter_stats(),
+        "llm_single_flight": llm.single_flight.stats(),
+        "plan_cache": plan_cache.get_stats(),
+        "recipe_images": image_store.get_stats(),
+        "recipe_delivery": recipes.get_delivery_stats(),
+        "recipe_store": recipe_store.get_stats(),
+        "workdir": workdir
+    }
+
+
+def print_report(report: dict) -> None:
+    print(f"\nПользователей: {report['users']}, апдейтов: {report['updates']}, "
+          f"время: {report['seconds']:.1f} с, {report['updates_per_second']:.1f} апдейтов/с")
+    print(f"\n{'обработчик':<14}{'кол-во':>8}{'ошибок':>8}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}{'max, мс':>10}")
+    for label, stats in report["handlers"].items():
+        print(f"{label:<14}{stats['count']:>8}{stats['failures']:>8}{stats['p50_ms']:>10.1f}"
+              f"{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+    first_text = report["ask_first_text_ms"]
+    print(f"\n/ask, первый текст у пользователя: p50 {first_text['p50']:.1f} мс, "
+          f"p95 {first_text['p95']:.1f} мс, p99 {first_text['p99']:.1f} мс")
+    lag = report["loop_lag_ms"]
+    print(f"\nЗадержка цикла событий: p50 {lag['p50']:.1f} мс, p99 {lag['p99']:.1f} мс, max {lag['max']:.1f} мс")
+    if report["peak_rss_mb"] is not None:
+        print(f"Пиковый RSS: {report['peak_rss_mb']:.1f} МБ")
+    print(f"Вызовы Bot API: {report['telegram_calls']}, ответов с ошибкой: {report['error_replies']}")
+    images = report["recipe_images"]
+    disk = images["disk_usage"]
+    print(f"Загружено файлов: {report['uploads']} ({report['upload_bytes'] / 1024:.1f} КБ), "
+          f"картинок на диске: {disk['files']} ({disk['bytes'] / 1024:.1f} КБ), вытеснено: {disk['evicted_files']}")
+    print(f"Картинки рецептов: попаданий {images['hit_ratio']:.0%}, фото после текста в среднем: "
+          + ", ".join(f"{source} {images[source]['avg_seconds'] * 1000:.1f} мс ({images[source]['count']})"
+                      for source in ("file_id", "disk", "generated")))
+    delivery = report["recipe_delivery"]
+    print(f"Рецепты: текст в среднем через {delivery['avg_first_response_seconds']:.2f} с, "
+          f"полностью с картинкой через {delivery['avg_total_seconds']:.2f} с; "
+          f"без картинки по таймауту: {images['timeout']['count']}, ошибок картинки: {images['failed']['count']}")
+    store = report["recipe_store"]
+    print(f"Хранилище рецептов: попаданий {store['hits']} ({store['hit_ratio']:.0%}), промахов {store['misses']}, "
+          f"поиск в среднем {store['avg_hit_seconds'] * 1000:.1f} / {store['avg_miss_seconds'] * 1000:.1f} мс")
+    print(f"Запросы к LLM: {report['llm_requests']}, TCP-соединений: {report['llm_connections']}")
+    print(f"Каталог прогона: {report['workdir']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота с локальными заглушками Telegram и OpenAI")
+    parser.add_argument("--users", type=int, default=200, help="число виртуальных пользователей")
+    parser.add_argument("--asks", type=int, default=2, help="вопросов /ask на пользователя")
+    parser.add_argument("--arrival-rate", type=float, default=0, help="новых пользователей в секунду (0 — все сразу)")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="средняя задержка ответа LLM, секунды")
+    parser.add_argument("--llm-jitter", type=float, default=0.2, help="разброс задержки LLM (доля от средней)")
+    parser.add_argument("--stream-chunks", type=int, default=20, help="фрагментов в потоковом ответе")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="пауза между фрагментами, секунды")
+    parser.add_argument("--image-latency", type=float, default=2.0, help="средняя задержка генерации картинки, секунды")
+    parser.add_argument("--image-size", type=int, default=1024, help="сторона картинки фейкового сервера, пиксели")
+    parser.add_argument("--tg-latency", type=float, default=0.01, help="задержка ответа Bot API, секунды")
+    parser.add_argument("--log-level", default="WARNING", help="уровень логирования бота")
+    parser.add_argument("--json", help="сохранить отчёт в JSON-файл")
+    args = parser.parse_args()
+
+    json_path = os.path.abspath(args.json) if args.json else None
+    report = asyncio.run(run_load_test(args))
+    print_report(report)
+    if json_path:
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
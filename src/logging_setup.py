@@ -0,0 +1,105 @@
+# logging_setup.py
+"""
+Единая настройка логирования для всех модулей бота.
+
+Обработчики пишут записи в очередь (QueueHandler), а запись на диск и в
+консоль выполняет отдельный поток (QueueListener), поэтому логирование не
+блокирует цикл событий. Параметры задаются переменными окружения:
+  LOG_LEVEL         – общий уровень (по умолчанию INFO)
+  LOG_LEVELS        – уровни отдельных модулей, например "db=DEBUG,httpx=WARNING"
+  LOG_FILE          – путь к файлу журнала
+  LOG_MAX_BYTES     – размер файла, после которого он ротируется
+  LOG_BACKUP_COUNT  – сколько старых файлов хранить
+  LOG_SAMPLE_EVERY  – для "горячих" DEBUG-строк пишется только каждая N-я
+"""
+import os
+import queue
+import atexit
+import logging
+import itertools
+import logging.handlers
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+_listener = None
+
+
+def _parse_levels(spec: str) -> dict:
+    """Разбирает LOG_LEVELS ("db=DEBUG,httpx=WARNING"); пустые и неизвестные уровни пропускаются"""
+    levels = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        name, level = (part.strip() for part in item.split("=", 1))
+        level = level.upper()
+        if not name or not isinstance(logging.getLevelName(level), int):
+            continue
+        levels[name] = level
+    return levels
+
+
+def setup_logging() -> None:
+    """Настраивает корневой логгер; повторные вызовы ничего не делают"""
+    global _listener
+    if _listener is not None:
+        return
+
+    log_file = os.getenv("LOG_FILE", os.path.join(BASE_DIR, "logs", "bot.log"))
+    os.makedirs(os.path.dirname(log_file), exist_ok=True)
+
+    formatter = logging.Formatter(LOG_FORMAT)
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file,
+        maxBytes=int(os.getenv("LOG_MAX_BYTES", str(10 * 1024 * 1024))),
+        backupCount=int(os.getenv("LOG_BACKUP_COUNT", "5")),
+        encoding="utf-8"
+    )
+    file_handler.setFormatter(formatter)
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    for name, level in _parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, file_handler, stream_handler)
+    _listener.start()
+    atexit.register(stop_logging)
+
+
+def stop_logging() -> None:
+    """Дописывает оставшиеся записи из очереди и останавливает фоновый поток"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает только каждую N-ю запись уровня DEBUG, остальные уровни — все"""
+
+    def __init__(self, every: int):
+        super().__init__()
+        self.every = max(1, every)
+        self._counter = itertools.count()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG:
+            return True
+        return next(self._counter) % self.every == 0
+
+
+def get_sampled_logger(name: str, every: int = None) -> logging.Logger:
+    """Логгер для частых DEBUG-строк (например, по каждому пользователю в рассылке)"""
+    logger = logging.getLogger(f"{name}.sampled")
+    if not any(isinstance(f, SamplingFilter) for f in logger.filters):
+        if every is None:
+            every = int(os.getenv("LOG_SAMPLE_EVERY", "100"))
+        logger.addFilter(SamplingFilter(every))
+    return logger
@@ -1,4 +1,5 @@
 import os
+import asyncio
 import logging
 from telegram.ext import (
     ApplicationBuilder,
@@ -9,6 +10,11 @@ from telegram.ext import (
 )
 from dotenv import load_dotenv
 from db import init_db
+import async_db
+import llm
+import generate_images
+import image_store
+import image_cache
 from bot import (
     create_conv_handler,
     create_ask_handler,
@@ -18,58 +24,96 @@ from bot import (
     create_recipe_handler,
     menu_handler,
     button_handler,
-    unknown_command
+    unknown_command,
+    cancel_background_tasks
 )
 from reminders import start_reminders
+from logging_setup import setup_logging
 
-logging.basicConfig(
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+
+async def on_startup(app):
+    """Запускает фоновый перевод профилей в новый формат, прогревает LLM-клиенты и индексирует картинки"""
+    app.bot_data["profile_migration"] = asyncio.create_task(async_db.migrate_profile_format())
+    image_cache.check_reencoding()
+    await async_db.run(image_store.image_cache.rebuild)
+    await llm.warm_up()
+
+
+async def on_shutdown(app):
+    """Сбрасывает очередь записи, останавливает пул потоков БД и закрывает соединения"""
+    migration = app.bot_data.get("profile_migration")
+    if migration and not migration.done():
+        migration.cancel()
+    await cancel_background_tasks()
+    await llm.close()
+    await generate_images.close()
+    await async_db.shutdown()
+
+
+def build_application(token: str, request=None, application_class=None):
+    """
+    Создаёт приложение бота со всеми обработчиками.
+    Апдейты обрабатываются по одному (ConversationHandler и флаги в user_data
+    не рассчитаны на параллельную обработку), а медленные обработчики с LLM
+    работают отдельными задачами (block=False) и очередь не задерживают.
+    request — собственный транспорт Bot API, application_class — подкласс
+    Application (например, в нагрузочном тесте).
+    """
+    builder = (
+        ApplicationBuilder()
+        .token(token)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if request is not None:
+        builder = builder.request(request).get_updates_request(request)
+    if application_class is not None:
+        builder = builder.application_class(application_class)
+    app = builder.build()
+
+    # Регистрация основных обработчиков
+    handlers = [
+        create_conv_handler(),     # Регистрация
+        create_ask_handler(),      # /ask
+        create_help_handler(),     # /help
+        create_message_handler(),  # Текстовые сообщения
+        create_nutrition_handler(),# /nutrition
+        create_recipe_handler()    # /recipe
+    ]
+    for handler in handlers:
+        if handler:
+            app.add_handler(handler)
+            logger.debug(f"Добавлен обработчик: {handler.__class__.__name__}")
+
+    # Обработчик нажатий на inline-кнопки
+    app.add_handler(CallbackQueryHandler(button_handler))
+
+    # Если пользователь введёт /menu — показываем главное меню
+    app.add_handler(CommandHandler("menu", menu_handler))
+
+    # Обработчик неизвестных команд
+    app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
+    return app
+
+
 def main():
     try:
-        # Проверка, что ключи прочитаны
-        logging.basicConfig(
-            format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-            level=logging.DEBUG  # <-- меняем на DEBUG
-        )
+        # Логирование через фоновый поток; уровни задаются LOG_LEVEL/LOG_LEVELS
+        setup_logging()
         # Инициализация базы данных
         init_db()
         logger.info("База данных успешно инициализирована")
 
         # Создание приложения бота
-        app = ApplicationBuilder().token(BOT_TOKEN).build()
+        app = build_application(BOT_TOKEN)
         logger.info("Приложение бота создано")
 
-        # Регистрация основных обработчиков
-        handlers = [
-            create_conv_handler(),     # Регистрация
-            create_ask_handler(),      # /ask
-            create_help_handler(),     # /help
-            create_message_handler(),  # Текстовые сообщения
-            create_nutrition_handler(),# /nutrition
-            create_recipe_handler()    # /recipe
-        ]
-        for handler in handlers:
-            if handler:
-                app.add_handler(handler)
-                logger.debug(f"Добавлен обработчик: {handler.__class__.__name__}")
-
-        # Обработчик нажатий на inline-кнопки
-        app.add_handler(CallbackQueryHandler(button_handler))
-
-        # Если пользователь введёт /menu — показываем главное меню
-        app.add_handler(CommandHandler("menu", menu_handler))
-
-        # Обработчик неизвестных команд
-        app.add_handler(MessageHandler(filters.COMMAND, unknown_command))
-
         # Запуск напоминаний
         start_reminders(app)
         logger.info("Сервис напоминаний активирован")
@@ -84,8 +128,3 @@ def main():
 
 if __name__ == "__main__":
     main()
-
-
-
-
-
@@ -0,0 +1,87 @@
+# meal_writer.py
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MealWriter:
+    """
+    Очередь отложенной записи приёмов пищи (group commit).
+    Накопленные записи сбрасываются одной транзакцией каждые flush_interval
+    секунд или как только в очереди наберётся max_batch строк.
+    """
+
+    def __init__(self, flush, max_batch: int = 100, flush_interval: float = 0.05):
+        # flush — корутина, принимающая список (telegram_id, meal) и
+        # возвращающая список bool с результатом по каждой строке
+        self._flush = flush
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._has_items = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._task = None
+        self._closed = False
+        self.rows_written = 0
+        self.batches_written = 0
+
+    def submit(self, telegram_id: int, meal: str) -> asyncio.Future:
+        """Ставит запись в очередь и возвращает future с результатом вставки"""
+        if self._closed:
+            raise RuntimeError("MealWriter is closed")
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((telegram_id, meal, future))
+        self._has_items.set()
+        if len(self._pending) >= self.max_batch:
+            self._batch_full.set()
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+        return future
+
+    async def close(self) -> None:
+        """Запрещает новые записи и дожидается сброса очереди"""
+        self._closed = True
+        if self._task is None:
+            return
+        self._batch_full.set()
+        self._has_items.set()
+        await self._task
+        self._task = None
+        logger.info(
+            f"MealWriter stopped: {self.rows_written} rows in {self.batches_written} batches"
+        )
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_items.wait()
+            if not self._closed:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch = self._pending[:self.max_batch]
+            del self._pending[:self.max_batch]
+            if len(self._pending) < self.max_batch:
+                self._batch_full.clear()
+            if not self._pending:
+                self._has_items.clear()
+            if batch:
+                await self._write(batch)
+            if self._closed and not self._pending:
+                return
+
+    async def _write(self, batch: list) -> None:
+        try:
+            results = await self._flush([(telegram_id, meal) for telegram_id, meal, _ in batch])
+        except Exception as e:
+            logger.error(f"Ошибка записи пачки приёмов пищи: {e}", exc_info=True)
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches_written += 1
+        self.rows_written += sum(results)
+        for (_, _, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
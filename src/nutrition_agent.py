@@ -1,8 +1,14 @@
+import time
+import asyncio
 import logging
-import os
-from langchain_openai import ChatOpenAI
+from functools import lru_cache
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
+from llm import get_model, ainvoke
+import async_db
+import energy
+import plan_cache
+import token_budget
 from dotenv import load_dotenv
 
 # Загрузка переменных окружения из .env
@@ -10,85 +16,106 @@ load_dotenv()
 
 # Настройка логгера
 logger = logging.getLogger(__name__)
-logging.basicConfig(level=logging.INFO)
 
-def calculate_bmr(weight: float, height: float, age: int, gender: str) -> float:
+# Шаблон промпта разбирается один раз при импорте, данные передаются переменными
+PLAN_PROMPT = ChatPromptTemplate.from_template(
+    "Ты опытный диетолог с многолетним стажем. "
+    "На основе следующих данных пользователя сформируй персональный план питания:\n"
+    "Возраст: {age} лет\n"
+    "Вес: {weight} кг\n"
+    "Рост: {height} см\n"
+    "Пол: {gender}\n"
+    "Уровень активности: {activity} из 5\n"
+    "Цель: {goal}\n"
+    "Хронические заболевания: {diseases}\n"
+    "Аллергии: {allergies}\n\n"
+    "Расчёт уже выполнен, используй эти числа без изменений и не пересчитывай их:\n"
+    "Базальный метаболизм (BMR): {bmr} ккал\n"
+    "Суточный расход энергии (TDEE): {tdee} ккал\n"
+    "Рекомендуемая суточная калорийность: {daily_calories} ккал\n"
+    "Белки: {protein_g} г, жиры: {fat_g} г, углеводы: {carbs_g} г\n\n"
+    "Составь подробный план питания: примерное меню на день, укладывающееся в эти цели, и советы по питанию."
+)
+
+def calculate_bmr(weight: float, height: float, age: int, gender: str = None) -> float:
     """
     Вычисляет базальный метаболизм (BMR) по формуле Mifflin-St Jeor.
-    Для мужчин: BMR = 10*weight + 6.25*height - 5*age + 5
-    Для женщин: BMR = 10*weight + 6.25*height - 5*age - 161
+    Если пол не указан, берётся среднее между формулами для мужчин и женщин.
     """
-    if gender.lower() == 'male':
-        return 10 * weight + 6.25 * height - 5 * age + 5
-    else:
-        return 10 * weight + 6.25 * height - 5 * age - 161
+    return energy.mifflin_st_jeor(weight, height, age, gender)
 
-def generate_nutrition_plan(user_data: dict) -> str:
+def build_plan_inputs(user_data: dict) -> dict:
     """
-    Генерирует персональный план питания на основе данных пользователя.
+    Извлекает из профиля данные, от которых зависит план питания, и
+    рассчитывает калорийность и макроэлементы (модуль energy).
     Ожидается, что в user_data присутствуют следующие ключи:
       - 'age': возраст (в годах)
       - 'weight': вес (в кг)
       - 'height': рост (в см)
-      - 'gender': пол ('male' или 'female')
+      - 'activity': уровень активности из регистрации
+      - 'gender': пол ('male' или 'female'), необязательно
       - 'goal': цель (например, "похудение", "набор массы" или "поддержание здоровья")
       - 'allergies': информация об аллергиях
       - 'diseases': информация о хронических заболеваниях
-    Если какие-либо данные отсутствуют, используются значения по умолчанию.
+    Если какие-либо данные отсутствуют или некорректны, используются значения по умолчанию.
+    Рассчитанные числа входят в ключ кэша планов.
     """
-    try:
-        # Извлечение данных с установкой дефолтных значений
-        weight = float(user_data.get('weight', 70))
-        height = float(user_data.get('height', 170))
-        age = int(user_data.get('age', 30))
-        gender = user_data.get('gender', 'male')
-        goal = user_data.get('goal', 'поддержание здоровья')
-        allergies = user_data.get('allergies', 'нет')
-        diseases = user_data.get('diseases', 'нет')
+    return build_plan_inputs_batch([user_data])[0]
+
+def build_plan_inputs_batch(profiles: list) -> list:
+    """
+    То же, что build_plan_inputs, для списка профилей: цели всех профилей
+    считаются одним векторным расчётом (energy.compute_targets_batch).
+    """
+    if not profiles:
+        return []
+    targets = energy.round_targets(energy.compute_targets_batch(**energy.profiles_to_arrays(profiles)))
+    return [_plan_inputs(profile, target) for profile, target in zip(profiles, targets)]
 
-        # Расчет BMR и суточной калорийности (примерный коэффициент активности = 1.2)
-        bmr = calculate_bmr(weight, height, age, gender)
-        daily_calories = bmr * 1.2
+def _plan_inputs(user_data: dict, targets: dict) -> dict:
+    """Входные данные промпта из профиля и рассчитанных для него целей"""
+    values = energy.profile_values(user_data)
+    return {
+        'age': values['age'],
+        'weight': values['weight'],
+        'height': values['height'],
+        'gender': values['gender'] or 'не указан',
+        'activity': values['activity'],
+        'goal': values['goal'],
+        'allergies': token_budget.trim(user_data.get('allergies') or 'нет', token_budget.PROFILE_FIELD_MAX_TOKENS),
+        'diseases': token_budget.trim(user_data.get('diseases') or 'нет', token_budget.PROFILE_FIELD_MAX_TOKENS),
+        'bmr': targets['bmr'],
+        'tdee': targets['tdee'],
+        'daily_calories': targets['calories'],
+        'protein_g': targets['protein_g'],
+        'fat_g': targets['fat_g'],
+        'carbs_g': targets['carbs_g']
+    }
+
+@lru_cache(maxsize=None)
+def get_plan_chain():
+    """Цепочка генерации плана питания (создаётся один раз)"""
+    return PLAN_PROMPT | get_model("nutrition") | StrOutputParser()
 
-        # Формирование промпта для генерации плана питания
-        prompt_text = (
-            "Ты опытный диетолог с многолетним стажем. "
-            "На основе следующих данных пользователя сформируй персональный план питания:\n"
-            "Возраст: {age} лет\n"
-            "Вес: {weight} кг\n"
-            "Рост: {height} см\n"
-            "Пол: {gender}\n"
-            "Цель: {goal}\n"
-            "Хронические заболевания: {diseases}\n"
-            "Аллергии: {allergies}\n"
-            "Базальный метаболизм (BMR): {bmr:.0f} калорий\n"
-            "Рекомендуемая суточная калорийность: {daily_calories:.0f} калорий\n\n"
-            "Составь подробный план питания, включая примерное меню на день, рекомендации по распределению макроэлементов и советы по питанию."
-        )
-        prompt_filled = prompt_text.format(
-            age=age,
-            weight=weight,
-            height=height,
-            gender=gender,
-            goal=goal,
-            diseases=diseases,
-            allergies=allergies,
-            bmr=bmr,
-            daily_calories=daily_calories
-        )
+async def generate_nutrition_plan(user_data: dict, regenerate: bool = False) -> str:
+    """
+    Возвращает персональный план питания. Если для тех же входных данных план
+    уже сгенерирован, он отдаётся из кэша; regenerate=True принудительно
+    создаёт новый план и заменяет им закэшированный.
+    """
+    started = time.monotonic()
+    try:
+        inputs = build_plan_inputs(user_data)
+        cache_key = plan_cache.make_key(inputs)
+        if not regenerate:
+            cached_plan = await async_db.run(plan_cache.get_plan, cache_key)
+            if cached_plan is not None:
+                plan_cache.record(True, time.monotonic() - started)
+                return cached_plan
 
-        # Создание цепочки для генерации ответа через LLM с использованием LangChain
-        chain = (
-            ChatPromptTemplate.from_template(prompt_filled)
-            | ChatOpenAI(
-                model="gpt-3.5-turbo",
-                temperature=0.7,
-                max_tokens=1000,
-                openai_api_key=os.getenv("OPENAI_API_KEY")
-            )
-            | StrOutputParser()
-        )
-        result = chain.invoke({})
+        result = await ainvoke(get_plan_chain(), inputs, "nutrition")
+        await async_db.run(plan_cache.put_plan, cache_key, result)
+        plan_cache.record(False, time.monotonic() - started)
         return result
 
     except Exception as e:
@@ -102,10 +129,11 @@ if __name__ == '__main__':
         'weight': '70',
         'height': '170',
         'gender': 'male',
+        'activity': '3️⃣ Средний (3-4 тренировки в неделю)',
         'goal': 'похудение',
         'allergies': 'нет',
         'diseases': 'нет'
     }
-    plan = generate_nutrition_plan(sample_user_data)
+    plan = asyncio.run(generate_nutrition_plan(sample_user_data))
     print(plan)
 
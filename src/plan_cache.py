@@ -0,0 +1,130 @@
+# plan_cache.py
+"""
+Постоянный кэш планов питания в SQLite (таблица nutrition_plans).
+
+Ключ — хэш нормализованных входных данных плана, поэтому пока профиль
+пользователя не меняется, повторный запрос отдаётся из кэша без обращения
+к LLM. Тексты планов хранятся зашифрованными, как и профили.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+
+from cryptography.fernet import InvalidToken
+
+import db
+from cache_stats import EveryN, HitStats
+
+logger = logging.getLogger(__name__)
+
+PLAN_CACHE_TTL = float(os.getenv("PLAN_CACHE_TTL", str(24 * 3600)))
+PLAN_CACHE_MAX_ENTRIES = int(os.getenv("PLAN_CACHE_MAX_ENTRIES", "50000"))
+# Как часто (в числе записей) проверять превышение размера кэша
+PLAN_CACHE_EVICT_EVERY = 100
+
+SQL_SELECT_PLAN = "SELECT plan, created_at FROM nutrition_plans WHERE cache_key=?"
+SQL_TOUCH_PLAN = "UPDATE nutrition_plans SET accessed_at=? WHERE cache_key=?"
+SQL_DELETE_PLAN = "DELETE FROM nutrition_plans WHERE cache_key=?"
+SQL_UPSERT_PLAN = '''
+    INSERT INTO nutrition_plans (cache_key, plan, created_at, accessed_at)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT(cache_key) DO UPDATE SET
+        plan = excluded.plan,
+        created_at = excluded.created_at,
+        accessed_at = excluded.accessed_at
+'''
+SQL_EVICT_PLANS = '''
+    DELETE FROM nutrition_plans WHERE cache_key IN (
+        SELECT cache_key FROM nutrition_plans
+        ORDER BY accessed_at DESC
+        LIMIT -1 OFFSET ?
+    )
+'''
+SQL_DELETE_EXPIRED = "DELETE FROM nutrition_plans WHERE created_at < ?"
+SQL_SELECT_CACHED_KEYS = "SELECT cache_key FROM nutrition_plans WHERE cache_key IN (SELECT value FROM json_each(?))"
+SQL_RENEW_PLANS = "UPDATE nutrition_plans SET created_at=? WHERE cache_key IN (SELECT value FROM json_each(?))"
+
+_stats = HitStats()
+_cleanup = EveryN(PLAN_CACHE_EVICT_EVERY)
+record = _stats.record
+get_stats = _stats.get_stats
+
+
+def make_key(inputs: dict) -> str:
+    """Хэш нормализованных входных данных плана"""
+    normalized = {
+        key: value.strip().lower() if isinstance(value, str) else value
+        for key, value in inputs.items()
+    }
+    payload = json.dumps(normalized, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def get_plan(cache_key: str):
+    """
+    Возвращает план из кэша или None (нет записи, истёк TTL или запись
+    не расшифровывается текущими ключами — такая удаляется)
+    """
+    try:
+        conn = db.get_connection()
+        row = conn.execute(SQL_SELECT_PLAN, (cache_key,)).fetchone()
+        if row is None:
+            return None
+        plan, created_at = row
+        now = time.time()
+        with conn:
+            if now - created_at > PLAN_CACHE_TTL:
+                conn.execute(SQL_DELETE_PLAN, (cache_key,))
+                return None
+            conn.execute(SQL_TOUCH_PLAN, (now, cache_key))
+        try:
+            return db.decrypt_data(plan)
+        except InvalidToken:
+            logger.warning("Cached plan cannot be decrypted with the current keys, removing it")
+            with conn:
+                conn.execute(SQL_DELETE_PLAN, (cache_key,))
+            return None
+    except sqlite3.Error as e:
+        logger.error(f"Error reading plan cache: {e}")
+        return None
+
+
+def put_plan(cache_key: str, plan: str) -> None:
+    """Сохраняет план; время от времени удаляет устаревшие и лишние записи"""
+    try:
+        conn = db.get_connection()
+        now = time.time()
+        with conn:
+            conn.execute(SQL_UPSERT_PLAN, (cache_key, db.encrypt_data(plan), now, now))
+        if _cleanup.tick():
+            with conn:
+                expired = conn.execute(SQL_DELETE_EXPIRED, (now - PLAN_CACHE_TTL,)).rowcount
+                evicted = conn.execute(SQL_EVICT_PLANS, (PLAN_CACHE_MAX_ENTRIES,)).rowcount
+            if expired or evicted:
+                logger.info(f"Plan cache cleanup: {expired} expired, {evicted} evicted")
+    except sqlite3.Error as e:
+        logger.error(f"Error writing plan cache: {e}")
+
+
+def renew_keys(cache_keys: list) -> set:
+    """
+    Ключи из cache_keys, для которых в кэше уже есть план; срок действия
+    этих планов отсчитывается заново. Ключ — хэш всех входных данных плана,
+    поэтому совпадение ключа означает, что профиль не менялся и план
+    по-прежнему подходит, даже если его TTL уже подходит к концу.
+    """
+    if not cache_keys:
+        return set()
+    try:
+        conn = db.get_connection()
+        with conn:
+            keys = [row[0] for row in conn.execute(SQL_SELECT_CACHED_KEYS, (json.dumps(list(cache_keys)),))]
+            if keys:
+                conn.execute(SQL_RENEW_PLANS, (time.time(), json.dumps(keys)))
+        return set(keys)
+    except sqlite3.Error as e:
+        logger.error(f"Error renewing cached plans: {e}")
+        return set()
@@ -0,0 +1,173 @@
+# plan_pregen.py
+"""
+Ночная подготовка планов питания для всех пользователей.
+
+Пользователи читаются порциями (keyset-пагинация по users.id), для каждого
+считаются входные данные плана. Если для них в кэше уже есть план
+(профиль не менялся), срок его действия продлевается и пользователь
+пропускается; остальные планы
+генерируются через llm.ainvoke — с общим лимитером и объединением одинаковых
+запросов, не более PLAN_PREGEN_CONCURRENCY одновременно — и повторами
+с экспоненциальной задержкой. Готовые планы попадают в
+plan_cache, откуда /nutrition отдаёт их сразу.
+
+После каждой порции в таблице job_state сохраняется контрольная точка,
+поэтому прерванный запуск продолжается с места остановки.
+"""
+import os
+import time
+import asyncio
+import logging
+
+import db
+import async_db
+import plan_cache
+import token_budget
+from llm import ainvoke
+from nutrition_agent import build_plan_inputs_batch, get_plan_chain
+
+logger = logging.getLogger(__name__)
+
+JOB_NAME = "plan_pregeneration"
+
+PLAN_PREGEN_HOUR = os.getenv("PLAN_PREGEN_HOUR", "3")
+PLAN_PREGEN_CHUNK_SIZE = int(os.getenv("PLAN_PREGEN_CHUNK_SIZE", "200"))
+PLAN_PREGEN_CONCURRENCY = int(os.getenv("PLAN_PREGEN_CONCURRENCY", "4"))
+PLAN_PREGEN_RETRIES = int(os.getenv("PLAN_PREGEN_RETRIES", "3"))
+PLAN_PREGEN_BACKOFF = float(os.getenv("PLAN_PREGEN_BACKOFF", "2"))
+# Незавершённый запуск продолжается, если он начат не раньше этого срока
+PLAN_PREGEN_RESUME_WINDOW = float(os.getenv("PLAN_PREGEN_RESUME_WINDOW", str(12 * 3600)))
+
+_run_lock = asyncio.Lock()
+
+
+def load_chunk(after_id: int, limit: int) -> tuple:
+    """
+    Порция пользователей после after_id: (последний id или None, [(telegram_id, user_data), ...]).
+    Пользователи без профиля пропускаются.
+    """
+    rows = db.get_profiles_chunk(after_id, limit)
+    if not rows:
+        return None, []
+    users = [(telegram_id, user_data) for _, telegram_id, user_data in rows if user_data]
+    return rows[-1][0], users
+
+
+async def generate_batch(inputs_list: list) -> list:
+    """
+    Генерирует планы пачкой через llm.ainvoke; неудачные запросы повторяются
+    с экспоненциальной задержкой. Возвращает список планов (None для
+    окончательно неудачных и слишком длинных промптов).
+    """
+    chain = get_plan_chain()
+    # Ночная генерация занимает не больше PLAN_PREGEN_CONCURRENCY слотов
+    # общего лимитера, остальные остаются запросам пользователей
+    semaphore = asyncio.Semaphore(PLAN_PREGEN_CONCURRENCY)
+
+    async def generate(inputs: dict):
+        async with semaphore:
+            return await ainvoke(chain, inputs, "nutrition")
+
+    results = [None] * len(inputs_list)
+    pending = list(range(len(inputs_list)))
+    for attempt in range(PLAN_PREGEN_RETRIES + 1):
+        if attempt:
+            delay = PLAN_PREGEN_BACKOFF * 2 ** (attempt - 1)
+            logger.warning(f"Plan pre-generation: retrying {len(pending)} requests in {delay:.0f} s")
+            await asyncio.sleep(delay)
+        outputs = await asyncio.gather(
+            *(generate(inputs_list[i]) for i in pending),
+            return_exceptions=True
+        )
+        failed = []
+        for i, output in zip(pending, outputs):
+            if isinstance(output, token_budget.PromptTooLong):
+                # Повтор не поможет
+                logger.warning(f"Plan pre-generation: prompt too long ({output})")
+            elif isinstance(output, Exception):
+                logger.debug(f"Plan pre-generation request failed: {output}")
+                failed.append(i)
+            else:
+                results[i] = output
+        pending = failed
+        if not pending:
+            break
+    return results
+
+
+async def process_chunk(users: list) -> dict:
+    """Готовит планы для порции пользователей, возвращает счётчики"""
+    stats = {'users': len(users), 'skipped': 0, 'generated': 0, 'failed': 0}
+    # Цели порции считаются одним расчётом, одинаковые входные данные дают один запрос
+    inputs_by_key = {}
+    for inputs in build_plan_inputs_batch([user_data for _, user_data in users]):
+        inputs_by_key.setdefault(plan_cache.make_key(inputs), inputs)
+
+    # Для неизменившихся профилей план уже есть: продлеваем его вместо нового запроса к LLM
+    cached = await async_db.run(plan_cache.renew_keys, list(inputs_by_key))
+    stats['skipped'] = len(cached)
+
+    keys = [key for key in inputs_by_key if key not in cached]
+    if keys:
+        plans = await generate_batch([inputs_by_key[key] for key in keys])
+        for key, plan in zip(keys, plans):
+            if plan is None:
+                stats['failed'] += 1
+                continue
+            await async_db.run(plan_cache.put_plan, key, plan)
+            stats['generated'] += 1
+    return stats
+
+
+async def pregenerate_plans(chunk_size: int = PLAN_PREGEN_CHUNK_SIZE, resume_only: bool = False) -> dict:
+    """
+    Проходит по всем пользователям и заполняет кэш планов.
+    Незавершённый недавний запуск продолжается с контрольной точки;
+    resume_only=True — только продолжить такой запуск, новый не начинать.
+    """
+    state = await async_db.run(db.get_job_state, JOB_NAME)
+    now = time.time()
+    if (state and state['finished_at'] is None
+            and now - state['started_at'] < PLAN_PREGEN_RESUME_WINDOW):
+        started_at, after_id = state['started_at'], state['last_id']
+        logger.info(f"Plan pre-generation: resuming after user id {after_id}")
+    elif resume_only:
+        return {}
+    else:
+        started_at, after_id = now, 0
+        await async_db.run(db.save_job_state, JOB_NAME, started_at, after_id)
+        logger.info("Plan pre-generation started")
+
+    totals = {'users': 0, 'skipped': 0, 'generated': 0, 'failed': 0}
+    run_started = time.monotonic()
+    while True:
+        last_id, users = await async_db.run(load_chunk, after_id, chunk_size)
+        if last_id is None:
+            break
+        if users:
+            for name, value in (await process_chunk(users)).items():
+                totals[name] += value
+        after_id = last_id
+        await async_db.run(db.save_job_state, JOB_NAME, started_at, after_id)
+
+    await async_db.run(db.save_job_state, JOB_NAME, started_at, after_id, time.time())
+    elapsed = time.monotonic() - run_started
+    logger.info(
+        f"Plan pre-generation finished in {elapsed:.1f} s: {totals['users']} users, "
+        f"{totals['generated']} generated, {totals['skipped']} up to date, {totals['failed']} failed "
+        f"({totals['users'] / elapsed if elapsed else 0:.1f} users/s, "
+        f"{totals['generated'] / elapsed if elapsed else 0:.2f} plans/s)"
+    )
+    return totals
+
+
+async def run_plan_pregeneration(resume_only: bool = False) -> None:
+    """Точка входа для планировщика: ошибки только логируются, запуски не пересекаются"""
+    if _run_lock.locked():
+        logger.info("Plan pre-generation is already running")
+        return
+    try:
+        async with _run_lock:
+            await pregenerate_plans(resume_only=resume_only)
+    except Exception as e:
+        logger.error(f"Ошибка подготовки планов питания: {e}", exc_info=True)
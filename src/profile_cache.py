@@ -0,0 +1,116 @@
+# profile_cache.py
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+def _estimate_size(profile: dict) -> int:
+    """Приблизительный размер профиля в памяти (байты)"""
+    size = sys.getsizeof(profile)
+    for key, value in profile.items():
+        size += sys.getsizeof(key) + sys.getsizeof(value)
+    return size
+
+
+class ProfileCache:
+    """
+    Ограниченный LRU/TTL-кэш расшифрованных профилей.
+    Данные хранятся только в памяти процесса и никогда не пишутся на диск.
+
+    Чтение из БД и put не атомарны: профиль, прочитанный до изменения, может
+    попасть в кэш уже после invalidate. Поэтому invalidate увеличивает номер
+    поколения ключа, читающий берёт generation() до запроса к БД и передаёт
+    его в put — устаревший профиль с прежним номером не сохраняется.
+    """
+
+    def __init__(self, max_entries: int = 10000, ttl: float = 300, max_bytes: int = 16 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # telegram_id -> (expires_at, size, profile)
+        self._bytes = 0
+        # telegram_id -> номер последней инвалидации; хранится не больше max_entries
+        # последних, для забытых generation() возвращает наибольший вытесненный номер
+        self._generations = OrderedDict()
+        self._invalidations = 0
+        self._forgotten = 0
+        self._lock = threading.Lock()
+
+    def get(self, telegram_id: int):
+        """Возвращает копию профиля или None, если его нет в кэше"""
+        with self._lock:
+            entry = self._entries.get(telegram_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, size, profile = entry
+            if expires_at < time.monotonic():
+                self._remove(telegram_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(telegram_id)
+            self.hits += 1
+            # Копия, чтобы обработчики не меняли закэшированный профиль
+            return dict(profile)
+
+    def generation(self, telegram_id: int) -> int:
+        """Номер поколения ключа; читается до запроса к БД и передаётся в put"""
+        with self._lock:
+            return self._generations.get(telegram_id, self._forgotten)
+
+    def put(self, telegram_id: int, profile: dict, generation: int = None) -> None:
+        """Сохраняет профиль; если с generation ключ инвалидировали, ничего не делает"""
+        if self.max_entries <= 0:
+            return
+        profile = dict(profile)
+        size = _estimate_size(profile)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and self._generations.get(telegram_id, self._forgotten) != generation:
+                logger.debug(f"Профиль {telegram_id} изменился во время чтения, в кэш не кладём")
+                return
+            if telegram_id in self._entries:
+                self._remove(telegram_id)
+            self._entries[telegram_id] = (time.monotonic() + self.ttl, size, profile)
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest_id = next(iter(self._entries))
+                self._remove(oldest_id)
+
+    def invalidate(self, telegram_id: int) -> None:
+        with self._lock:
+            if telegram_id in self._entries:
+                self._remove(telegram_id)
+            self._invalidations += 1
+            self._generations[telegram_id] = self._invalidations
+            self._generations.move_to_end(telegram_id)
+            while len(self._generations) > max(self.max_entries, 1):
+                # Номера растут в порядке OrderedDict: вытесняется наименьший
+                _, self._forgotten = self._generations.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'entries': len(self._entries),
+                'bytes': self._bytes
+            }
+
+    def _remove(self, telegram_id: int) -> None:
+        _, size, _ = self._entries.pop(telegram_id)
+        self._bytes -= size
@@ -0,0 +1,230 @@
+# recipe_store.py
+"""
+Хранилище сгенерированных рецептов (таблицы recipes, recipe_tokens, recipe_token_df).
+
+Список ингредиентов превращается в множество токенов: нормализованные слова
+без единиц измерения и служебных слов, с отброшенным окончанием и обрезанные
+до RECIPE_TOKEN_LENGTH букв («курицу», «курица» и «курицы» дают один токен).
+Рецепт сохраняется вместе с целью пользователя и токенами его аллергий,
+а обратный индекс recipe_tokens связывает каждый токен с рецептами.
+
+Похожесть наборов — коэффициент Жаккара |A∩B| / |A∪B|. Чтобы при сотнях
+тысяч рецептов не перебирать длинные списки популярных токенов, кандидаты
+ищутся только по самым редким токенам запроса (prefix filtering): рецепт
+с похожестью не ниже порога обязан содержать хотя бы один из них.
+Кроме того, в индексе учитываются цель и размер набора.
+
+Рецепт отдаётся пользователю, только если все его аллергии учитывались при
+генерации и ни один аллерген не встречается в тексте рецепта.
+Поиск и запись обращаются к SQLite, поэтому recipes.py вызывает их через async_db.run.
+"""
+import os
+import re
+import json
+import math
+import time
+import sqlite3
+import logging
+
+import db
+from cache_stats import EveryN, HitStats
+from answer_cache import normalize_question, stem
+from energy import GOAL_CODES, normalize_goal
+
+logger = logging.getLogger(__name__)
+
+# Минимальная похожесть набора ингредиентов (Жаккар), при которой рецепт отдаётся без LLM
+RECIPE_STORE_MIN_SIMILARITY = float(os.getenv("RECIPE_STORE_MIN_SIMILARITY", "0.8"))
+RECIPE_STORE_MAX_ENTRIES = int(os.getenv("RECIPE_STORE_MAX_ENTRIES", "500000"))
+# Как часто (в числе записей) проверять превышение размера хранилища
+RECIPE_STORE_EVICT_EVERY = 100
+# Сколько лучших кандидатов проверяется на аллергены
+RECIPE_STORE_MAX_CANDIDATES = 5
+RECIPE_TOKEN_LENGTH = 6
+
+_words = re.compile(r"[^\W\d_]+")
+
+# Единицы измерения, предлоги и слова вроде «нет» в поле аллергий
+STOP_WORDS = {
+    "и", "или", "с", "со", "без", "на", "в", "во", "для", "по", "из", "к", "не",
+    "г", "гр", "грамм", "кг", "мл", "л", "шт", "штук", "штуки", "ст", "ч",
+    "ложка", "ложки", "чайная", "столовая", "щепотка", "немного", "вкусу",
+    "нет", "нету", "никаких", "отсутствует", "отсутствуют", "аллергия", "аллергии", "аллергий"
+}
+SQL_SELECT_EXACT = "SELECT id, allergies_key FROM recipes WHERE ingredients_key=? AND goal=?"
+SQL_SELECT_DF = "SELECT token, df FROM recipe_token_df WHERE token IN (SELECT value FROM json_each(?))"
+SQL_SELECT_CANDIDATES = '''
+    SELECT DISTINCT r.id, r.ingredients_key, r.allergies_key
+    FROM recipe_tokens t JOIN recipes r ON r.id = t.recipe_id
+    WHERE t.token IN (SELECT value FROM json_each(?))
+      AND t.goal = ? AND t.token_count BETWEEN ? AND ?
+'''
+SQL_SELECT_RECIPE = "SELECT recipe FROM recipes WHERE id=?"
+SQL_TOUCH_RECIPE = "UPDATE recipes SET accessed_at=?, hits=hits+1 WHERE id=?"
+SQL_SELECT_RECIPE_ID = "SELECT id FROM recipes WHERE ingredients_key=? AND goal=? AND allergies_key=?"
+SQL_UPDATE_RECIPE = "UPDATE recipes SET recipe=?, created_at=?, accessed_at=? WHERE id=?"
+SQL_INSERT_RECIPE = '''
+    INSERT INTO recipes (ingredients_key, goal, allergies_key, token_count, recipe, created_at, accessed_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+'''
+SQL_INSERT_POSTING = "INSERT OR IGNORE INTO recipe_tokens (token, goal, token_count, recipe_id) VALUES (?, ?, ?, ?)"
+SQL_DELETE_POSTING = "DELETE FROM recipe_tokens WHERE token=? AND goal=? AND token_count=? AND recipe_id=?"
+SQL_INCREMENT_DF = '''
+    INSERT INTO recipe_token_df (token, df) VALUES (?, 1)
+    ON CONFLICT(token) DO UPDATE SET df = df + 1
+'''
+SQL_DECREMENT_DF = "UPDATE recipe_token_df SET df = df - 1 WHERE token=?"
+SQL_DELETE_EMPTY_DF = "DELETE FROM recipe_token_df WHERE df <= 0"
+SQL_COUNT_RECIPES = "SELECT COUNT(*) FROM recipes"
+SQL_SELECT_EVICTED = '''
+    SELECT id, ingredients_key, goal, token_count FROM recipes
+    ORDER BY accessed_at DESC
+    LIMIT -1 OFFSET ?
+'''
+SQL_DELETE_RECIPE = "DELETE FROM recipes WHERE id=?"
+
+_stats = HitStats()
+_cleanup = EveryN(RECIPE_STORE_EVICT_EVERY)
+record = _stats.record
+get_stats = _stats.get_stats
+
+
+def tokenize(text: str) -> set:
+    """Множество токенов текста (ингредиентов, аллергий или рецепта)"""
+    return {
+        stem(word, RECIPE_TOKEN_LENGTH) for word in _words.findall(normalize_question(text or ""))
+        if len(word) > 1 and word not in STOP_WORDS
+    }
+
+
+def jaccard(a: set, b: set) -> float:
+    union = len(a | b)
+    return len(a & b) / union if union else 0.0
+
+
+def contains_allergens(recipe: str, allergens: set) -> bool:
+    """В тексте рецепта есть слово, начинающееся с основы одного из аллергенов"""
+    if not allergens:
+        return False
+    return any(token.startswith(allergen) for token in tokenize(recipe) for allergen in allergens)
+
+
+def _size_bounds(size: int, threshold: float) -> tuple:
+    """
+    Допустимое число токенов рецепта (от, до) при пороге Жаккара threshold.
+    Нижняя граница одновременно минимальное пересечение с запросом.
+    """
+    # Небольшой допуск, чтобы 0.8 * 5 не превратилось в 5 из-за погрешности
+    return max(1, math.ceil(threshold * size - 1e-9)), math.floor(size / threshold + 1e-9)
+
+
+def _allergies_covered(allergens: set, allergies_key: str) -> bool:
+    """Аллергии пользователя учитывались при генерации рецепта"""
+    return not allergens or allergens <= set(allergies_key.split())
+
+
+def _serve(conn: sqlite3.Connection, candidates: list, allergens: set):
+    """Первый из кандидатов [(похожесть, id), ...], в тексте которого нет аллергенов"""
+    for similarity, recipe_id in candidates[:RECIPE_STORE_MAX_CANDIDATES]:
+        row = conn.execute(SQL_SELECT_RECIPE, (recipe_id,)).fetchone()
+        # Рецепт мог быть удалён вытеснением между поиском кандидатов и чтением
+        if row is None or contains_allergens(row[0], allergens):
+            continue
+        recipe = row[0]
+        with conn:
+            conn.execute(SQL_TOUCH_RECIPE, (time.time(), recipe_id))
+        return recipe, similarity
+    return None
+
+
+def find_recipe(ingredients: str, goal: str, allergies: str, threshold: float = RECIPE_STORE_MIN_SIMILARITY):
+    """
+    Самый похожий сохранённый рецепт для того же набора ингредиентов, цели
+    и аллергий или None. Возвращает (рецепт, похожесть).
+    Сначала проверяется точное совпадение набора, затем похожие наборы.
+    """
+    query = tokenize(ingredients)
+    if not query:
+        return None
+    allergens = tokenize(allergies)
+    goal_code = GOAL_CODES[normalize_goal(goal)]
+    min_size, max_size = _size_bounds(len(query), threshold)
+    try:
+        conn = db.get_connection()
+        exact = [
+            (1.0, recipe_id)
+            for recipe_id, allergies_key in conn.execute(SQL_SELECT_EXACT, (" ".join(sorted(query)), goal_code))
+            if _allergies_covered(allergens, allergies_key)
+        ]
+        found = _serve(conn, exact, allergens)
+        if found is not None:
+            return found
+
+        df = dict(conn.execute(SQL_SELECT_DF, (json.dumps(sorted(query)),)).fetchall())
+        # Рецепт с похожестью не ниже порога содержит хотя бы один из
+        # len(query) - min_size + 1 самых редких токенов запроса
+        rare = sorted(query, key=lambda token: df.get(token, 0))[:len(query) - min_size + 1]
+        rare = [token for token in rare if token in df]
+        if not rare:
+            return None
+        rows = conn.execute(
+            SQL_SELECT_CANDIDATES, (json.dumps(rare), goal_code, min_size, max_size)
+        ).fetchall()
+
+        candidates = []
+        for recipe_id, ingredients_key, allergies_key in rows:
+            if not _allergies_covered(allergens, allergies_key):
+                continue
+            similarity = jaccard(query, set(ingredients_key.split()))
+            if similarity >= threshold:
+                candidates.append((similarity, recipe_id))
+        candidates.sort(reverse=True)
+        return _serve(conn, candidates, allergens)
+    except sqlite3.Error as e:
+        logger.error(f"Error reading recipe store: {e}")
+        return None
+
+
+def put_recipe(ingredients: str, goal: str, allergies: str, recipe: str) -> None:
+    """Сохраняет рецепт и индексирует его токены; время от времени удаляет давно не использованные"""
+    tokens = tokenize(ingredients)
+    if not tokens:
+        return
+    ingredients_key = " ".join(sorted(tokens))
+    allergies_key = " ".join(sorted(tokenize(allergies)))
+    goal_code = GOAL_CODES[normalize_goal(goal)]
+    try:
+        conn = db.get_connection()
+        now = time.time()
+        with conn:
+            row = conn.execute(SQL_SELECT_RECIPE_ID, (ingredients_key, goal_code, allergies_key)).fetchone()
+            if row is not None:
+                conn.execute(SQL_UPDATE_RECIPE, (recipe, now, now, row[0]))
+            else:
+                recipe_id = conn.execute(SQL_INSERT_RECIPE, (
+                    ingredients_key, goal_code, allergies_key, len(tokens), recipe, now, now
+                )).lastrowid
+                conn.executemany(SQL_INSERT_POSTING, [(token, goal_code, len(tokens), recipe_id) for token in tokens])
+                conn.executemany(SQL_INCREMENT_DF, [(token,) for token in tokens])
+        if _cleanup.tick():
+            evict()
+    except sqlite3.Error as e:
+        logger.error(f"Error writing recipe store: {e}")
+
+
+def evict(max_entries: int = None) -> int:
+    """Удаляет давно не использованные рецепты сверх max_entries вместе с их постингами"""
+    max_entries = RECIPE_STORE_MAX_ENTRIES if max_entries is None else max_entries
+    conn = db.get_connection()
+    if conn.execute(SQL_COUNT_RECIPES).fetchone()[0] <= max_entries:
+        return 0
+    with conn:
+        rows = conn.execute(SQL_SELECT_EVICTED, (max_entries,)).fetchall()
+        for recipe_id, ingredients_key, goal_code, token_count in rows:
+            tokens = ingredients_key.split()
+            conn.executemany(SQL_DELETE_POSTING, [(token, goal_code, token_count, recipe_id) for token in tokens])
+            conn.executemany(SQL_DECREMENT_DF, [(token,) for token in tokens])
+            conn.execute(SQL_DELETE_RECIPE, (recipe_id,))
+        conn.execute(SQL_DELETE_EMPTY_DF)
+    logger.info(f"Recipe store cleanup: {len(rows)} evicted")
+    return len(rows)
@@ -1,48 +1,159 @@
+import time
 import logging
+import threading
+from functools import lru_cache
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers import StrOutputParser
+from llm import get_model, ainvoke, astream
+import async_db
+import recipe_store
+import token_budget
+from token_budget import PromptTooLong
 
 logger = logging.getLogger(__name__)
 
-def generate_recipe_with_openai(ingredients: str, user_context: dict) -> str:
-    """Генерация рецепта с улучшенной обработкой ошибок"""
+# Промпт с учётом целей пользователя (разбирается один раз при импорте)
+RECIPE_PROMPT = ChatPromptTemplate.from_template(
+    "Ты шеф-повар и диетолог. Создай рецепт используя: {ingredients}\n"
+    "Учти:\n"
+    "- Аллергии: {allergies}\n"
+    "- Цель: {goal}\n"
+    "Формат:\n"
+    "1. 🍽️ Название блюда\n"
+    "2. 📋 Ингредиенты\n"
+    "3. 🧑🍳 Приготовление\n"
+    "4. 🏷️ КБЖУ"
+)
+
+EMPTY_INGREDIENTS = "❌ Пожалуйста, укажите ингредиенты"
+TOO_MANY_INGREDIENTS = "❌ Слишком длинный список ингредиентов. Сократите его и попробуйте снова."
+RECIPE_ERROR = "⚠️ Не удалось создать рецепт. Проверьте ингредиенты и попробуйте снова."
+
+_stats_lock = threading.Lock()
+_delivery_stats = {'count': 0, 'first_response': 0.0, 'total': 0.0}
+
+
+@lru_cache(maxsize=None)
+def get_recipe_chain():
+    """Цепочка генерации рецепта (создаётся один раз)"""
+    return RECIPE_PROMPT | get_model("recipe") | StrOutputParser()
+
+
+def build_recipe_inputs(ingredients: str, user_context: dict) -> dict:
+    """
+    Входные данные цепочки рецепта.
+    Бросает ValueError для пустого списка ингредиентов и PromptTooLong для слишком длинного.
+    """
+    if not ingredients.strip():
+        raise ValueError("empty ingredients")
+    if token_budget.count_tokens(ingredients) > token_budget.INGREDIENTS_MAX_TOKENS:
+        raise PromptTooLong("ingredients list is too long")
+    return {
+        "ingredients": ingredients,
+        "allergies": token_budget.trim(
+            user_context.get("allergies", "нет"), token_budget.PROFILE_FIELD_MAX_TOKENS
+        ),
+        "goal": user_context.get("goal", "нет данных")
+    }
+
+
+def is_recipe_error(text: str) -> bool:
+    """Текст — сообщение об ошибке, а не рецепт"""
+    return text in (EMPTY_INGREDIENTS, TOO_MANY_INGREDIENTS, RECIPE_ERROR)
+
+
+async def find_stored_recipe(ingredients: str, user_context: dict):
+    """Готовый рецепт из хранилища для похожего набора ингредиентов или None"""
+    started = time.monotonic()
+    found = await async_db.run(
+        recipe_store.find_recipe, ingredients,
+        user_context.get("goal"), user_context.get("allergies", "нет")
+    )
+    recipe_store.record(found is not None, time.monotonic() - started)
+    if found is None:
+        return None
+    recipe, similarity = found
+    logger.debug(f"Рецепт из хранилища (похожесть {similarity:.2f})")
+    return recipe
+
+
+async def store_recipe(ingredients: str, user_context: dict, recipe: str) -> None:
+    """Сохраняет сгенерированный рецепт для следующих похожих запросов"""
+    await async_db.run(
+        recipe_store.put_recipe, ingredients,
+        user_context.get("goal"), user_context.get("allergies", "нет"), recipe
+    )
+
+
+async def generate_recipe_with_openai(ingredients: str, user_context: dict) -> str:
+    """
+    Генерация рецепта с улучшенной обработкой ошибок.
+    Для похожего набора ингредиентов (с той же целью и аллергиями) рецепт
+    берётся из хранилища, LLM вызывается только при промахе.
+    """
     try:
         # Debug-лог: выводим входные данные для отладки
         logger.debug(
             "generate_recipe_with_openai вызвана с данными:\n"
             f"ingredients={ingredients}, user_context={user_context}"
         )
+        inputs = build_recipe_inputs(ingredients, user_context)
+        stored = await find_stored_recipe(ingredients, user_context)
+        if stored is not None:
+            return stored
+        result = await ainvoke(get_recipe_chain(), inputs, "recipe")
+        await store_recipe(ingredients, user_context, result)
+        return result
 
-        # Проверка на пустые ингредиенты
-        if not ingredients.strip():
-            return "❌ Пожалуйста, укажите ингредиенты"
-
-        # Промпт с учётом целей пользователя
-        prompt_text = (
-            "Ты шеф-повар и диетолог. Создай рецепт используя: {ingredients}\n"
-            "Учти:\n"
-            "- Аллергии: {allergies}\n"
-            "- Цель: {goal}\n"
-            "Формат:\n"
-            "1. 🍽️ Название блюда\n"
-            "2. 📋 Ингредиенты\n"
-            "3. 🧑🍳 Приготовление\n"
-            "4. 🏷️ КБЖУ"
-        )
+    except PromptTooLong:
+        return TOO_MANY_INGREDIENTS
+    except ValueError:
+        return EMPTY_INGREDIENTS
+    except Exception as e:
+        logger.error(f"Ошибка генерации: {str(e)}", exc_info=True)
+        return RECIPE_ERROR
 
-        chain = (
-            ChatPromptTemplate.from_template(prompt_text)
-            | ChatOpenAI(model="gpt-3.5-turbo", temperature=0.7)
-            | StrOutputParser()
-        )
 
-        return chain.invoke({
-            "ingredients": ingredients,
-            "allergies": user_context.get("allergies", "нет"),
-            "goal": user_context.get("goal", "нет данных")
-        })
+async def stream_recipe(ingredients: str, user_context: dict):
+    """
+    Потоковая генерация рецепта: фрагменты отдаются по мере генерации, так что
+    название блюда (первая строка) известно задолго до конца ответа.
+    Рецепт из хранилища отдаётся одним фрагментом, сгенерированный —
+    сохраняется в него после окончания потока.
+    Ошибки модели не перехватываются — вызывающий код сам решает, как откатиться.
+    """
+    try:
+        inputs = build_recipe_inputs(ingredients, user_context)
+    except PromptTooLong:
+        yield TOO_MANY_INGREDIENTS
+        return
+    except ValueError:
+        yield EMPTY_INGREDIENTS
+        return
+    stored = await find_stored_recipe(ingredients, user_context)
+    if stored is not None:
+        yield stored
+        return
+    text = ""
+    async for chunk in astream(get_recipe_chain(), inputs, "recipe"):
+        text += chunk
+        yield chunk
+    await store_recipe(ingredients, user_context, text)
 
-    except Exception as e:
-        logger.error(f"Ошибка генерации: {str(e)}", exc_info=True)
-        return "⚠️ Не удалось создать рецепт. Проверьте ингредиенты и попробуйте снова."
+
+def record_delivery(first_response: float, total: float) -> None:
+    """Учитывает время до отправки текста рецепта и до конца доставки (с картинкой)"""
+    with _stats_lock:
+        _delivery_stats['count'] += 1
+        _delivery_stats['first_response'] += first_response
+        _delivery_stats['total'] += total
+
+
+def get_delivery_stats() -> dict:
+    with _stats_lock:
+        count = _delivery_stats['count']
+        return {
+            'count': count,
+            'avg_first_response_seconds': _delivery_stats['first_response'] / count if count else 0.0,
+            'avg_total_seconds': _delivery_stats['total'] / count if count else 0.0
+        }
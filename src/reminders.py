@@ -1,11 +1,19 @@
 # reminders.py
+import os
 import asyncio
 import logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from db import get_all_users
+from async_db import iter_user_ids
+from logging_setup import get_sampled_logger
+from plan_pregen import run_plan_pregeneration, PLAN_PREGEN_HOUR
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
+# Строки по каждому пользователю пишутся выборочно (LOG_SAMPLE_EVERY)
+sampled_logger = get_sampled_logger(__name__)
+
+# Размер порции пользователей, читаемой из БД за один запрос
+REMINDER_CHUNK_SIZE = int(os.getenv("REMINDER_CHUNK_SIZE", "1000"))
 
 
 async def send_water_reminder(app):
@@ -13,28 +21,27 @@ async def send_water_reminder(app):
     try:
         logger.info("Запущена отправка напоминаний о воде")
 
-        # Получаем список пользователей
-        users = get_all_users()
-        if not users:
-            logger.warning("Нет зарегистрированных пользователей для напоминаний")
-            return
-
         success_count = 0
         fail_count = 0
 
-        for user_id in users:
+        # Пользователи читаются порциями, список целиком не строится
+        async for user_id in iter_user_ids(REMINDER_CHUNK_SIZE):
             try:
                 await app.bot.send_message(
                     chat_id=user_id,
                     text="💧 Не забудьте выпить воды! Сохраняйте водный баланс!"
                 )
                 success_count += 1
-                logger.debug(f"Напоминание отправлено пользователю {user_id}")
+                sampled_logger.debug("Напоминание отправлено пользователю %s", user_id)
 
             except Exception as e:
                 fail_count += 1
                 logger.error(f"Ошибка отправки пользователю {user_id}: {str(e)}", exc_info=True)
 
+        if not success_count and not fail_count:
+            logger.warning("Нет зарегистрированных пользователей для напоминаний")
+            return
+
         logger.info(
             f"Напоминания отправлены. Успешно: {success_count}, Неудач: {fail_count}"
         )
@@ -66,6 +73,23 @@ def start_reminders(app):
             misfire_grace_time=300
         )
 
+        # Ночная подготовка планов питания к утреннему пику запросов
+        scheduler.add_job(
+            run_plan_pregeneration,
+            'cron',
+            hour=PLAN_PREGEN_HOUR,
+            id="plan_pregeneration",
+            max_instances=1,
+            coalesce=True,
+            misfire_grace_time=3600
+        )
+        # Продолжение подготовки планов, прерванной перезапуском бота
+        scheduler.add_job(
+            run_plan_pregeneration,
+            kwargs={"resume_only": True},
+            id="plan_pregeneration_resume"
+        )
+
         scheduler.start()
         logger.info("Планировщик напоминаний запущен. Напоминания будут приходить только в дневное время.")
 
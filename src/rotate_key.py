@@ -0,0 +1,160 @@
+# rotate_key.py
+"""
+Ротация ключа шифрования без остановки бота.
+
+Порядок действий:
+  1. Сгенерировать новый ключ (generate_key.py).
+  2. Запустить бота с ENCRYPTION_KEY=<новый> и ENCRYPTION_OLD_KEYS=<старый>:
+     данные читаются любым из ключей, новые записи шифруются новым.
+  3. Запустить этот скрипт с теми же переменными окружения — он перешифрует
+     порциями таблицу users, затем кэш планов nutrition_plans. После
+     прерывания повторный запуск продолжит работу с последней сохранённой
+     контрольной точки.
+  4. Убрать старый ключ из ENCRYPTION_OLD_KEYS.
+"""
+import os
+import json
+import time
+import sqlite3
+import logging
+import argparse
+
+from cryptography.fernet import InvalidToken
+
+import db
+from logging_setup import setup_logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHECKPOINT = os.path.join(db.DB_DIR, "key_rotation.json")
+
+# Все колонки users, которые содержат зашифрованные токены
+ENCRYPTED_COLUMNS = ('profile', 'age', 'weight', 'height', 'activity', 'diseases', 'allergies')
+
+# Таблицы с зашифрованными данными в порядке обработки:
+# (таблица, ключ для порций, колонки, можно ли удалить нечитаемую строку).
+# Кэш планов можно просто сгенерировать заново, профили — нет.
+ENCRYPTED_TABLES = (
+    ('users', 'id', ENCRYPTED_COLUMNS, False),
+    ('nutrition_plans', 'rowid', ('plan',), True),
+)
+
+
+def _select_chunk_sql(table: str, key: str, columns: tuple) -> str:
+    return f"SELECT {key}, {', '.join(columns)} FROM {table} WHERE {key} > ? ORDER BY {key} LIMIT ?"
+
+
+def _update_row_sql(table: str, key: str, columns: tuple) -> str:
+    return f"UPDATE {table} SET {', '.join(f'{column} = ?' for column in columns)} WHERE {key} = ?"
+
+
+def load_checkpoint(path: str) -> dict:
+    if not os.path.exists(path):
+        return {'table': ENCRYPTED_TABLES[0][0], 'last_id': 0, 'rotated': 0}
+    with open(path, encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    # Контрольные точки прежнего формата относятся к таблице users
+    checkpoint.setdefault('table', 'users')
+    return checkpoint
+
+
+def save_checkpoint(path: str, checkpoint: dict) -> None:
+    """Атомарно сохраняет контрольную точку (через временный файл)"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(tmp_path, path)
+
+
+def rotate_chunk(conn: sqlite3.Connection, after_id: int, chunk_size: int, table: str = 'users') -> tuple:
+    """
+    Перешифровывает одну порцию строк таблицы в рамках одной транзакции.
+    Блокировка на запись берётся сразу (BEGIN IMMEDIATE), поэтому строки
+    не могут измениться между чтением и записью. Строки кэша, которые не
+    расшифровываются ни одним ключом, удаляются.
+    Возвращает (последний id, число строк); id равен None, если строк больше нет.
+    """
+    _, key, columns, drop_invalid = next(spec for spec in ENCRYPTED_TABLES if spec[0] == table)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        rows = conn.execute(_select_chunk_sql(table, key, columns), (after_id, chunk_size)).fetchall()
+        updates, invalid = [], []
+        for row in rows:
+            try:
+                rotated = [db.rotate_token(value) if value else value for value in row[1:]]
+            except InvalidToken:
+                if not drop_invalid:
+                    raise
+                invalid.append((row[0],))
+                continue
+            updates.append((*rotated, row[0]))
+        conn.executemany(_update_row_sql(table, key, columns), updates)
+        if invalid:
+            conn.executemany(f"DELETE FROM {table} WHERE {key} = ?", invalid)
+            logger.warning(f"Deleted {len(invalid)} unreadable rows from {table}")
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    if not rows:
+        return None, 0
+    return rows[-1][0], len(rows)
+
+
+def rotate(chunk_size: int = 500, pause: float = 0.05, checkpoint_path: str = DEFAULT_CHECKPOINT) -> int:
+    """Перешифровывает все зашифрованные таблицы текущим ключом, возвращает число строк"""
+    if not db.ENCRYPTION_OLD_KEYS:
+        logger.warning("ENCRYPTION_OLD_KEYS is empty: tokens will be re-encrypted with the same key")
+
+    checkpoint = load_checkpoint(checkpoint_path)
+    if checkpoint['last_id']:
+        logger.info(f"Resuming key rotation of {checkpoint['table']} after id {checkpoint['last_id']}")
+
+    conn = db.get_connection()
+    started = time.monotonic()
+    rotated_now = 0
+    tables = [spec[0] for spec in ENCRYPTED_TABLES]
+    for table in tables[tables.index(checkpoint['table']):]:
+        if checkpoint['table'] != table:
+            checkpoint.update(table=table, last_id=0)
+        while True:
+            last_id, count = rotate_chunk(conn, checkpoint['last_id'], chunk_size, table)
+            if last_id is None:
+                break
+            checkpoint['last_id'] = last_id
+            checkpoint['rotated'] += count
+            save_checkpoint(checkpoint_path, checkpoint)
+            rotated_now += count
+
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"Rotated {checkpoint['rotated']} rows ({table}, last id {last_id}), "
+                f"{rotated_now / elapsed if elapsed else 0:.0f} rows/s"
+            )
+            # Пауза между порциями, чтобы бот успевал получать блокировки БД
+            time.sleep(pause)
+
+    if os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    logger.info(f"Key rotation finished: {checkpoint['rotated']} rows in {time.monotonic() - started:.1f} s")
+    return checkpoint['rotated']
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Перешифровка данных в БД новым ключом")
+    parser.add_argument("--chunk-size", type=int, default=500, help="строк в одной транзакции")
+    parser.add_argument("--pause", type=float, default=0.05, help="пауза между порциями, секунды")
+    parser.add_argument("--checkpoint", default=DEFAULT_CHECKPOINT, help="файл контрольной точки")
+    parser.add_argument("--restart", action="store_true", help="начать заново, игнорируя контрольную точку")
+    args = parser.parse_args()
+    setup_logging()
+
+    if args.restart and os.path.exists(args.checkpoint):
+        os.remove(args.checkpoint)
+
+    db.init_db()
+    rotate(chunk_size=args.chunk_size, pause=args.pause, checkpoint_path=args.checkpoint)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# token_budget.py
+"""
+Локальный подсчёт токенов и ограничение размера промптов.
+
+Если словарь tiktoken загружен, токены считаются точно; иначе используется
+оценка по числу символов (кириллица занимает больше токенов, чем латиница).
+Словарь читается только из локального кэша TIKTOKEN_CACHE_DIR и в фоновом
+потоке: без кэша tiktoken скачивает его без таймаута, и запуск бота мог
+зависнуть на сервере без доступа в интернет.
+Слишком длинные свободные поля профиля обрезаются, а слишком длинные
+вопросы и списки ингредиентов отклоняются до обращения к API.
+"""
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+QUESTION_MAX_TOKENS = int(os.getenv("QUESTION_MAX_TOKENS", "800"))
+INGREDIENTS_MAX_TOKENS = int(os.getenv("INGREDIENTS_MAX_TOKENS", "300"))
+PROFILE_FIELD_MAX_TOKENS = int(os.getenv("PROFILE_FIELD_MAX_TOKENS", "150"))
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "2000"))
+TIKTOKEN_ENCODING = os.getenv("TIKTOKEN_ENCODING", "o200k_base")
+TIKTOKEN_CACHE_DIR = os.getenv("TIKTOKEN_CACHE_DIR")
+
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+_stats_lock = threading.Lock()
+_stats = {}  # пресет -> {'calls': ..., 'tokens': ..., 'max_tokens': ...}
+
+
+class PromptTooLong(ValueError):
+    """Входные данные не помещаются в бюджет токенов"""
+
+
+def load_encoding():
+    """Загружает словарь tiktoken один раз; без TIKTOKEN_CACHE_DIR или при ошибке остаётся оценка"""
+    global _encoding, _encoding_loaded
+    with _encoding_lock:
+        if not _encoding_loaded:
+            if not TIKTOKEN_CACHE_DIR:
+                logger.info("TIKTOKEN_CACHE_DIR не задан, используется оценка числа токенов")
+            else:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding(TIKTOKEN_ENCODING)
+                except Exception as e:
+                    logger.warning(f"tiktoken недоступен, используется оценка числа токенов: {e}")
+            _encoding_loaded = True
+    return _encoding
+
+
+def start_loading() -> None:
+    """Загружает словарь в фоновом потоке; до его готовности используется оценка"""
+    threading.Thread(target=load_encoding, name="tiktoken-load", daemon=True).start()
+
+
+def _estimate(text: str) -> int:
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return int((len(text) - ascii_chars) / 2.5 + ascii_chars / 4) + 1
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding
+    if encoding is not None:
+        return len(encoding.encode(text))
+    return _estimate(text)
+
+
+def trim(text: str, max_tokens: int) -> str:
+    """Обрезает текст до max_tokens токенов"""
+    if not text or count_tokens(text) <= max_tokens:
+        return text
+    encoding = _encoding
+    if encoding is not None:
+        trimmed = encoding.decode(encoding.encode(text)[:max_tokens])
+    else:
+        trimmed = text[:int(len(text) * max_tokens / _estimate(text))]
+    logger.info(f"Текст обрезан до {max_tokens} токенов")
+    return trimmed.rstrip() + "…"
+
+
+def ensure_fits(text: str, max_tokens: int) -> int:
+    """Возвращает число токенов или бросает PromptTooLong"""
+    tokens = count_tokens(text)
+    if tokens > max_tokens:
+        raise PromptTooLong(f"{tokens} tokens > {max_tokens}")
+    return tokens
+
+
+def record(preset: str, tokens: int) -> None:
+    """Учитывает размер промпта отдельного вызова"""
+    with _stats_lock:
+        stats = _stats.setdefault(preset, {'calls': 0, 'tokens': 0, 'max_tokens': 0})
+        stats['calls'] += 1
+        stats['tokens'] += tokens
+        stats['max_tokens'] = max(stats['max_tokens'], tokens)
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        return {preset: dict(stats) for preset, stats in _stats.items()}
@@ -0,0 +1,22 @@
+# conftest.py
+"""
+Общая настройка тестов: модули бота лежат в src и читают окружение при
+импорте, поэтому база, журнал и ключ шифрования подставляются заранее.
+"""
+import os
+import sys
+import tempfile
+
+from cryptography.fernet import Fernet
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+if SRC_DIR not in sys.path:
+    sys.path.insert(0, SRC_DIR)
+
+_workdir = tempfile.mkdtemp(prefix="nutribot-tests-")
+os.environ.setdefault("ENCRYPTION_KEY", Fernet.generate_key().decode())
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ["DB_PATH"] = os.path.join(_workdir, "users.db")
+os.environ["LOG_FILE"] = os.path.join(_workdir, "bot.log")
+os.environ["IMAGE_DIR"] = os.path.join(_workdir, "images")
+os.environ["LLM_WARMUP"] = "0"
@@ -0,0 +1,35 @@
+import pytest
+
+from answer_cache import AnswerCache
+
+
+@pytest.fixture
+def cache():
+    return AnswerCache(max_entries=100)
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Сколько калорий в 100 г гречки?", "Сколько калорий в 300 г гречки?"),
+    ("Сколько белка нужно в 25 лет?", "Сколько белка нужно в 60 лет?"),
+    ("Сколько воды пить при весе 50 кг?", "Сколько воды пить при весе 120 кг?"),
+    ("Можно ли на диете есть клубнику?", "Можно ли на диете есть клубнику и мед?"),
+])
+def test_questions_with_different_numbers_or_items_are_misses(cache, cached, asked):
+    cache.put(cached, "ответ")
+    assert cache.get(asked) is None
+
+
+@pytest.mark.parametrize("cached, asked", [
+    ("Сколько воды нужно пить в день?", "сколько воды нужно пить в день"),
+    ("Сколько воды нужно пить в день?", "Сколько нужно пить воды в день?"),
+    ("Что съесть перед тренировкой?", "Что съесть перед тренировками?"),
+])
+def test_rephrased_questions_are_hits(cache, cached, asked):
+    cache.put(cached, "ответ")
+    assert cache.get(asked) == "ответ"
+
+
+def test_similar_hit_picks_question_with_same_numbers(cache):
+    cache.put("Сколько калорий в 100 г гречки?", "про 100 г")
+    cache.put("Сколько калорий в 300 г гречки?", "про 300 г")
+    assert cache.get("Сколько калорий в гречке 300 г?") == "про 300 г"
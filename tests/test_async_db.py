@@ -0,0 +1,71 @@
+import time
+import asyncio
+
+import async_db
+import bot
+import main
+from load_test import FakeTelegramRequest, TrackingApplication, UpdateFactory
+
+SLOW_DB_SECONDS = 1.0
+
+
+async def _max_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    lag = 0.0
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(lag, time.perf_counter() - started - interval)
+    return lag
+
+
+def test_slow_db_call_does_not_block_event_loop():
+    async def scenario():
+        stop = asyncio.Event()
+        monitor = asyncio.create_task(_max_loop_lag(stop))
+        await async_db.run(time.sleep, 0.5)
+        stop.set()
+        return await monitor
+
+    assert asyncio.run(scenario()) < 0.1
+
+
+def test_slow_db_call_does_not_delay_unrelated_update(monkeypatch):
+    async def registered(user_id):
+        return True
+
+    async def slow_user_data(user_id):
+        # Медленный запрос к БД в пуле потоков, как в async_db
+        await async_db.run(time.sleep, SLOW_DB_SECONDS)
+        return {"goal": "Похудение"}
+
+    async def plan(user_data, regenerate=False):
+        return "План питания"
+
+    monkeypatch.setattr(bot, "is_user_registered", registered)
+    monkeypatch.setattr(bot, "get_user_data", slow_user_data)
+    monkeypatch.setattr(bot, "generate_nutrition_plan", plan)
+
+    async def scenario():
+        request = FakeTelegramRequest()
+        app = main.build_application("123456:TEST", request=request, application_class=TrackingApplication)
+        await app.initialize()
+        await app.start()
+        factory = UpdateFactory(app.bot)
+        try:
+            slow = factory.message(1, "/nutrition")
+            started = time.perf_counter()
+            await app.process_update(slow)
+            # Другой пользователь получает ответ, пока план первого ещё готовится
+            await app.process_update(factory.message(2, "/help"))
+            unrelated = time.perf_counter() - started
+            await app.wait_spawned(slow)
+            total = time.perf_counter() - started
+        finally:
+            await app.stop()
+            await app.shutdown()
+        return unrelated, total, request.calls
+
+    unrelated, total, calls = asyncio.run(scenario())
+    assert unrelated < 0.3
+    assert total >= SLOW_DB_SECONDS
+    assert calls["sendMessage"] == 2
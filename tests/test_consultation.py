@@ -0,0 +1,107 @@
+import time
+import asyncio
+
+import pytest
+from telegram.error import BadRequest, RetryAfter
+
+import bot
+
+
+class FakeMessage:
+    """Сообщение Telegram: reply_text возвращает новое сообщение, edit_text может падать"""
+
+    def __init__(self, edit_error=None):
+        self.edit_error = edit_error
+        self.replies = []
+        self.edits = []
+        self.first_reply_at = None
+
+    async def reply_text(self, text, **kwargs):
+        if self.first_reply_at is None:
+            self.first_reply_at = time.perf_counter()
+        self.replies.append(text)
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        if self.edit_error is not None:
+            raise self.edit_error
+        self.edits.append(text)
+
+
+@pytest.fixture
+def consult(monkeypatch):
+    calls = {"generate": 0}
+
+    async def get_consultation(question, user_data=None):
+        calls["generate"] += 1
+        return "Ответ целиком"
+
+    monkeypatch.setattr(bot, "CONSULT_STREAMING", True)
+    monkeypatch.setattr(bot, "CONSULT_EDIT_INTERVAL", 0)
+    monkeypatch.setattr(bot, "get_consultation", get_consultation)
+    return calls
+
+
+def _stream(chunks, error=None, delay=0.0):
+    async def stream_consultation(question, user_data=None):
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk
+        if error is not None:
+            raise error
+    return stream_consultation
+
+
+@pytest.mark.parametrize("edit_error", [
+    BadRequest("Message is not modified"),
+    BadRequest("Message to edit not found"),
+    RetryAfter(0),
+])
+def test_telegram_errors_do_not_regenerate_answer(monkeypatch, consult, edit_error):
+    monkeypatch.setattr(bot, "stream_consultation", _stream(["Пейте ", "воду", " регулярно"]))
+    message = FakeMessage(edit_error=edit_error)
+
+    asyncio.run(bot.send_consultation(message, "Сколько пить воды?"))
+
+    assert consult["generate"] == 0
+    assert message.replies[0] == "Пейте "
+    if "not modified" not in str(edit_error):
+        # Правка не удалась — полученный текст приходит отдельным сообщением
+        assert message.replies[-1] == "Пейте воду регулярно"
+
+
+def test_stream_failure_after_first_message_keeps_streamed_text(monkeypatch, consult):
+    monkeypatch.setattr(bot, "stream_consultation", _stream(["Пейте ", "воду"], RuntimeError("обрыв")))
+    message = FakeMessage()
+
+    asyncio.run(bot.send_consultation(message, "Сколько пить воды?"))
+
+    assert consult["generate"] == 0
+    assert len(message.replies) == 1
+    assert message.edits[-1].startswith("Пейте воду")
+
+
+def test_stream_failure_before_any_text_regenerates_once(monkeypatch, consult):
+    monkeypatch.setattr(bot, "stream_consultation", _stream([], RuntimeError("обрыв")))
+    message = FakeMessage()
+
+    asyncio.run(bot.send_consultation(message, "Сколько пить воды?"))
+
+    assert consult["generate"] == 1
+    assert message.replies == ["Ответ целиком"]
+
+
+def test_first_text_arrives_before_generation_finishes(monkeypatch, consult):
+    # Фейковая модель: 20 кусков по 50 мс, весь ответ генерируется за 1 с
+    chunks = [f"слово{i} " for i in range(20)]
+    monkeypatch.setattr(bot, "stream_consultation", _stream(chunks, delay=0.05))
+    message = FakeMessage()
+
+    started = time.perf_counter()
+    asyncio.run(bot.send_consultation(message, "Сколько пить воды?"))
+    finished = time.perf_counter()
+
+    first_text = message.first_reply_at - started
+    assert first_text < 0.3
+    assert finished - started >= 1.0
+    assert message.edits[-1].startswith("".join(chunks).strip())
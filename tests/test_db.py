@@ -0,0 +1,50 @@
+import db
+
+
+def setup_module():
+    db.init_db()
+
+
+def test_update_user_fields_does_not_create_unknown_user():
+    assert not db.update_user_fields(999001, goal="Похудение")
+    assert not db.update_user_fields(999001, weight="70")
+    assert not db.is_user_registered(999001)
+
+
+def test_update_user_fields_updates_existing_user():
+    assert db.add_user(999002, "Анна", "30", "70", "170", "3️⃣ Средний", "Похудение", "нет", "нет")
+    version = db.get_user_data(999002)["profile_version"]
+
+    assert db.update_user_fields(999002, goal="Набор массы", weight="72")
+    user = db.get_user_data(999002)
+    assert user["goal"] == "Набор массы"
+    assert user["weight"] == "72"
+    assert user["height"] == "170"
+    assert user["profile_version"] == version + 1
+
+
+def test_legacy_profile_reads_and_migrates_to_single_token():
+    fields = {'age': "41", 'weight': "80", 'height': "182", 'activity': "2️⃣ Низкий",
+              'diseases': "гастрит", 'allergies': "орехи"}
+    conn = db.get_connection()
+    with conn:
+        conn.execute(
+            "INSERT INTO users (telegram_id, name, goal, age, weight, height, activity, diseases, allergies)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (999003, "Пётр", "Похудение", *(db.encrypt_data(fields[key]) for key in db.SENSITIVE_FIELDS))
+        )
+    db.profile_cache.invalidate(999003)
+    before = db.get_user_data(999003)
+    assert {key: before[key] for key in fields} == fields
+
+    after_id = 0
+    while after_id is not None:
+        after_id, _ = db.migrate_profiles_chunk(after_id, chunk_size=3)
+
+    row = conn.execute(
+        "SELECT format_version, age, allergies, profile FROM users WHERE telegram_id=?", (999003,)
+    ).fetchone()
+    assert row[:3] == (db.PROFILE_FORMAT_BLOB, None, None)
+    assert db.decrypt_profile(row[3]) == fields
+    db.profile_cache.invalidate(999003)
+    assert db.get_user_data(999003) == before
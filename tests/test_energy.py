@@ -0,0 +1,82 @@
+import math
+
+import pytest
+
+import energy
+from nutrition_agent import build_plan_inputs, build_plan_inputs_batch
+
+PROFILES = [
+    {"weight": "70", "height": "170", "age": "30", "gender": "male",
+     "activity": "3️⃣ Средний (3-4 тренировки в неделю)", "goal": "похудение"},
+    {"weight": "55.5", "height": "160", "age": "45", "gender": "female",
+     "activity": "1️⃣ Минимальный", "goal": "набор массы"},
+    {"weight": "120", "height": "190", "age": "22", "activity": "5️⃣ Очень высокий",
+     "goal": "поддержание здоровья"},
+    # Пустые поля
+    {},
+    {"weight": None, "height": "", "age": None, "activity": None, "goal": None},
+    # Некорректные значения
+    {"weight": "abc", "height": "-5", "age": "тридцать", "gender": "other",
+     "activity": "9", "goal": "стать космонавтом"},
+    {"weight": "nan", "height": "inf", "age": "0", "activity": 7},
+    {"weight": "72,5", "height": "181", "age": "33.9"},
+    # Маленький вес и высокий возраст — срабатывает нижняя граница калорий
+    {"weight": "40", "height": "150", "age": "90", "gender": "female", "goal": "похудение"},
+]
+
+
+def scalar_targets(values: dict) -> dict:
+    """Эталонный расчёт для одного профиля обычной арифметикой"""
+    goal = energy.GOALS[values["goal"]]
+    bmr = energy.mifflin_st_jeor(values["weight"], values["height"], values["age"], values["gender"])
+    tdee = bmr * energy.ACTIVITY_FACTORS[values["activity"]]
+    calories = max(tdee * (1 + goal["adjustment"]), energy.MIN_CALORIES)
+    protein_g = values["weight"] * goal["protein_per_kg"]
+    fat_g = calories * energy.FAT_SHARE / energy.KCAL_PER_G_FAT
+    carbs_kcal = calories - protein_g * energy.KCAL_PER_G_PROTEIN - fat_g * energy.KCAL_PER_G_FAT
+    return {
+        "bmr": bmr,
+        "tdee": tdee,
+        "calories": calories,
+        "protein_g": protein_g,
+        "fat_g": fat_g,
+        "carbs_g": max(carbs_kcal, 0) / energy.KCAL_PER_G_CARBS
+    }
+
+
+def test_batch_matches_scalar():
+    batch = energy.compute_targets_batch(**energy.profiles_to_arrays(PROFILES))
+    for i, profile in enumerate(PROFILES):
+        expected = scalar_targets(energy.profile_values(profile))
+        for key, value in expected.items():
+            assert batch[key][i] == pytest.approx(value), (profile, key)
+
+
+def test_missing_and_invalid_fields_use_defaults():
+    for profile in PROFILES[3:7]:
+        values = energy.profile_values(profile)
+        assert values["weight"] == energy.DEFAULT_WEIGHT
+        assert values["height"] == energy.DEFAULT_HEIGHT
+        assert values["age"] == energy.DEFAULT_AGE
+        assert values["activity"] == energy.DEFAULT_ACTIVITY_LEVEL
+        assert values["goal"] == energy.DEFAULT_GOAL
+    values = energy.profile_values(PROFILES[7])
+    assert (values["weight"], values["age"]) == (72.5, 33)
+
+
+def test_rounded_batch_matches_compute_targets():
+    rounded = energy.round_targets(energy.compute_targets_batch(**energy.profiles_to_arrays(PROFILES)))
+    for profile, targets in zip(PROFILES, rounded):
+        values = energy.profile_values(profile)
+        assert targets == energy.compute_targets(
+            values["weight"], values["height"], values["age"],
+            values["activity"], values["goal"], values["gender"]
+        )
+    assert all(targets["calories"] >= energy.MIN_CALORIES for targets in rounded)
+    assert rounded[-1]["calories"] == math.ceil(energy.MIN_CALORIES)
+
+
+def test_plan_inputs_batch_matches_single_profile():
+    profiles = [dict(p, allergies="нет", diseases="нет") for p in PROFILES]
+    assert build_plan_inputs_batch(profiles) == [build_plan_inputs(p) for p in profiles]
+    assert build_plan_inputs_batch([]) == []
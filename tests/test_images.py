@@ -0,0 +1,52 @@
+import os
+import asyncio
+import hashlib
+from types import SimpleNamespace
+
+import bot
+import image_cache
+import image_store
+
+
+def test_finalize_image_names_file_by_content_hash(monkeypatch, tmp_path):
+    # Без пережатия файл сохраняется как есть
+    monkeypatch.setattr(image_cache, "IMAGE_FORMAT", "png")
+    monkeypatch.setattr(image_cache, "IMAGE_HASH_CHUNK", 7)
+    data = os.urandom(1000)
+    expected = hashlib.sha256(data).hexdigest()
+
+    tmp_file = tmp_path / ".download.part"
+    tmp_file.write_bytes(data)
+    assert image_cache.finalize_image(str(tmp_file), str(tmp_path)) == str(tmp_path / f"{expected}.png")
+
+    # Хэш, посчитанный при скачивании, используется без повторного чтения
+    tmp_file.write_bytes(data)
+    path = image_cache.finalize_image(str(tmp_file), str(tmp_path), digest="0" * 64)
+    assert path == str(tmp_path / f"{'0' * 64}.png")
+
+
+def test_uploaded_photo_evicted_during_send_is_counted(monkeypatch, tmp_path):
+    uploads = []
+    monkeypatch.setattr(image_store, "record_upload", uploads.append)
+    photo_path = tmp_path / "dish.jpg"
+    photo_path.write_bytes(b"x" * 2048)
+
+    class Message:
+        async def reply_photo(self, photo, **kwargs):
+            # Пока фото отправляется, вытеснение LRU удаляет файл
+            os.remove(photo_path)
+            return SimpleNamespace(photo=[])
+
+    image = {'file_id': None, 'path': str(photo_path)}
+    assert asyncio.run(bot.send_recipe_photo(Message(), "Омлет", image, "🍽️ Омлет"))
+    assert uploads == [2048]
+
+    # Файла уже нет — отправка не удаётся, но без исключения
+    assert not asyncio.run(bot.send_recipe_photo(Message(), "Омлет", image, "🍽️ Омлет"))
+
+
+def test_missing_pillow_is_reported(monkeypatch, caplog):
+    assert image_cache.check_reencoding()
+    monkeypatch.setattr(image_cache, "Image", None)
+    assert not image_cache.check_reencoding()
+    assert "Pillow" in caplog.text
@@ -0,0 +1,34 @@
+import asyncio
+
+import db
+import async_db
+
+
+def setup_module():
+    db.init_db()
+    conn = db.get_connection()
+    with conn:
+        conn.executemany("INSERT OR IGNORE INTO users (telegram_id, name) VALUES (?, ?)",
+                         [(888000 + i, "Пользователь") for i in range(50)])
+        # Дыры в первичном ключе не должны сбивать пагинацию
+        conn.execute("DELETE FROM users WHERE telegram_id IN (888003, 888020, 888021)")
+
+
+def _all_ids() -> list:
+    return [row[0] for row in db.get_connection().execute("SELECT telegram_id FROM users ORDER BY id")]
+
+
+def test_keyset_pagination_yields_every_id_once():
+    expected = _all_ids()
+    # Размер порции меньше, равен и больше числа пользователей, в том числе делитель
+    for chunk_size in (1, 7, 10, len(expected), len(expected) + 5):
+        assert list(db.iter_user_ids(chunk_size)) == expected
+
+
+def test_async_iteration_matches_sync():
+    async def collect(chunk_size: int) -> list:
+        return [telegram_id async for telegram_id in async_db.iter_user_ids(chunk_size)]
+
+    expected = _all_ids()
+    for chunk_size in (1, 7, len(expected)):
+        assert asyncio.run(collect(chunk_size)) == expected
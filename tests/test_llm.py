@@ -0,0 +1,174 @@
+import time
+import asyncio
+
+import httpx
+from langchain_core.output_parsers import StrOutputParser
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.runnables import RunnableLambda
+
+import llm
+from load_test import FakeOpenAIServer
+
+LLM_LATENCY = 0.5
+
+
+def _fresh_limiter(monkeypatch, total: int, per_model: int) -> None:
+    # Семафоры привязываются к циклу событий, поэтому у каждого теста свои
+    monkeypatch.setattr(llm, "_global_semaphore", asyncio.Semaphore(total))
+    monkeypatch.setattr(llm, "_model_semaphores", {})
+    monkeypatch.setattr(llm, "LLM_MAX_CONCURRENCY_PER_MODEL", per_model)
+
+
+async def _slow_llm(inputs: dict) -> str:
+    await asyncio.sleep(LLM_LATENCY)
+    return f"Ответ на {inputs['question']}"
+
+
+def test_concurrent_users_are_served_in_parallel(monkeypatch):
+    _fresh_limiter(monkeypatch, total=64, per_model=64)
+    chain = RunnableLambda(_slow_llm)
+
+    async def scenario():
+        started = time.perf_counter()
+        answers = await asyncio.gather(*(
+            llm.ainvoke(chain, {"question": f"вопрос {user}"}, "consult") for user in range(50)
+        ))
+        return answers, time.perf_counter() - started
+
+    answers, elapsed = asyncio.run(scenario())
+    assert len(set(answers)) == 50
+    # Последовательно это заняло бы 50 * LLM_LATENCY = 25 с
+    assert elapsed < LLM_LATENCY * 3
+
+
+def test_concurrency_is_capped_per_model(monkeypatch):
+    _fresh_limiter(monkeypatch, total=64, per_model=10)
+    chain = RunnableLambda(_slow_llm)
+
+    async def scenario():
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            llm.ainvoke(chain, {"question": f"вопрос {user}"}, "consult") for user in range(30)
+        ))
+        return time.perf_counter() - started
+
+    # 30 запросов по 10 одновременно — три волны
+    assert LLM_LATENCY * 3 <= asyncio.run(scenario()) < LLM_LATENCY * 5
+
+
+def test_saturated_model_does_not_hold_global_slots(monkeypatch):
+    _fresh_limiter(monkeypatch, total=4, per_model=2)
+
+    async def busy(model: str) -> None:
+        async with llm.limit(model):
+            await asyncio.sleep(LLM_LATENCY)
+
+    async def scenario():
+        # Очередь к gpt-4o больше его лимита; общих слотов хватает ещё на два запроса
+        backlog = [asyncio.create_task(busy("gpt-4o")) for _ in range(6)]
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        async with llm.limit("gpt-3.5-turbo"):
+            waited = time.perf_counter() - started
+        await asyncio.gather(*backlog)
+        return waited
+
+    assert asyncio.run(scenario()) < 0.1
+
+
+def test_single_flight_error_reaches_every_waiter():
+    flight = llm.SingleFlight()
+    calls = []
+
+    async def failing():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        raise RuntimeError("API недоступен")
+
+    async def scenario():
+        return await asyncio.gather(*(flight.do("k", failing) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(scenario())
+    assert len(calls) == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_single_flight_cancelled_waiter_does_not_cancel_others():
+    flight = llm.SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ответ"
+
+    async def scenario():
+        first = asyncio.create_task(flight.do("k", slow))
+        second = asyncio.create_task(flight.do("k", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    first, second = asyncio.run(scenario())
+    assert isinstance(first, asyncio.CancelledError)
+    assert second == "ответ"
+
+
+def test_single_flight_new_caller_after_last_waiter_cancelled():
+    flight = llm.SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ответ"
+
+    async def scenario():
+        waiter = asyncio.create_task(flight.do("k", slow))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        # Новый запрос выполняется в том же такте, что и отмена: вызов уже
+        # отменён, но его done-колбэк ещё не выполнен
+        fresh = asyncio.create_task(flight.do("k", slow))
+        await asyncio.gather(waiter, return_exceptions=True)
+        return await fresh
+
+    assert asyncio.run(scenario()) == "ответ"
+    assert flight.stats()['calls'] == 2
+
+
+def test_single_flight_coalescing_ratio():
+    flight = llm.SingleFlight()
+
+    async def slow():
+        await asyncio.sleep(0.05)
+        return "ответ"
+
+    async def scenario():
+        await asyncio.gather(*(flight.do("a", slow) for _ in range(3)), flight.do("b", slow))
+
+    asyncio.run(scenario())
+    stats = flight.stats()
+    assert (stats['calls'], stats['coalesced'], stats['in_flight']) == (2, 2, 0)
+    assert stats['coalescing_ratio'] == 0.5
+
+
+def test_sequential_requests_reuse_one_connection(monkeypatch):
+    server = FakeOpenAIServer(latency=0.01, jitter=0.0, image_variants=1, image_size=8)
+    monkeypatch.setattr(llm, "OPENAI_BASE_URL", server.start())
+    monkeypatch.setattr(llm, "_models", {})
+    _fresh_limiter(monkeypatch, total=4, per_model=4)
+    prompt = ChatPromptTemplate.from_messages([("user", "{question}")])
+
+    async def scenario():
+        # Пул клиента привязывается к циклу событий, поэтому у теста свой
+        monkeypatch.setattr(llm, "http_async_client", httpx.AsyncClient(limits=llm._limits, timeout=llm._timeout))
+        chain = prompt | llm.get_model("consult") | StrOutputParser()
+        try:
+            return [await llm.ainvoke(chain, {"question": f"вопрос {i}"}, "consult") for i in range(10)]
+        finally:
+            await llm.http_async_client.aclose()
+
+    try:
+        answers = asyncio.run(scenario())
+    finally:
+        server.stop()
+    assert len(answers) == 10
+    assert server.requests["/v1/chat/completions"] == 10
+    assert server.connections == 1
@@ -0,0 +1,23 @@
+import logging
+
+from logging_setup import SamplingFilter, _parse_levels
+
+
+def _record(level: int) -> logging.LogRecord:
+    return logging.LogRecord("bench", level, __file__, 1, "сообщение", None, None)
+
+
+def test_log_levels_parsing():
+    assert _parse_levels("db=debug, httpx = WARNING") == {"db": "DEBUG", "httpx": "WARNING"}
+    assert _parse_levels("") == {}
+    # Без "=", без имени, без уровня и с неизвестным уровнем — пропускаются
+    assert _parse_levels("db,=INFO,llm=,bot=LOUD,telegram.ext=error") == {"telegram.ext": "ERROR"}
+
+
+def test_sampling_filter_passes_every_nth_debug_record():
+    sampling = SamplingFilter(3)
+    passed = [sampling.filter(_record(logging.DEBUG)) for _ in range(7)]
+    assert passed == [True, False, False, True, False, False, True]
+    # Остальные уровни не прореживаются
+    assert all(sampling.filter(_record(logging.INFO)) for _ in range(5))
+    assert all(SamplingFilter(0).filter(_record(logging.DEBUG)) for _ in range(3))
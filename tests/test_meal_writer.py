@@ -0,0 +1,84 @@
+import time
+import asyncio
+
+import pytest
+
+import db
+from meal_writer import MealWriter
+
+
+def setup_module():
+    db.init_db()
+    # Строку с таким текстом база отклоняет, как при нарушении ограничения
+    db.get_connection().execute('''
+        CREATE TEMP TRIGGER IF NOT EXISTS reject_meal BEFORE INSERT ON meals
+        WHEN NEW.meal = 'отклонить' BEGIN SELECT RAISE(ABORT, 'rejected'); END
+    ''')
+
+
+async def _flush(rows: list) -> list:
+    # Соединение теста с временным триггером, поэтому без пула потоков
+    return db.add_meals_batch(rows)
+
+
+def _meal_count(telegram_id: int) -> int:
+    return db.get_connection().execute("SELECT COUNT(*) FROM meals WHERE user_id=?", (telegram_id,)).fetchone()[0]
+
+
+def test_each_row_gets_its_own_result():
+    async def scenario():
+        writer = MealWriter(_flush, max_batch=100, flush_interval=0.01)
+        futures = [writer.submit(777001, meal) for meal in ("Каша", "отклонить", "Суп", "Салат")]
+        results = await asyncio.gather(*futures)
+        await writer.close()
+        return writer, results
+
+    writer, results = asyncio.run(scenario())
+    # Ошибка одной строки не откатывает остальные
+    assert results == [True, False, True, True]
+    assert writer.batches_written == 1 and writer.rows_written == 3
+    assert _meal_count(777001) == 3
+
+
+def test_full_batch_is_written_without_waiting():
+    async def scenario():
+        writer = MealWriter(_flush, max_batch=10, flush_interval=10)
+        started = time.perf_counter()
+        await asyncio.gather(*(writer.submit(777002, f"Перекус {i}") for i in range(10)))
+        elapsed = time.perf_counter() - started
+        await writer.close()
+        return elapsed
+
+    assert asyncio.run(scenario()) < 1
+    assert _meal_count(777002) == 10
+
+
+def test_close_flushes_pending_rows():
+    async def scenario():
+        writer = MealWriter(_flush, max_batch=100, flush_interval=10)
+        futures = [writer.submit(777003, f"Ужин {i}") for i in range(3)]
+        await asyncio.sleep(0)
+        started = time.perf_counter()
+        await writer.close()
+        with pytest.raises(RuntimeError):
+            writer.submit(777003, "После закрытия")
+        return [future.result() for future in futures], time.perf_counter() - started
+
+    results, elapsed = asyncio.run(scenario())
+    assert results == [True, True, True]
+    assert elapsed < 1
+    assert _meal_count(777003) == 3
+
+
+def test_failed_flush_reaches_every_future():
+    async def failing(rows):
+        raise OSError("disk I/O error")
+
+    async def scenario():
+        writer = MealWriter(failing, max_batch=100, flush_interval=0.01)
+        futures = [writer.submit(777004, "Обед"), writer.submit(777004, "Полдник")]
+        results = await asyncio.gather(*futures, return_exceptions=True)
+        await writer.close()
+        return results
+
+    assert all(isinstance(result, OSError) for result in asyncio.run(scenario()))
@@ -0,0 +1,38 @@
+import os
+import shutil
+import sqlite3
+
+import db
+
+SHIPPED_DB = os.path.join(db.DB_DIR, "users.db")
+
+
+def _columns(conn, table: str) -> set:
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def test_shipped_database_upgrades_to_latest_version(tmp_path):
+    path = tmp_path / "users.db"
+    shutil.copy(SHIPPED_DB, path)
+    conn = sqlite3.connect(path)
+    assert db.get_schema_version(conn) == 0
+    # Строки старой версии бота: telegram_id мог сохраниться строкой
+    with conn:
+        conn.execute("INSERT INTO users (telegram_id, name, age) VALUES ('4242', 'Иван', 'токен')")
+        conn.execute("INSERT INTO meals (user_id, meal) VALUES ('4242', 'Каша')")
+
+    assert db.run_migrations(conn) == len(db.MIGRATIONS) == 9
+    assert db.get_schema_version(conn) == 9
+    assert {"profile", "format_version", "profile_version"} <= _columns(conn, "users")
+    tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+    assert {"nutrition_plans", "job_state", "recipe_images", "recipes", "recipe_tokens"} <= tables
+
+    row = conn.execute("SELECT typeof(telegram_id), format_version, profile_version FROM users").fetchone()
+    assert row == ("integer", db.PROFILE_FORMAT_LEGACY, 1)
+    plan = " ".join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN " + db.SQL_SELECT_MEALS, (4242, 10)))
+    assert "COVERING INDEX idx_meals_user_timestamp" in plan
+    assert conn.execute(db.SQL_SELECT_MEALS, (4242, 10)).fetchall()[0][0] == "Каша"
+
+    # Повторный запуск ничего не делает
+    assert db.run_migrations(conn) == 9
+    conn.close()
@@ -0,0 +1,43 @@
+from cryptography.fernet import Fernet, MultiFernet
+
+import db
+import plan_cache
+import rotate_key
+
+
+def setup_module():
+    db.init_db()
+
+
+def _new_key() -> Fernet:
+    return Fernet(Fernet.generate_key())
+
+
+def test_undecryptable_plan_is_a_miss_and_removed(monkeypatch):
+    key = plan_cache.make_key({"goal": "похудение", "weight": 70})
+    plan_cache.put_plan(key, "План на день")
+    assert plan_cache.get_plan(key) == "План на день"
+
+    # Старого ключа больше нет: запись не читается
+    monkeypatch.setattr(db, "cipher", MultiFernet([_new_key()]))
+    assert plan_cache.get_plan(key) is None
+    assert plan_cache.renew_keys([key]) == set()
+
+
+def test_key_rotation_reencrypts_cached_plans(monkeypatch, tmp_path):
+    old_key, new_key = _new_key(), _new_key()
+    monkeypatch.setattr(db, "cipher", MultiFernet([old_key]))
+    # Строки других тестов зашифрованы ключом из окружения — убираем их
+    conn = db.get_connection()
+    with conn:
+        conn.execute("DELETE FROM users")
+        conn.execute("DELETE FROM nutrition_plans")
+    key = plan_cache.make_key({"goal": "набор массы", "weight": 80})
+    plan_cache.put_plan(key, "План для набора массы")
+
+    monkeypatch.setattr(db, "cipher", MultiFernet([new_key, old_key]))
+    monkeypatch.setattr(db, "ENCRYPTION_OLD_KEYS", ["old"])
+    assert rotate_key.rotate(pause=0, checkpoint_path=str(tmp_path / "rotation.json")) == 1
+
+    monkeypatch.setattr(db, "cipher", MultiFernet([new_key]))
+    assert plan_cache.get_plan(key) == "План для набора массы"
@@ -0,0 +1,78 @@
+import time
+import asyncio
+
+from langchain_core.runnables import RunnableLambda
+
+import db
+import llm
+import plan_cache
+import plan_pregen
+
+
+def setup_module():
+    db.init_db()
+
+
+def test_load_chunk_does_not_fill_profile_cache():
+    assert db.add_user(999101, "Олег", "40", "90", "180", "2️⃣ Низкий", "Похудение", "нет", "нет")
+    db.profile_cache.invalidate(999101)
+
+    _, users = plan_pregen.load_chunk(0, 1000)
+    assert dict(users)[999101]["weight"] == "90"
+    assert db.profile_cache.get(999101) is None
+
+
+def test_generate_batch_goes_through_llm_limiter(monkeypatch):
+    monkeypatch.setattr(llm, "_global_semaphore", asyncio.Semaphore(64))
+    monkeypatch.setattr(llm, "_model_semaphores", {})
+    monkeypatch.setattr(llm, "LLM_MAX_CONCURRENCY_PER_MODEL", 2)
+    monkeypatch.setattr(plan_pregen, "PLAN_PREGEN_CONCURRENCY", 10)
+    state = {'in_flight': 0, 'max_in_flight': 0, 'calls': 0}
+
+    async def fake_llm(inputs: dict) -> str:
+        state['calls'] += 1
+        state['in_flight'] += 1
+        state['max_in_flight'] = max(state['max_in_flight'], state['in_flight'])
+        await asyncio.sleep(0.05)
+        state['in_flight'] -= 1
+        return f"План для {inputs['weight']} кг"
+
+    monkeypatch.setattr(plan_pregen, "get_plan_chain", lambda: RunnableLambda(fake_llm))
+    # Одинаковые входные данные объединяются в один запрос
+    inputs_list = [{"weight": weight} for weight in (60, 70, 80, 90, 100, 60)]
+    plans = asyncio.run(plan_pregen.generate_batch(inputs_list))
+
+    assert plans == [f"План для {inputs['weight']} кг" for inputs in inputs_list]
+    assert state['max_in_flight'] <= llm.LLM_MAX_CONCURRENCY_PER_MODEL
+    assert state['calls'] == 5
+
+
+def test_unchanged_profile_is_not_regenerated_next_night(monkeypatch):
+    monkeypatch.setattr(llm, "_global_semaphore", asyncio.Semaphore(64))
+    monkeypatch.setattr(llm, "_model_semaphores", {})
+    calls = []
+
+    async def fake_llm(inputs: dict) -> str:
+        calls.append(inputs)
+        return "План"
+
+    monkeypatch.setattr(plan_pregen, "get_plan_chain", lambda: RunnableLambda(fake_llm))
+    assert db.add_user(999102, "Вера", "35", "65", "168", "3️⃣ Средний", "Похудение", "нет", "нет")
+    conn = db.get_connection()
+    with conn:
+        conn.execute("DELETE FROM nutrition_plans")
+
+    first = asyncio.run(plan_pregen.pregenerate_plans())
+    assert first['generated'] == len(calls) > 0
+
+    # Следующей ночью планы прошлого запуска почти исчерпали TTL
+    with conn:
+        conn.execute("UPDATE nutrition_plans SET created_at = ?", (time.time() - plan_cache.PLAN_CACHE_TTL + 360,))
+    calls.clear()
+
+    second = asyncio.run(plan_pregen.pregenerate_plans())
+    assert calls == []
+    assert second['generated'] == 0 and second['skipped'] == first['generated']
+    # Срок действия продлён: план по-прежнему отдаётся из кэша
+    oldest = conn.execute("SELECT MIN(created_at) FROM nutrition_plans").fetchone()[0]
+    assert time.time() - oldest < 60
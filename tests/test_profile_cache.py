@@ -0,0 +1,44 @@
+import db
+from profile_cache import ProfileCache
+
+
+def setup_module():
+    db.init_db()
+
+
+def test_put_after_invalidate_with_old_generation_is_dropped():
+    cache = ProfileCache(max_entries=10)
+    generation = cache.generation(1)
+    cache.invalidate(1)
+
+    cache.put(1, {"weight": "70"}, generation)
+    assert cache.get(1) is None
+
+    cache.put(1, {"weight": "72"}, cache.generation(1))
+    assert cache.get(1) == {"weight": "72"}
+
+
+def test_forgotten_generation_still_rejects_stale_put():
+    cache = ProfileCache(max_entries=2)
+    generation = cache.generation(1)
+    for telegram_id in (1, 2, 3):
+        cache.invalidate(telegram_id)
+
+    cache.put(1, {"weight": "70"}, generation)
+    assert cache.get(1) is None
+
+
+def test_update_during_read_does_not_cache_stale_profile(monkeypatch):
+    assert db.add_user(999004, "Ольга", "35", "70", "168", "3️⃣ Средний", "Похудение", "нет", "нет")
+    db.profile_cache.invalidate(999004)
+    row_to_user_data = db._row_to_user_data
+
+    def update_between_select_and_put(result):
+        # Профиль меняется после SELECT, но до того, как прочитанное попадёт в кэш
+        monkeypatch.setattr(db, "_row_to_user_data", row_to_user_data)
+        assert db.update_user_fields(999004, weight="65")
+        return row_to_user_data(result)
+
+    monkeypatch.setattr(db, "_row_to_user_data", update_between_select_and_put)
+    assert db.get_user_data(999004)["weight"] == "70"
+    assert db.get_user_data(999004)["weight"] == "65"
@@ -0,0 +1,90 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import bot
+
+
+class FakeMessage:
+    def __init__(self, text, reply_error=None):
+        self.text = text
+        self.reply_error = reply_error
+        self.replies = []
+
+    async def reply_text(self, text, **kwargs):
+        if self.reply_error is not None:
+            raise self.reply_error
+        self.replies.append(text)
+        return self
+
+
+@pytest.fixture
+def image_state(monkeypatch):
+    state = {"started": False, "cancelled": False}
+
+    async def get_recipe_image(title):
+        state["started"] = True
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    async def is_user_registered(telegram_id):
+        return True
+
+    async def get_user_data(telegram_id):
+        return {"goal": "похудение", "allergies": "нет"}
+
+    monkeypatch.setattr(bot, "get_recipe_image", get_recipe_image)
+    monkeypatch.setattr(bot, "is_user_registered", is_user_registered)
+    monkeypatch.setattr(bot, "get_user_data", get_user_data)
+    return state
+
+
+def _recipe_text(result):
+    async def generate(ingredients, user_data, on_title):
+        on_title("Омлет с сыром")
+        await asyncio.sleep(0)
+        return result
+    return generate
+
+
+def _run(message, image_state) -> tuple:
+    """
+    Выполняет /recipe; возвращает (отменена ли картинка к выходу из обработчика,
+    исключение обработчика или None)
+    """
+    update = SimpleNamespace(message=message, callback_query=None, effective_user=SimpleNamespace(id=1))
+
+    async def scenario():
+        error = None
+        try:
+            await bot.recipe_handler(update, None)
+        except Exception as e:
+            error = e
+        # asyncio.run отменит оставшиеся задачи сам, поэтому смотрим до выхода
+        return image_state["cancelled"], error
+
+    return asyncio.run(scenario())
+
+
+def test_image_is_cancelled_when_recipe_fails(monkeypatch, image_state):
+    monkeypatch.setattr(bot, "_generate_recipe_text", _recipe_text("Ошибка генерации рецепта"))
+    monkeypatch.setattr(bot, "is_recipe_error", lambda text: True)
+    message = FakeMessage("яйца, сыр")
+
+    cancelled, error = _run(message, image_state)
+    assert image_state["started"] and cancelled
+    assert error is None
+    assert message.replies == ["Ошибка генерации рецепта"]
+
+
+def test_image_is_cancelled_when_sending_text_fails(monkeypatch, image_state):
+    monkeypatch.setattr(bot, "_generate_recipe_text", _recipe_text("Омлет с сыром\nВзбейте яйца"))
+    message = FakeMessage("яйца, сыр", reply_error=RuntimeError("сеть недоступна"))
+
+    cancelled, error = _run(message, image_state)
+    assert image_state["started"] and cancelled
+    assert isinstance(error, RuntimeError)
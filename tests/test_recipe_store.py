@@ -0,0 +1,49 @@
+import db
+import recipe_store
+
+
+def setup_module():
+    db.init_db()
+
+
+def test_evicted_candidate_is_skipped():
+    recipe_store.put_recipe("курица, рис, морковь", "похудение", "нет", "Плов с курицей")
+    found = recipe_store.find_recipe("курица, рис, морковь", "похудение", "нет")
+    assert found == ("Плов с курицей", 1.0)
+
+    conn = db.get_connection()
+    (recipe_id,) = conn.execute("SELECT id FROM recipes WHERE recipe=?", ("Плов с курицей",)).fetchone()
+    # Первый кандидат удалён вытеснением после поиска — отдаётся следующий
+    candidates = [(1.0, recipe_id + 1000), (0.9, recipe_id)]
+    assert recipe_store._serve(conn, candidates, set()) == ("Плов с курицей", 0.9)
+    assert recipe_store._serve(conn, candidates[:1], set()) is None
+
+
+def test_recipe_with_allergen_in_text_is_not_served():
+    recipe_store.put_recipe("творог, мед, изюм", "похудение", "арахис", "Сырники: посыпать арахисом перед подачей")
+    assert recipe_store.find_recipe("творог, мед, изюм", "похудение", "арахис") is None
+
+
+def test_recipe_generated_without_user_allergy_is_not_served():
+    recipe_store.put_recipe("гречка, грибы, лук", "похудение", "нет", "Гречка с грибами и луком")
+    assert recipe_store.find_recipe("гречка, грибы, лук", "похудение", "нет") == ("Гречка с грибами и луком", 1.0)
+    # В тексте молока нет, но аллергию при генерации не учитывали
+    assert recipe_store.find_recipe("гречка, грибы, лук", "похудение", "молоко") is None
+
+
+def test_most_similar_recipe_above_threshold_wins():
+    assert recipe_store.jaccard({"a", "b", "c"}, {"b", "c", "d"}) == 0.5
+    assert recipe_store.jaccard(set(), set()) == 0.0
+
+    recipe_store.put_recipe("индейка, булгур, томаты, шпинат, чеснок", "набор массы", "нет", "Булгур с индейкой")
+    recipe_store.put_recipe("индейка, булгур, томаты, шпинат, перец, укроп", "набор массы", "нет", "Булгур с перцем")
+    query = "индейка, булгур, томаты, шпинат, чеснок, перец"
+
+    # Жаккар 5/6 и 5/7: отдаётся самый похожий
+    recipe, similarity = recipe_store.find_recipe(query, "набор массы", "нет", threshold=0.7)
+    assert recipe == "Булгур с индейкой"
+    assert abs(similarity - 5 / 6) < 1e-9
+    # Ниже порога — промах
+    assert recipe_store.find_recipe(query, "набор массы", "нет", threshold=0.9) is None
+    # Другая цель — другой рецепт
+    assert recipe_store.find_recipe(query, "похудение", "нет", threshold=0.7) is None
@@ -0,0 +1,57 @@
+import time
+import asyncio
+import threading
+
+import tiktoken
+
+import llm
+import token_budget
+
+
+def _reset_encoding(monkeypatch):
+    monkeypatch.setattr(token_budget, "_encoding", None)
+    monkeypatch.setattr(token_budget, "_encoding_loaded", False)
+
+
+def test_encoding_is_not_downloaded_without_cache_dir(monkeypatch):
+    _reset_encoding(monkeypatch)
+    monkeypatch.setattr(token_budget, "TIKTOKEN_CACHE_DIR", None)
+
+    def download(name):
+        raise AssertionError(f"{name} must not be downloaded")
+
+    monkeypatch.setattr(tiktoken, "get_encoding", download)
+
+    assert token_budget.load_encoding() is None
+    assert token_budget.count_tokens("Сколько белка в курице?") == token_budget._estimate("Сколько белка в курице?")
+
+
+def test_slow_encoding_load_does_not_block(monkeypatch, tmp_path):
+    _reset_encoding(monkeypatch)
+    monkeypatch.setattr(token_budget, "TIKTOKEN_CACHE_DIR", str(tmp_path))
+    release = threading.Event()
+
+    def hanging_download(name):
+        # Как tiktoken без кэша на сервере без доступа в интернет
+        release.wait(5)
+        raise OSError("network unreachable")
+
+    monkeypatch.setattr(tiktoken, "get_encoding", hanging_download)
+
+    started = time.perf_counter()
+    token_budget.start_loading()
+    text = "Что приготовить из гречки?"
+    assert token_budget.count_tokens(text) == token_budget._estimate(text)
+    assert time.perf_counter() - started < 1
+
+    release.set()
+    while not token_budget._encoding_loaded:
+        time.sleep(0.01)
+    assert token_budget._encoding is None
+
+
+def test_warm_up_skips_encoding_when_disabled(monkeypatch):
+    _reset_encoding(monkeypatch)
+    monkeypatch.setattr(llm, "LLM_WARMUP", False)
+    asyncio.run(llm.warm_up())
+    assert not token_budget._encoding_loaded